@@ -1,5 +1,71 @@
 let socket = null;
 
+// ─── Версия состояния ───────────────────────────────────────────────────────
+// seq растёт с каждым отправленным снимком и передаётся в пингах, чтобы
+// приложение видело, свежий ли у него кэш. epoch меняется при перезапуске
+// Service Worker — после него счётчик начинается заново.
+const stateEpoch = Date.now().toString(36) + Math.random().toString(36).slice(2, 6);
+let stateSeq = 0;
+
+// ─── Идентификатор профиля ──────────────────────────────────────────────────
+// У каждого профиля своё chrome.storage.local, поэтому случайный id, созданный
+// один раз, отличает браузеры и профили друг от друга и переживает переподключения.
+let instanceId = null;
+
+async function getInstanceId() {
+    if (instanceId) return instanceId;
+    const stored = await chrome.storage.local.get('instanceId');
+    instanceId = stored.instanceId;
+    if (!instanceId) {
+        instanceId = crypto.randomUUID();
+        await chrome.storage.local.set({ instanceId });
+    }
+    return instanceId;
+}
+
+function browserName() {
+    const brands = (navigator.userAgentData && navigator.userAgentData.brands) || [];
+    const brand = brands.find(b => !/Chromium|Not/i.test(b.brand));
+    return brand ? brand.brand : 'Chromium';
+}
+
+// ─── Иконки по ссылке ───────────────────────────────────────────────────────
+// В снимок идёт короткий digest вместо favIconUrl (часто это data:image на
+// несколько килобайт). Сами url приложение запрашивает один раз через get_icons.
+const ICON_CACHE_LIMIT = 2000;
+const iconUrlByDigest = new Map();
+const iconDigestByUrl = new Map();   // порядок вставки = порядок использования (LRU)
+
+function iconDigest(url) {
+    if (!url) return '';
+    let digest = iconDigestByUrl.get(url);
+    if (digest) {
+        iconDigestByUrl.delete(url);     // в конец очереди вытеснения
+        iconDigestByUrl.set(url, digest);
+        return digest;
+    }
+    // cyrb53 (53 бита) + длина строки. Коллизия возможна, но приложение
+    // кэширует иконки по digest годами: при 10⁵ разных url её вероятность ~10⁻⁶
+    let h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+    for (let i = 0; i < url.length; i++) {
+        const ch = url.charCodeAt(i);
+        h1 = Math.imul(h1 ^ ch, 2654435761);
+        h2 = Math.imul(h2 ^ ch, 1597334677);
+    }
+    h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+    h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+    const hash = 4294967296 * (2097151 & h2) + (h1 >>> 0);
+    digest = hash.toString(36) + '.' + url.length.toString(36);
+    if (iconDigestByUrl.size >= ICON_CACHE_LIMIT) {
+        const oldest = iconDigestByUrl.keys().next().value;
+        iconUrlByDigest.delete(iconDigestByUrl.get(oldest));
+        iconDigestByUrl.delete(oldest);
+    }
+    iconDigestByUrl.set(url, digest);
+    iconUrlByDigest.set(digest, url);
+    return digest;
+}
+
 // ─── Keep-alive через Alarms API ────────────────────────────────────────────
 // chrome.alarms надёжнее setInterval: Service Worker не засыпает между вызовами.
 chrome.alarms.create('keepAlive', { periodInMinutes: 0.4 }); // каждые ~24 сек
@@ -10,11 +76,21 @@ chrome.alarms.onAlarm.addListener((alarm) => {
             console.log('Alarm: socket closed, reconnecting...');
             connect();
         } else if (socket.readyState === WebSocket.OPEN) {
-            try { socket.send(JSON.stringify({ type: "ping" })); } catch(e) {}
+            sendPing();
         }
     }
 });
 
+// Пинг заодно сообщает, сколько памяти свободно, — для политики выгрузки
+async function sendPing() {
+    const ping = { type: "ping", epoch: stateEpoch, seq: stateSeq };
+    try {
+        const mem = await chrome.system.memory.getInfo();
+        ping.memory = { capacity: mem.capacity, available: mem.availableCapacity };
+    } catch(e) {}
+    try { socket.send(JSON.stringify(ping)); } catch(e) {}
+}
+
 // ─── WebSocket ───────────────────────────────────────────────────────────────
 function connect() {
     // Не создавать новое соединение, если уже есть активное или идёт подключение
@@ -24,9 +100,23 @@ function connect() {
 
     socket = new WebSocket('ws://localhost:8765');
 
-    socket.onopen = () => {
+    socket.onopen = async () => {
         console.log('Connected to Sidebar App');
-        sendTabData();
+        const ws = socket;
+        const instance = await getInstanceId();
+        if (ws !== socket || ws.readyState !== WebSocket.OPEN) return;
+        ws.send(JSON.stringify({
+            type: "hello", instance, browser: browserName(),
+            capabilities: { fields: Object.keys(TAB_FIELDS), windows: ['current', 'all'], events: EVENT_TYPES }
+        }));
+        // Первый снимок — после ответного hello с подпиской. Старое приложение
+        // его не пришлёт: тогда через HELLO_TIMEOUT шлём всё, как раньше
+        setTimeout(() => {
+            if (ws === socket && !ws.subscription) {
+                ws.subscription = makeSubscription({});
+                sendTabData();
+            }
+        }, HELLO_TIMEOUT);
     };
 
     socket.onmessage = (event) => {
@@ -36,6 +126,13 @@ function connect() {
 
             if (cmd.type === 'ping') return;
 
+            if (cmd.type === 'hello') {
+                socket.subscription = makeSubscription(cmd);
+                console.log('Subscription:', cmd);
+                sendTabData();
+                return;
+            }
+
             const tabId = parseInt(cmd.id);
 
             switch (cmd.action) {
@@ -97,6 +194,11 @@ function connect() {
                     break;
                 }
 
+                // ── Автогруппировка: все группы снимка одной командой ──
+                case 'group_multiple':
+                    groupMultiple(cmd.groups || []);
+                    break;
+
                 case 'remove_from_group':
                     chrome.tabs.ungroup(tabId);
                     break;
@@ -107,6 +209,44 @@ function connect() {
                     break;
                 }
 
+                // ── Пакетная выгрузка из памяти ──
+                case 'discard_multiple': {
+                    const ids = (cmd.ids || []).map(id => parseInt(id)).filter(n => !isNaN(n));
+                    Promise.all(ids.map(id => chrome.tabs.discard(id).catch(() => null)));
+                    break;
+                }
+
+                // ── Пакетное перемещение (сортировка) — порядок ids сохраняется ──
+                case 'move_multiple': {
+                    const ids = (cmd.ids || []).map(id => parseInt(id)).filter(n => !isNaN(n));
+                    if (ids.length > 0) chrome.tabs.move(ids, { index: cmd.index ?? -1 });
+                    break;
+                }
+
+                // ── Иконки по digest из снимка ──
+                case 'get_icons': {
+                    // data:image бывают большими — отвечаем пачками до ICON_REPLY_BYTES
+                    let icons = {}, size = 0;
+                    for (const d of cmd.digests || []) {
+                        const url = iconUrlByDigest.get(d);
+                        if (!url) continue;
+                        if (size > 0 && size + url.length > ICON_REPLY_BYTES) {
+                            socket.send(JSON.stringify({ type: "icons", icons }));
+                            icons = {};
+                            size = 0;
+                        }
+                        icons[d] = url;
+                        size += url.length;
+                    }
+                    if (size > 0) socket.send(JSON.stringify({ type: "icons", icons }));
+                    break;
+                }
+
+                // ── Пакет восстановления сессии ──
+                case 'restore_batch':
+                    restoreBatch(cmd);
+                    break;
+
                 case 'request_update':
                     sendTabData();
                     break;
@@ -128,35 +268,213 @@ function connect() {
     };
 }
 
+// ─── Группировка по правилам приложения ─────────────────────────────────────
+// За снимок приходит одна команда: вкладки в существующие группы по groupId,
+// для новых групп — название и цвет. Группа с тем же названием в окне
+// переиспользуется, так что повтор команды не плодит дубликатов.
+async function groupMultiple(groups) {
+    for (const g of groups) {
+        const ids = (g.ids || []).map(id => parseInt(id)).filter(n => !isNaN(n));
+        if (ids.length === 0) continue;
+        try {
+            let groupId = g.groupId;
+            if (groupId == null) {
+                const tab = await chrome.tabs.get(ids[0]);
+                const inWindow = await chrome.tabGroups.query({ windowId: tab.windowId });
+                const same = inWindow.find(x => x.title === g.title);
+                if (same) groupId = same.id;
+            }
+            if (groupId != null) {
+                await chrome.tabs.group({ tabIds: ids, groupId });
+            } else {
+                groupId = await chrome.tabs.group({ tabIds: ids });
+                await chrome.tabGroups.update(groupId, { title: g.title || '', color: g.color || 'grey' });
+            }
+        } catch (e) {
+            console.warn('group_multiple: cannot group', g, e);
+        }
+    }
+}
+
+// ─── Восстановление сессии ───────────────────────────────────────────────────
+// Приложение шлёт вкладки пачками restore_batch и ждёт restore_ack перед
+// следующей. Группы сессии приходят по ключу; ключ → groupId запоминается,
+// чтобы вкладки одной группы из разных пачек попали в одну группу.
+const restoreGroups = new Map();  // `${restore}:${key}` → groupId
+
+async function restoreBatch(cmd) {
+    const byGroup = new Map();
+    let opened = 0;
+    for (const t of cmd.tabs || []) {
+        try {
+            const tab = await chrome.tabs.create({ url: t.url, pinned: !!t.pinned, active: false });
+            opened++;
+            if (t.group != null && !t.pinned) {
+                if (!byGroup.has(t.group)) byGroup.set(t.group, []);
+                byGroup.get(t.group).push(tab.id);
+            }
+            if (cmd.discarded && !t.pinned) discardWhenReady(tab.id);
+        } catch (e) {
+            console.warn('restore: cannot open', t.url, e);
+        }
+    }
+    for (const [key, tabIds] of byGroup) {
+        const mapKey = `${cmd.restore}:${key}`;
+        const existing = restoreGroups.get(mapKey);
+        try {
+            const groupId = await chrome.tabs.group(existing ? { tabIds, groupId: existing } : { tabIds });
+            if (!existing) {
+                restoreGroups.set(mapKey, groupId);
+                const g = (cmd.groups || {})[key] || {};
+                await chrome.tabGroups.update(groupId, { title: g.title || '', color: g.color || 'grey' });
+            }
+        } catch (e) {
+            // Группу успели закрыть — начнём новую со следующей пачки
+            restoreGroups.delete(mapKey);
+            console.warn('restore: cannot group', key, e);
+        }
+    }
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: "restore_ack", restore: cmd.restore, batch: cmd.batch, opened }));
+    }
+}
+
+function discardWhenReady(tabId) {
+    // Выгрузить можно только вкладку, у которой уже есть url
+    const listener = (id, info) => {
+        if (id !== tabId || !(info.url || info.status === 'loading')) return;
+        chrome.tabs.onUpdated.removeListener(listener);
+        chrome.tabs.discard(tabId).catch(() => null);
+    };
+    chrome.tabs.onUpdated.addListener(listener);
+    setTimeout(() => chrome.tabs.onUpdated.removeListener(listener), 10000);
+}
+
+// ─── Подписка приложения ─────────────────────────────────────────────────────
+// В hello расширение перечисляет, что умеет, приложение отвечает своим hello:
+// какие поля вкладок, какие окна и какие события ему нужны. В снимок идут только
+// эти поля, а события, не задевающие ни одного из них, снимка не вызывают.
+const HELLO_TIMEOUT = 1000;  // мс ждать ответный hello от приложения
+
+const TAB_FIELDS = {
+    id:           t => t.id,
+    title:        t => t.title,
+    active:       t => t.active,
+    groupId:      t => t.groupId,
+    icon:         t => iconDigest(t.favIconUrl),
+    url:          t => t.url,
+    pinned:       t => t.pinned,
+    lastAccessed: t => t.lastAccessed,
+    discarded:    t => t.discarded,
+    audible:      t => t.audible
+};
+
+// Ключ changeInfo из tabs.onUpdated → поле снимка. status, mutedInfo и прочее
+// сюда не входят: загрузка страницы сама по себе снимок не шлёт
+const CHANGE_FIELDS = {
+    title: 'title', favIconUrl: 'icon', url: 'url', pinned: 'pinned',
+    discarded: 'discarded', audible: 'audible', groupId: 'groupId'
+};
+
+const EVENT_TYPES = ['created', 'removed', 'activated', 'moved', 'updated', 'groups', 'lifecycle'];
+
+function makeSubscription(msg) {
+    const fields = (msg.fields || Object.keys(TAB_FIELDS)).filter(f => f in TAB_FIELDS);
+    if (!fields.includes('id')) fields.unshift('id');
+    return {
+        fields: new Set(fields),
+        getters: fields.map(f => [f, TAB_FIELDS[f]]),
+        windows: msg.windows === 'all' ? 'all' : 'current',
+        events: new Set(msg.events || EVENT_TYPES)
+    };
+}
+
+function subscribed(event) {
+    return !!(socket && socket.subscription && socket.subscription.events.has(event));
+}
+
 // ─── Отправка состояния вкладок ──────────────────────────────────────────────
+// Большие окна уходят несколькими сообщениями snapshot_part с общими epoch/seq:
+// приложение собирает их по порядку, а ни одно сообщение не упирается в лимит.
+const SNAPSHOT_CHUNK_TABS = 1000;
+const ICON_REPLY_BYTES = 256 * 1024;
+
+let snapshotWindowId = null;  // окно последнего снимка при windows: 'current'
+
 async function sendTabData() {
-    if (!socket || socket.readyState !== WebSocket.OPEN) return;
+    if (!socket || socket.readyState !== WebSocket.OPEN || !socket.subscription) return;
+    const sub = socket.subscription;
     try {
-        const tabs = await chrome.tabs.query({ currentWindow: true, windowType: 'normal' });
+        const query = sub.windows === 'all'
+            ? { windowType: 'normal' }
+            : { currentWindow: true, windowType: 'normal' };
+        const tabs = await chrome.tabs.query(query);
         if (!tabs || tabs.length === 0) return;
 
-        const groups = await chrome.tabGroups.query({});
-
-        const data = {
-            tabs: tabs.map(t => ({
-                id: t.id, title: t.title, active: t.active,
-                groupId: t.groupId, favIcon: t.favIconUrl
-            })),
-            groups: groups.map(g => ({
-                id: g.id, title: g.title, color: g.color
-            }))
-        };
-        socket.send(JSON.stringify(data));
+        // Группы — только окон из снимка, а не всех окон браузера
+        snapshotWindowId = sub.windows === 'all' ? null : tabs[0].windowId;
+        const groups = await chrome.tabGroups.query(
+            snapshotWindowId === null ? {} : { windowId: snapshotWindowId });
+
+        const tabData = tabs.map(t => {
+            const out = {};
+            for (const [name, get] of sub.getters) out[name] = get(t);
+            return out;
+        });
+        const groupData = groups.map(g => ({
+            id: g.id, title: g.title, color: g.color
+        }));
+        const seq = ++stateSeq;
+
+        if (tabData.length <= SNAPSHOT_CHUNK_TABS) {
+            socket.send(JSON.stringify({ tabs: tabData, groups: groupData, epoch: stateEpoch, seq }));
+            return;
+        }
+        const parts = Math.ceil(tabData.length / SNAPSHOT_CHUNK_TABS);
+        for (let part = 0; part < parts; part++) {
+            const start = part * SNAPSHOT_CHUNK_TABS;
+            socket.send(JSON.stringify({
+                type: "snapshot_part", epoch: stateEpoch, seq, part, parts,
+                tabs: tabData.slice(start, start + SNAPSHOT_CHUNK_TABS),
+                groups: part === 0 ? groupData : undefined
+            }));
+        }
     } catch (e) {
         console.error('sendTabData error:', e);
     }
 }
 
 // ─── Слушатели событий вкладок ────────────────────────────────────────────────
-chrome.tabs.onUpdated.addListener(sendTabData);
-chrome.tabs.onRemoved.addListener(sendTabData);
-chrome.tabs.onActivated.addListener(sendTabData);
-chrome.tabs.onMoved.addListener(sendTabData);
-chrome.tabGroups.onUpdated.addListener(sendTabData);
+// Каждое событие шлёт снимок, только если приложение на него подписано
+function inSnapshotWindow(windowId) {
+    return snapshotWindowId === null || windowId === snapshotWindowId;
+}
+
+chrome.tabs.onUpdated.addListener((tabId, changeInfo, tab) => {
+    if (!subscribed('updated') || !inSnapshotWindow(tab.windowId)) return;
+    const fields = socket.subscription.fields;
+    if (Object.keys(changeInfo).some(k => fields.has(CHANGE_FIELDS[k]))) sendTabData();
+});
+chrome.tabs.onCreated.addListener((tab) => {
+    if (subscribed('lifecycle')) socket.send(JSON.stringify({ type: "opened", ids: [tab.id] }));
+    if (subscribed('created')) sendTabData();
+});
+chrome.tabs.onRemoved.addListener((tabId) => {
+    // Снимок покрывает одно окно: без opened/closed приложение не отличит
+    // закрытую вкладку от ушедшей из снимка вместе с окном
+    if (subscribed('lifecycle')) socket.send(JSON.stringify({ type: "closed", ids: [tabId] }));
+    if (subscribed('removed')) sendTabData();
+});
+chrome.tabs.onActivated.addListener(() => { if (subscribed('activated')) sendTabData(); });
+chrome.windows.onFocusChanged.addListener((windowId) => {
+    // Другое окно в фокусе — другой снимок при windows: 'current'
+    if (windowId !== chrome.windows.WINDOW_ID_NONE && !inSnapshotWindow(windowId)
+        && subscribed('activated')) sendTabData();
+});
+chrome.tabs.onMoved.addListener(() => { if (subscribed('moved')) sendTabData(); });
+chrome.tabs.onAttached.addListener(() => { if (subscribed('moved')) sendTabData(); });
+chrome.tabs.onDetached.addListener(() => { if (subscribed('moved')) sendTabData(); });
+chrome.tabGroups.onUpdated.addListener(() => { if (subscribed('groups')) sendTabData(); });
+chrome.tabGroups.onRemoved.addListener(() => { if (subscribed('groups')) sendTabData(); });
 
 connect();
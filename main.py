@@ -6,9 +6,17 @@ import base64
 import queue
 import platform
 import time
+import itertools
+import bisect
+import sqlite3
+import gzip
+import zlib
+import re
+from urllib.parse import urlsplit, parse_qs
+from collections import OrderedDict
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QPushButton,
                              QScrollArea, QHBoxLayout, QMenu, QFrame, QLabel,
-                             QSizePolicy, QSystemTrayIcon)
+                             QSizePolicy, QSystemTrayIcon, QGraphicsOpacityEffect)
 from PyQt6.QtCore import Qt, QPropertyAnimation, QRect, pyqtSignal, QObject, QTimer, QUrl, QSize, QPoint
 from PyQt6.QtGui import QPixmap, QPainter, QPen, QBrush, QPolygon, QColor, QIcon
 from PyQt6.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
@@ -16,6 +24,10 @@ from PyQt6.QtSvg import QSvgRenderer
 from PyQt6 import sip
 import websockets, ctypes, ctypes.wintypes
 import os
+try:
+    import qasync   # необязательно: asyncio прямо на цикле событий Qt
+except ImportError:
+    qasync = None
 
 # ─── Цвета групп Chrome ───────────────────────────────────────────────────────
 CHROME_COLORS = {
@@ -25,20 +37,98 @@ CHROME_COLORS = {
 }
 
 network_manager = None
-icon_cache = {}
-
-# Thread-safe очередь команд Qt → asyncio
+icon_cache = OrderedDict()   # {digest иконки: QPixmap 16×16}, LRU до ICON_CACHE_LIMIT
+
+# Режим подписки: расширение само присылает снимки с номером версии (seq) и
+# heartbeat-пинги с текущей версией. При наведении показываем кэш, а resync
+# запрашиваем только если состояние устарело или обнаружен пропуск версии.
+PUSH_SUBSCRIPTION   = True
+STATE_STALE_TIMEOUT = 60.0   # сек без сообщений от расширения (keepAlive ~24 сек)
+RESYNC_MIN_INTERVAL = 1.0    # не чаще одного resync в секунду
+
+# Несколько браузеров/профилей: у каждого своя секция в панели
+SHOW_CLIENT_SECTIONS = True  # заголовки секций, когда подключено больше одного
+CLIENT_GRACE_PERIOD  = 30.0  # сек держим секцию отключившегося расширения
+
+# Планировщик отрисовки
+UI_FRAME_BUDGET  = 0.004   # сек работы отрисовки за один тик цикла событий; примерно
+                            # столько же Qt затем тратит на раскладку новых строк — вместе ≤ кадра
+UI_MIN_DELAY     = 16      # мс — одиночный снимок рисуется почти сразу
+UI_MAX_DELAY     = 400     # мс — дольше не копим, даже если отрисовка дорогая
+UI_COST_FACTOR   = 2.0     # задержка ≥ цена прохода × 2: на отрисовку ≤ 1/3 времени
+UI_HOVER_RECHECK = 300     # мс — перепроверка, пока курсор над панелью
+ROW_BLOCK_SIZE   = 64      # строк в блоке секции: вставка перекладывает один блок
+
+# Оптимистичный UI: activate/close/group/pin сразу меняют панель, а следующий
+# снимок расширения подтверждает изменение или откатывает его по таймауту
+OPTIMISTIC_UI      = True
+OPTIMISTIC_TIMEOUT = 2.0     # сек ждать подтверждения до отката
+
+# Выгрузка вкладок из памяти (chrome.tabs.discard) по LRU
+DISCARD_AUTO            = False   # периодически применять политику сама
+DISCARD_DRY_RUN         = False   # только печатать отчёт, ничего не выгружать
+DISCARD_INTERVAL        = 60.0    # сек между проверками
+DISCARD_MAX_LOADED      = 40      # держать загруженными не больше N вкладок
+DISCARD_MIN_IDLE        = 1800.0  # выгружать только простаивающие дольше, сек
+DISCARD_MEMORY_PRESSURE = 0.15    # доля свободной памяти, ниже — «давление»
+DISCARD_PRESSURE_IDLE   = 300.0   # порог простоя при давлении, сек
+DISCARD_EXEMPT_PINNED   = True
+DISCARD_EXEMPT_GROUPED  = False
+DISCARD_EXEMPT_AUDIBLE  = True
+
+# История и сессии
+APP_DATA_DIR = os.path.join(os.environ.get("APPDATA") or os.path.expanduser("~"), "ChromeTabsManager")
+
+# Цикл событий: "qasync" — asyncio работает на цикле Qt (нужен пакет qasync),
+# "thread" — отдельный поток с asyncio, "auto" — qasync, если установлен
+EVENT_LOOP_MODE = os.environ.get("TABS_EVENT_LOOP", "auto")
+
+# Команды Qt → asyncio, отправленные до запуска сервера
 command_queue = queue.Queue()
+ws_loop       = None    # цикл asyncio сервера, когда он запущен
+loop_is_qt    = False   # asyncio крутится в потоке Qt (qasync)
+loop_lock     = threading.Lock()   # ws_loop публикуется и очередь разбирается под ним
 
 
 class CommSignal(QObject):
-    data_received = pyqtSignal(dict)
+    data_received = pyqtSignal(str, dict)       # (client_key, снимок)
+    heartbeat_received = pyqtSignal(str, dict)  # (client_key, пинг)
+    client_connected = pyqtSignal(str, dict)    # (client_key, hello)
+    client_disconnected = pyqtSignal(str)
+    icons_received = pyqtSignal(str, dict)      # (client_key, {digest: url})
+    restore_ack = pyqtSignal(str, dict)         # (client_key, {restore, batch})
+    tab_lifecycle = pyqtSignal(str, str, list)  # (client_key, "opened"/"closed", [tab_id])
     send_command = pyqtSignal(str)
 
 
 signals = CommSignal()
 
 
+def send_command(client, action, **fields):
+    """Ставит команду в очередь; client — ключ расширения-владельца или None."""
+    payload = {"action": action, **fields}
+    if client is not None:
+        payload["client"] = client
+    post_command(json.dumps(payload))
+
+
+def post_command(cmd):
+    """Передаёт команду серверу без опроса: напрямую или через call_soon_threadsafe."""
+    with loop_lock:
+        if ws_loop is None:
+            command_queue.put(cmd)  # разберёт main_async при старте
+            return
+    call_in_loop(dispatch_command, cmd)
+
+
+def call_in_loop(fn, *args):
+    """Выполняет fn в цикле сервера: сразу, если он крутится в потоке Qt."""
+    if loop_is_qt:
+        fn(*args)
+    else:
+        ws_loop.call_soon_threadsafe(fn, *args)
+
+
 # ─── Кастомная кнопка закрытия ────────────────────────────────────────────────
 class CloseButton(QPushButton):
     """Кнопка с нарисованным X и круговым hover-эффектом в стиле Chrome."""
@@ -106,15 +196,167 @@ class CloseButton(QPushButton):
         painter.end()
 
 
+# ─── Иконки вкладок ──────────────────────────────────────────────────────────
+ICON_RETRY_INTERVAL = 30.0  # сек до повторного запроса иконки, которую не прислали
+ICON_MAX_RETRIES    = 3     # повторов, после которых остаётся иконка по умолчанию
+ICON_CACHE_LIMIT    = 1000  # готовых QPixmap в icon_cache
+
+
+def pixmap_from_bytes(data):
+    """Декодирует PNG/ICO/SVG в QPixmap 16×16; None, если не вышло."""
+    pixmap = QPixmap()
+    if b"<svg" in bytes(data[:200]).lower():
+        try:
+            renderer = QSvgRenderer(data)
+            if not renderer.isValid():
+                return None
+            pixmap = QPixmap(16, 16)
+            pixmap.fill(Qt.GlobalColor.transparent)
+            p = QPainter(pixmap)
+            renderer.render(p)
+            p.end()
+        except:
+            return None
+    else:
+        pixmap.loadFromData(data)
+    if pixmap.isNull():
+        return None
+    return pixmap.scaled(
+        16, 16,
+        Qt.AspectRatioMode.KeepAspectRatio,
+        Qt.TransformationMode.SmoothTransformation
+    )
+
+
+def cached_icon(digest):
+    """QPixmap из icon_cache (заодно отмечает, что иконкой пользовались) или None.
+
+    Пустой QPixmap — иконку уже не удалось получить: нужна иконка по умолчанию.
+    """
+    pixmap = icon_cache.get(digest)
+    if pixmap is not None:
+        icon_cache.move_to_end(digest)
+    return pixmap
+
+
+class IconStore:
+    """Иконки по ссылке: в снимках только короткий digest, а сам favIconUrl
+    (часто многокилобайтный data:image) запрашивается у расширения один раз
+    сообщением get_icons и кэшируется в icon_cache уже готовым QPixmap.
+
+    Ответ может потеряться (расширение перезапустилось или уже забыло этот
+    digest) — retry_timer повторяет запрос до ICON_MAX_RETRIES раз и убирает
+    записи, которые больше никому не нужны. Неудача тоже кэшируется (пустой
+    QPixmap), чтобы битую иконку не запрашивали при каждой перерисовке.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock     = clock   # источник monotonic() — тесты подставляют свой
+        self.waiting   = {}   # {digest: [TabWidget]} — ждут иконку
+        self.requested = {}   # {digest: [monotonic() запроса, число повторов]}
+        self.batch     = {}   # {client_key: set(digest)} — ещё не отправлено
+        self.flush_timer = QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(20)   # собираем запросы всего снимка в один
+        self.flush_timer.timeout.connect(self.flush)
+        self.retry_timer = QTimer()
+        self.retry_timer.setInterval(int(ICON_RETRY_INTERVAL * 1000))
+        self.retry_timer.timeout.connect(self.retry)
+        signals.icons_received.connect(self.on_icons)
+
+    def request(self, client_key, digest, widget):
+        alive = [w for w in self.waiting.get(digest, []) if not sip.isdeleted(w)]
+        alive.append(widget)
+        self.waiting[digest] = alive
+        if digest in self.requested:
+            return                    # уже запрошена; без ответа повторит retry
+        self.requested[digest] = [self.clock(), 0]
+        self._enqueue(client_key, digest)
+
+    def _enqueue(self, client_key, digest):
+        self.batch.setdefault(client_key, set()).add(digest)
+        self.flush_timer.start()
+        if not self.retry_timer.isActive():
+            self.retry_timer.start()
+
+    def retry(self):
+        now = self.clock()
+        for digest, entry in list(self.requested.items()):
+            if now - entry[0] < ICON_RETRY_INTERVAL:
+                continue
+            alive = [w for w in self.waiting.get(digest, [])
+                     if not sip.isdeleted(w) and w.icon_key == digest]
+            if not alive:
+                del self.requested[digest]    # ждать некому
+                self.waiting.pop(digest, None)
+                continue
+            if entry[1] >= ICON_MAX_RETRIES:
+                self._deliver(digest, None)   # так и не ответило — иконка по умолчанию
+                continue
+            self.waiting[digest] = alive
+            entry[0]  = now
+            entry[1] += 1
+            self._enqueue(alive[-1].client_key, digest)
+        if not self.requested:
+            self.retry_timer.stop()
+
+    def flush(self):
+        for client_key, digests in self.batch.items():
+            send_command(client_key, "get_icons", digests=sorted(digests))
+        self.batch.clear()
+
+    def on_icons(self, client_key, icons):
+        for digest, url in icons.items():
+            pixmap = cached_icon(digest)
+            if pixmap is not None:
+                self._deliver(digest, pixmap)   # ответ на повтор уже полученной
+                continue
+            if url.startswith('data:image'):
+                try:
+                    _header, encoded = url.split(",", 1)
+                    self._deliver(digest, pixmap_from_bytes(base64.b64decode(encoded)))
+                except:
+                    self._deliver(digest, None)
+            elif url.startswith('http'):
+                request = QNetworkRequest(QUrl(url))
+                request.setHeader(QNetworkRequest.KnownHeaders.UserAgentHeader, "Mozilla/5.0")
+                request.setAttribute(QNetworkRequest.Attribute.Http2AllowedAttribute, False)
+                reply = network_manager.get(request)
+                reply.finished.connect(lambda reply=reply, digest=digest: self.on_icon_loaded(reply, digest))
+            else:
+                self._deliver(digest, None)
+
+    def on_icon_loaded(self, reply, digest):
+        if reply.error() == QNetworkReply.NetworkError.NoError:
+            self._deliver(digest, pixmap_from_bytes(reply.readAll()))
+        else:
+            self._deliver(digest, None)
+        reply.deleteLater()
+
+    def _deliver(self, digest, pixmap):
+        self.requested.pop(digest, None)
+        widgets = self.waiting.pop(digest, [])
+        icon_cache[digest] = pixmap if pixmap is not None else QPixmap()
+        while len(icon_cache) > ICON_CACHE_LIMIT:
+            icon_cache.popitem(last=False)    # виджеты держат свою копию QPixmap
+        if pixmap is None or pixmap.isNull():
+            return   # у виджетов уже стоит иконка по умолчанию
+        for w in widgets:
+            if not sip.isdeleted(w) and not sip.isdeleted(w.icon_label) and w.icon_key == digest:
+                w.icon_label.setPixmap(pixmap)
+
+
 # ─── Виджет одной вкладки ────────────────────────────────────────────────────
 class TabWidget(QWidget):
-    def __init__(self, tab_data, sidebar_app):
+    def __init__(self, tab_data, sidebar_app, client_key=None):
         super().__init__()
         self.sidebar_app = sidebar_app
+        self.client_key = client_key      # расширение-владелец вкладки
         self.tab_id = None
-        self.fav_icon_url = None
+        self.icon_key = None              # digest иконки из снимка
         self.is_active = None
         self.is_selected = False          # ← Новое: состояние выделения
+        self.is_discarded = False         # выгружена из памяти Chrome
 
         self.main_layout = QHBoxLayout(self)
         self.main_layout.setContentsMargins(0, 1, 4, 1)
@@ -141,7 +383,7 @@ class TabWidget(QWidget):
         self.set_initial_icon()
 
         # Заголовок
-        self.title_label = QLabel(tab_data['title'][:40] or "Новая вкладка")
+        self.title_label = QLabel(tab_data.title[:40] or "Новая вкладка")
         self.title_label.setStyleSheet("color: #e8eaed; font-size: 11px; background: transparent;")
         self.title_label.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
 
@@ -181,6 +423,21 @@ class TabWidget(QWidget):
             QFrame#tabBaseFrame:hover {{ background-color: {hover_bg}; }}
         """)
 
+    def _update_discarded_style(self):
+        """Выгруженная вкладка — приглушённый курсивный заголовок и бледная иконка."""
+        if self.is_discarded:
+            self.title_label.setStyleSheet(
+                "color: #80868b; font-size: 11px; font-style: italic; background: transparent;"
+            )
+            effect = QGraphicsOpacityEffect(self.icon_label)
+            effect.setOpacity(0.45)
+            self.icon_label.setGraphicsEffect(effect)
+        else:
+            self.title_label.setStyleSheet(
+                "color: #e8eaed; font-size: 11px; background: transparent;"
+            )
+            self.icon_label.setGraphicsEffect(None)
+
     def set_selected(self, selected: bool):
         """Публичный метод — устанавливает/снимает выделение."""
         if self.is_selected != selected:
@@ -190,12 +447,12 @@ class TabWidget(QWidget):
     # ── Обновление данных ────────────────────────────────────────────────────
     def update_data(self, tab_data):
         """Обновляет содержимое виджета без его пересоздания."""
-        new_active = tab_data['active']
-        new_title  = tab_data['title'][:40] or "Новая вкладка"
-        new_icon   = tab_data.get('favIcon', '')
+        new_active = tab_data.active
+        new_title  = tab_data.title[:40] or "Новая вкладка"
+        new_icon   = tab_data.icon
 
-        if self.tab_id != tab_data['id']:
-            self.tab_id = tab_data['id']
+        if self.tab_id != tab_data.id:
+            self.tab_id = tab_data.id
 
         if self.is_active != new_active:
             self.is_active = new_active
@@ -204,8 +461,12 @@ class TabWidget(QWidget):
         if self.title_label.text() != new_title:
             self.title_label.setText(new_title)
 
-        if self.fav_icon_url != new_icon:
-            self.fav_icon_url = new_icon
+        if self.is_discarded != tab_data.discarded:
+            self.is_discarded = tab_data.discarded
+            self._update_discarded_style()
+
+        if self.icon_key != new_icon:
+            self.icon_key = new_icon
             self.set_initial_icon()
 
     # ── Клик по вкладке ──────────────────────────────────────────────────────
@@ -216,39 +477,45 @@ class TabWidget(QWidget):
             if modifiers & Qt.KeyboardModifier.ControlModifier:
                 # Ctrl+Click — переключить выделение без активации вкладки
                 if self.sidebar_app:
-                    self.sidebar_app.toggle_tab_selection(self.tab_id)
+                    self.sidebar_app.toggle_tab_selection(self.client_key, self.tab_id)
 
             elif modifiers & Qt.KeyboardModifier.ShiftModifier:
                 # Shift+Click — выделить диапазон от последнего кликнутого
                 if self.sidebar_app:
-                    self.sidebar_app.range_select_tabs(self.tab_id)
+                    self.sidebar_app.range_select_tabs(self.client_key, self.tab_id)
 
             else:
                 # Обычный клик: сбросить выделение и активировать вкладку
                 if self.sidebar_app:
                     self.sidebar_app.clear_selection()
+                    self.sidebar_app.selection_client = self.client_key
                     self.sidebar_app.last_clicked_tab_id = self.tab_id
-                cmd = json.dumps({"action": "activate", "id": self.tab_id})
                 print(f"Sending activate for tab {self.tab_id}")
-                command_queue.put(cmd)
+                send_command(self.client_key, "activate", id=self.tab_id)
                 if self.sidebar_app:
-                    self.sidebar_app.force_update = True
                     self.sidebar_app.scroll_to_active_tab = True
-                    QTimer.singleShot(30, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                self._optimistic('activate', [self.tab_id])
+
+    def _optimistic(self, kind, ids, value=None, delay=30):
+        """Сразу показывает результат команды; снимок потом подтвердит или откатит."""
+        if not self.sidebar_app:
+            return
+        self.sidebar_app.apply_optimistic(self.client_key, kind, ids, value)
+        if not OPTIMISTIC_UI:
+            self.sidebar_app.force_update = True
+            self._request_update_later(delay)
+
+    def _request_update_later(self, delay):
+        client = self.client_key
+        QTimer.singleShot(delay, lambda: send_command(client, "request_update"))
 
     # ── Закрытие вкладки ─────────────────────────────────────────────────────
     def on_close_click(self):
         tid = self.tab_id
-        cmd = json.dumps({"action": "close", "id": tid})
         print(f"Sending close for tab {tid}")
-        command_queue.put(cmd)
-        if self.sidebar_app:
-            # Сохраняем время отправки — если вкладка не исчезнет за 600 мс, повторим
-            self.sidebar_app.pending_closes[tid] = time.time()
-            self.sidebar_app.force_update = True
-            QTimer.singleShot(30, lambda: command_queue.put(
-                json.dumps({"action": "request_update"})))
+        send_command(self.client_key, "close", id=tid)
+        # Если вкладка не исчезнет за OPTIMISTIC_TIMEOUT — команда будет повторена
+        self._optimistic('close', [tid])
 
     # ── Контекстное меню ─────────────────────────────────────────────────────
     def show_context_menu(self, position):
@@ -275,7 +542,8 @@ class TabWidget(QWidget):
         menu.setStyleSheet(menu_style)
 
         selected  = self.sidebar_app.selected_tab_ids if self.sidebar_app else set()
-        is_multi  = len(selected) > 1 and self.tab_id in selected
+        is_multi  = (len(selected) > 1 and self.tab_id in selected
+                     and self.sidebar_app.selection_client == self.client_key)
 
         groups_actions = {}
 
@@ -290,9 +558,9 @@ class TabWidget(QWidget):
 
             if hasattr(self, 'available_groups') and self.available_groups:
                 for group in self.available_groups:
-                    group_title = group.get('title') or f"Группа {group['id']}"
+                    group_title = group.title or f"Группа {group.id}"
                     act = add_to_group_menu.addAction(f"📁 {group_title}")
-                    groups_actions[act] = group['id']
+                    groups_actions[act] = group.id
 
             new_group_action  = add_to_group_menu.addAction("➕ Создать новую группу")
             remove_from_group = menu.addAction("Убрать из группы")
@@ -301,43 +569,31 @@ class TabWidget(QWidget):
 
             if chosen == close_sel:
                 ids = list(self.sidebar_app.selected_tab_ids)
-                command_queue.put(json.dumps({"action": "close_multiple", "ids": ids}))
-                if self.sidebar_app:
-                    self.sidebar_app.clear_selection()
-                    self.sidebar_app.force_update = True
-                    QTimer.singleShot(80, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                send_command(self.client_key, "close_multiple", ids=ids)
+                self.sidebar_app.clear_selection()
+                self._optimistic('close', ids, delay=80)
 
             elif chosen == new_group_action:
                 ids = list(self.sidebar_app.selected_tab_ids)
-                command_queue.put(json.dumps({"action": "add_multiple_to_new_group", "ids": ids}))
+                send_command(self.client_key, "add_multiple_to_new_group", ids=ids)
                 if self.sidebar_app:
                     self.sidebar_app.clear_selection()
                     self.sidebar_app.force_update = True
-                    QTimer.singleShot(100, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                    self._request_update_later(100)
 
             elif chosen in groups_actions:
                 group_id = groups_actions[chosen]
                 ids = list(self.sidebar_app.selected_tab_ids)
-                command_queue.put(json.dumps({
-                    "action": "add_multiple_to_group", "ids": ids, "groupId": group_id
-                }))
-                if self.sidebar_app:
-                    self.sidebar_app.clear_selection()
-                    self.sidebar_app.force_update = True
-                    self.sidebar_app.scroll_to_group_id = group_id
-                    QTimer.singleShot(80, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                send_command(self.client_key, "add_multiple_to_group", ids=ids, groupId=group_id)
+                self.sidebar_app.clear_selection()
+                self.sidebar_app.scroll_to_group = (self.client_key, group_id)
+                self._optimistic('group', ids, group_id, delay=80)
 
             elif chosen == remove_from_group:
                 ids = list(self.sidebar_app.selected_tab_ids)
-                command_queue.put(json.dumps({"action": "remove_multiple_from_group", "ids": ids}))
-                if self.sidebar_app:
-                    self.sidebar_app.clear_selection()
-                    self.sidebar_app.force_update = True
-                    QTimer.singleShot(50, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                send_command(self.client_key, "remove_multiple_from_group", ids=ids)
+                self.sidebar_app.clear_selection()
+                self._optimistic('group', ids, -1, delay=50)
 
         else:
             # ── Меню для одной вкладки (оригинал) ───────────────────────────
@@ -350,81 +606,140 @@ class TabWidget(QWidget):
 
             if hasattr(self, 'available_groups') and self.available_groups:
                 for group in self.available_groups:
-                    group_title = group.get('title') or f"Группа {group['id']}"
+                    group_title = group.title or f"Группа {group.id}"
                     act = add_to_group_menu.addAction(f"📁 {group_title}")
-                    groups_actions[act] = group['id']
+                    groups_actions[act] = group.id
 
             new_group_action  = add_to_group_menu.addAction("➕ Создать новую группу")
             remove_from_group = menu.addAction("Убрать из группы")
             menu.addSeparator()
             others = menu.addAction("Закрыть другие")
+            bulk_actions = self._add_bulk_menu(menu, menu_style)
+            bulk_actions.update(self._add_session_menu(menu, menu_style))
 
             chosen = menu.exec(self.base_frame.mapToGlobal(position))
 
-            if chosen == dup:
-                command_queue.put(json.dumps({"action": "duplicate", "id": self.tab_id}))
+            if chosen in bulk_actions:
+                bulk_actions[chosen]()
                 if self.sidebar_app:
                     self.sidebar_app.force_update = True
-                    QTimer.singleShot(80, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
-            elif chosen == pin:
-                command_queue.put(json.dumps({"action": "toggle_pin", "id": self.tab_id}))
+                    self._request_update_later(100)
+
+            if chosen == dup:
+                send_command(self.client_key, "duplicate", id=self.tab_id)
                 if self.sidebar_app:
                     self.sidebar_app.force_update = True
-                    QTimer.singleShot(30, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                    self._request_update_later(80)
+            elif chosen == pin:
+                send_command(self.client_key, "toggle_pin", id=self.tab_id)
+                self._optimistic('pin', [self.tab_id])
             elif chosen == others:
-                command_queue.put(json.dumps({"action": "close_others", "id": self.tab_id}))
+                send_command(self.client_key, "close_others", id=self.tab_id)
                 if self.sidebar_app:
                     self.sidebar_app.force_update = True
-                    QTimer.singleShot(50, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                    self._request_update_later(50)
             elif chosen == remove_from_group:
-                command_queue.put(json.dumps({"action": "remove_from_group", "id": self.tab_id}))
-                if self.sidebar_app:
-                    self.sidebar_app.force_update = True
-                    QTimer.singleShot(30, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                send_command(self.client_key, "remove_from_group", id=self.tab_id)
+                self._optimistic('group', [self.tab_id], -1)
             elif chosen == new_group_action:
-                command_queue.put(json.dumps({"action": "add_to_new_group", "id": self.tab_id}))
+                send_command(self.client_key, "add_to_new_group", id=self.tab_id)
                 if self.sidebar_app:
                     self.sidebar_app.force_update = True
-                    QTimer.singleShot(100, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                    self._request_update_later(100)
             elif chosen in groups_actions:
                 group_id = groups_actions[chosen]
-                command_queue.put(json.dumps({
-                    "action": "add_to_group", "id": self.tab_id, "groupId": group_id
-                }))
+                send_command(self.client_key, "add_to_group", id=self.tab_id, groupId=group_id)
                 if self.sidebar_app:
-                    self.sidebar_app.force_update = True
-                    self.sidebar_app.scroll_to_group_id = group_id
-                    QTimer.singleShot(50, lambda: command_queue.put(
-                        json.dumps({"action": "request_update"})))
+                    self.sidebar_app.scroll_to_group = (self.client_key, group_id)
+                self._optimistic('group', [self.tab_id], group_id, delay=50)
+
+    def _add_bulk_menu(self, menu, menu_style):
+        """Подменю массовых операций; возвращает {action: callable}."""
+        client = self.sidebar_app.clients.get(self.client_key) if self.sidebar_app else None
+        if not client:
+            return {}
+        ops     = BulkOperations(client)
+        actions = {}
+        bulk    = menu.addMenu("Очистка")
+        bulk.setStyleSheet(menu_style)
+
+        dups = ops.duplicates()
+        act  = bulk.addAction(f"Закрыть дубликаты  ({len(dups)})")
+        act.setEnabled(bool(dups))
+        actions[act] = lambda: ops.close(dups)
+
+        domain = url_domain(client.index.urls.get(self.tab_id, ''))
+        if domain:
+            same = ops.from_domain(domain)
+            act  = bulk.addAction(f"Закрыть все с {domain}  ({len(same)})")
+            actions[act] = lambda: ops.close(same)
+
+        bulk.addSeparator()
+        for title, seconds in (("1 часа", 3600), ("1 дня", 86400), ("7 дней", 7 * 86400)):
+            old = ops.older_than(seconds)
+            act = bulk.addAction(f"Закрыть не открывавшиеся дольше {title}  ({len(old)})")
+            act.setEnabled(bool(old))
+            actions[act] = lambda old=old: ops.close(old)
+
+        policy = self.sidebar_app.discard_policy
+        plan   = policy.plan(client)
+        dry    = "  — только отчёт" if DISCARD_DRY_RUN else ""
+        act    = bulk.addAction(f"Выгрузить из памяти по политике  ({len(plan)}){dry}")
+        act.setEnabled(bool(plan))
+        actions[act] = lambda: policy.run(client, plan)
+
+        bulk.addSeparator()
+        order = ops.sorted_by_domain()
+        act   = bulk.addAction("Сортировать по домену")
+        act.setEnabled(bool(order))
+        actions[act] = lambda: ops.move_to_end(order)
+        return actions
+
+    def _add_session_menu(self, menu, menu_style):
+        """Подменю сохранения и восстановления окна; возвращает {action: callable}."""
+        app    = self.sidebar_app
+        client = app.clients.get(self.client_key) if app else None
+        if not client:
+            return {}
+        actions = {}
+        session = menu.addMenu("Сессия")
+        session.setStyleSheet(menu_style)
+
+        act = session.addAction(f"Сохранить окно  ({len(client.store)})")
+        actions[act] = lambda: app.save_window_session(self.client_key)
+
+        paths = list_sessions()[:SESSION_MENU_LIMIT]
+        for title, discarded in (("Открыть сессию", False), ("Открыть сессию выгруженной", True)):
+            sub = session.addMenu(title)
+            sub.setStyleSheet(menu_style)
+            sub.setEnabled(bool(paths))
+            for path in paths:
+                name = os.path.basename(path)[:-len(".json.gz")]
+                act  = sub.addAction(name)
+                actions[act] = lambda path=path, discarded=discarded: app.restore_session(
+                    self.client_key, path, discarded)
+
+        if app.restores:
+            progress = ", ".join(r.progress() for r in app.restores.values())
+            act = session.addAction(f"Остановить восстановление  ({progress})")
+            actions[act] = app.cancel_restores
+        return actions
 
     # ── Иконки ───────────────────────────────────────────────────────────────
     def set_initial_icon(self):
-        if not self.fav_icon_url:
+        if not self.icon_key:
             self.set_default_icon()
             return
-        if self.fav_icon_url in icon_cache:
-            self.icon_label.setPixmap(icon_cache[self.fav_icon_url])
+        pixmap = cached_icon(self.icon_key)
+        if pixmap is not None:
+            if pixmap.isNull():
+                self.set_default_icon()       # иконку получить не удалось
+            else:
+                self.icon_label.setPixmap(pixmap)
             return
-        if self.fav_icon_url.startswith('data:image'):
-            try:
-                _header, encoded = self.fav_icon_url.split(",", 1)
-                data = base64.b64decode(encoded)
-                self.process_image_data(data, self.fav_icon_url)
-            except:
-                self.set_default_icon()
-        elif self.fav_icon_url.startswith('http'):
-            request = QNetworkRequest(QUrl(self.fav_icon_url))
-            request.setHeader(QNetworkRequest.KnownHeaders.UserAgentHeader, "Mozilla/5.0")
-            request.setAttribute(QNetworkRequest.Attribute.Http2AllowedAttribute, False)
-            reply = network_manager.get(request)
-            reply.finished.connect(lambda: self.on_icon_loaded(reply, self.fav_icon_url))
-        else:
-            self.set_default_icon()
+        self.set_default_icon()
+        if self.sidebar_app:
+            self.sidebar_app.icons.request(self.client_key, self.icon_key, self)
 
     def set_default_icon(self):
         if sip.isdeleted(self) or sip.isdeleted(self.icon_label):
@@ -444,51 +759,13 @@ class TabWidget(QWidget):
         painter.end()
         self.icon_label.setPixmap(pixmap)
 
-    def on_icon_loaded(self, reply, url):
-        if sip.isdeleted(self) or sip.isdeleted(self.icon_label):
-            return
-        if reply.error() == QNetworkReply.NetworkError.NoError:
-            self.process_image_data(reply.readAll(), url)
-        else:
-            self.set_default_icon()
-        reply.deleteLater()
-
-    def process_image_data(self, data, url):
-        if sip.isdeleted(self) or sip.isdeleted(self.icon_label):
-            return
-        pixmap = QPixmap()
-        if b"<svg" in bytes(data[:200]).lower():
-            try:
-                renderer = QSvgRenderer(data)
-                if renderer.isValid():
-                    pixmap = QPixmap(16, 16)
-                    pixmap.fill(Qt.GlobalColor.transparent)
-                    p = QPainter(pixmap)
-                    renderer.render(p)
-                    p.end()
-            except:
-                self.set_default_icon()
-                return
-        else:
-            pixmap.loadFromData(data)
-        if not pixmap.isNull():
-            scaled = pixmap.scaled(
-                16, 16,
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            icon_cache[url] = scaled
-            if not sip.isdeleted(self) and not sip.isdeleted(self.icon_label):
-                self.icon_label.setPixmap(scaled)
-        else:
-            self.set_default_icon()
-
 
 # ─── Виджет группы вкладок ───────────────────────────────────────────────────
 class GroupWidget(QWidget):
-    def __init__(self, group_data, sidebar_app, is_expanded=True):
+    def __init__(self, group_data, sidebar_app, is_expanded=True, client_key=None):
         super().__init__()
         self.sidebar_app = sidebar_app
+        self.client_key = client_key
         self.group_id = None
         self.color = None
 
@@ -496,7 +773,7 @@ class GroupWidget(QWidget):
         self.main_layout.setContentsMargins(0, 4, 0, 4)
         self.main_layout.setSpacing(2)
 
-        self.header = QPushButton(group_data['title'] or "Группа")
+        self.header = QPushButton(group_data.title or "Группа")
         self.header.setCursor(Qt.CursorShape.PointingHandCursor)
         self.header.clicked.connect(self.toggle_collapse)
 
@@ -513,10 +790,10 @@ class GroupWidget(QWidget):
         self.update_data(group_data, is_expanded)
 
     def update_data(self, group_data, is_expanded):
-        new_color = CHROME_COLORS.get(group_data['color'], "#5f6368")
-        new_title = group_data['title'] or "Группа"
+        new_color = CHROME_COLORS.get(group_data.color, "#5f6368")
+        new_title = group_data.title or "Группа"
 
-        self.group_id = group_data['id']
+        self.group_id = group_data.id
         if self.color != new_color or self.header.text() != new_title:
             self.color = new_color
             self.header.setText(new_title)
@@ -545,43 +822,1285 @@ class GroupWidget(QWidget):
         self.is_expanded = not self.is_expanded
         self.tabs_container.setVisible(self.is_expanded)
         if hasattr(self, 'sidebar_app') and self.sidebar_app:
-            self.sidebar_app.group_states[self.group_id] = self.is_expanded
+            client = self.sidebar_app.clients.get(self.client_key)
+            if client:
+                client.group_states[self.group_id] = self.is_expanded
 
     def add_tab(self, tab_w):
         self.tabs_layout.addWidget(tab_w)
 
 
+# ─── Хранилище вкладок ────────────────────────────────────────────────────────
+class TabRecord:
+    """Вкладка из снимка.
+
+    __slots__ и интернированные строки вместо dict из JSON: на тысячах вкладок
+    это в разы меньше памяти, а повторяющиеся url и digest иконок хранятся
+    в одном экземпляре.
+    """
+    __slots__ = ('id', 'title', 'url', 'icon', 'group_id', 'active',
+                 'pinned', 'discarded', 'audible', 'last_accessed')
+
+    def __init__(self, t):
+        self.id            = t['id']
+        self.title         = sys.intern(t.get('title') or '')
+        self.url           = sys.intern(t.get('url') or '')
+        self.icon          = sys.intern(t.get('icon') or '')
+        self.group_id      = t.get('groupId', -1)
+        self.active        = bool(t.get('active'))
+        self.pinned        = bool(t.get('pinned'))
+        self.discarded     = bool(t.get('discarded'))
+        self.audible       = bool(t.get('audible'))
+        self.last_accessed = t.get('lastAccessed') or 0
+
+    def replace(self, **changes):
+        """Копия с изменёнными полями — для оптимистичного представления."""
+        rec = TabRecord.__new__(TabRecord)
+        for name in self.__slots__:
+            setattr(rec, name, changes.get(name, getattr(self, name)))
+        return rec
+
+    def same_as(self, t):
+        """Совпадает ли с dict из нового снимка — без создания записи."""
+        return (self.title == (t.get('title') or '')
+                and self.url == (t.get('url') or '')
+                and self.icon == (t.get('icon') or '')
+                and self.group_id == t.get('groupId', -1)
+                and self.active == bool(t.get('active'))
+                and self.pinned == bool(t.get('pinned'))
+                and self.discarded == bool(t.get('discarded'))
+                and self.audible == bool(t.get('audible'))
+                and self.last_accessed == (t.get('lastAccessed') or 0))
+
+
+class GroupRecord:
+    __slots__ = ('id', 'title', 'color')
+
+    def __init__(self, g):
+        self.id    = g['id']
+        self.title = sys.intern(g.get('title') or '')
+        self.color = sys.intern(g.get('color') or '')
+
+    def same_as(self, g):
+        return self.title == (g.get('title') or '') and self.color == (g.get('color') or '')
+
+
+class SnapshotDiff:
+    """Чем новый снимок отличается от предыдущего."""
+    __slots__ = ('added', 'removed', 'changed', 'reordered', 'groups_changed')
+
+    def __init__(self):
+        self.added          = []      # [TabRecord]
+        self.removed        = []      # [TabRecord]
+        self.changed        = []      # [(старая TabRecord, новая TabRecord)]
+        self.reordered      = False
+        self.groups_changed = False
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed
+                    or self.reordered or self.groups_changed)
+
+    def moves_rows(self):
+        """Меняет ли снимок состав или порядок строк, а не только их содержимое."""
+        return bool(self.added or self.removed or self.reordered or self.groups_changed
+                    or any(old.group_id != new.group_id for old, new in self.changed))
+
+
+class TabStore:
+    """Снимок одного браузера: записи в порядке окна и индексы к ним.
+
+    pos даёт позицию вкладки за O(1), group_members — вкладки группы без
+    прохода по окну, а счётчики для строки статуса поддерживаются при
+    применении снимка.
+    """
+
+    def __init__(self):
+        self.tabs          = []      # [TabRecord] в порядке окна
+        self.by_id         = {}      # {tab_id: TabRecord}
+        self.pos           = {}      # {tab_id: позиция в tabs}
+        self.groups        = {}      # {group_id: GroupRecord} в порядке снимка
+        self.group_members = {}      # {group_id: [tab_id]} в порядке окна
+        self.active_id     = None
+        self.n_discarded   = 0
+        self.loaded        = False   # снимок хоть раз приходил
+
+    def __len__(self):
+        return len(self.tabs)
+
+    def apply(self, data):
+        """Применяет снимок; возвращает SnapshotDiff (пустой — ничего не изменилось).
+
+        Записи неизменившихся вкладок переиспользуются, так что повторный
+        снимок не создаёт ни одного нового объекта.
+        """
+        diff    = SnapshotDiff()
+        old     = self.by_id
+        old_pos = self.pos
+        tabs, by_id, pos = [], {}, {}
+        active_id, n_discarded = None, 0
+
+        for i, t in enumerate(data.get('tabs', [])):
+            tid = t['id']
+            rec = old.get(tid)
+            if rec is None:
+                rec = TabRecord(t)
+                diff.added.append(rec)
+            elif not rec.same_as(t):
+                new = TabRecord(t)
+                diff.changed.append((rec, new))
+                rec = new
+            if old_pos.get(tid) != i:
+                diff.reordered = True
+            tabs.append(rec)
+            by_id[tid] = rec
+            pos[tid]   = i
+            if rec.active:
+                active_id = tid
+            if rec.discarded:
+                n_discarded += 1
+        diff.removed = [rec for tid, rec in old.items() if tid not in by_id]
+
+        groups = {}
+        for g in data.get('groups', []):
+            rec = self.groups.get(g['id'])
+            if rec is None or not rec.same_as(g):
+                rec = GroupRecord(g)
+                diff.groups_changed = True
+            groups[g['id']] = rec
+        if groups.keys() != self.groups.keys():
+            diff.groups_changed = True
+
+        # Состав групп меняется только вместе с порядком или group_id вкладок —
+        # иначе индекс прежний. Новый словарь, а не правка на месте: старый
+        # может читать поток сервера (ApiView)
+        if diff.moves_rows():
+            members = {}
+            for rec in tabs:
+                if rec.group_id != -1:
+                    members.setdefault(rec.group_id, []).append(rec.id)
+            self.group_members = members
+
+        self.tabs, self.by_id, self.pos = tabs, by_id, pos
+        self.groups = groups
+        self.active_id, self.n_discarded = active_id, n_discarded
+        self.loaded = True
+        return diff
+
+
+# ─── Индексы и массовые операции ──────────────────────────────────────────────
+def url_domain(url):
+    """Домен вкладки без «www.»; для chrome:// и прочих — схема."""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return ""
+    host = parts.hostname or parts.scheme
+    return sys.intern(host[4:] if host.startswith("www.") else host)
+
+
+class TabIndex:
+    """Индексы вкладок одного браузера: url → ids и домен → ids.
+
+    Обновляется по SnapshotDiff: пересчитываются только добавленные, закрытые
+    и сменившие url вкладки, — массовые операции не сканируют весь список.
+    """
+
+    def __init__(self):
+        self.urls       = {}   # {tab_id: url без пустого «#» в конце}
+        self.by_url     = {}   # {url: set(tab_id)}
+        self.by_domain  = {}   # {domain: set(tab_id)}
+        self.first_seen = {}   # {tab_id: time.time()} — если нет lastAccessed
+        self.last_active = {}  # {tab_id: time.time()} — когда видели активной
+
+    def update(self, diff):
+        now = time.time()
+        for rec in diff.added:
+            self._add(rec.id, rec.url)
+            self.first_seen[rec.id] = now
+            if rec.active:
+                self.last_active[rec.id] = now
+        for old, new in diff.changed:
+            if old.url != new.url:
+                self._remove(old.id)
+                self._add(new.id, new.url)
+            if old.active or new.active:
+                self.last_active[new.id] = now
+        for rec in diff.removed:
+            self._remove(rec.id)
+            self.first_seen.pop(rec.id, None)
+            self.last_active.pop(rec.id, None)
+
+    def last_access(self, tab):
+        """Время последнего обращения: lastAccessed Chrome или то, что видели сами."""
+        if tab.last_accessed:
+            return max(self.last_active.get(tab.id, 0), tab.last_accessed / 1000)
+        return self.last_active.get(tab.id) or self.first_seen.get(tab.id) or time.time()
+
+    def _add(self, tid, url):
+        # #fragment — часто маршрут SPA (#inbox, #/settings): разные страницы.
+        # Пустой «#» в конце ничего не значит
+        url = sys.intern(url[:-1] if url.endswith('#') else url)
+        self.urls[tid] = url
+        self.by_url.setdefault(url, set()).add(tid)
+        self.by_domain.setdefault(url_domain(url), set()).add(tid)
+
+    def _remove(self, tid):
+        url = self.urls.pop(tid, None)
+        if url is None:
+            return
+        for index, key in ((self.by_url, url), (self.by_domain, url_domain(url))):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(tid)
+                if not ids:
+                    del index[key]
+
+
+class BulkOperations:
+    """Массовые операции над вкладками одного браузера.
+
+    Целевой набор считается локально по индексам ClientState, а в расширение
+    уходит одна пакетная команда. Закреплённые вкладки не трогаем.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.store  = client.store
+
+    def _closable(self, tid):
+        tab = self.store.by_id.get(tid)
+        return tab is not None and not tab.pinned
+
+    def duplicates(self):
+        """Все копии одинаковых url, кроме одной (активной или первой по порядку)."""
+        by_id, pos = self.store.by_id, self.store.pos
+        result = []
+        for ids in self.client.index.by_url.values():
+            if len(ids) < 2:
+                continue
+            keep = min(ids, key=lambda tid: (not by_id[tid].active, pos[tid]))
+            result.extend(tid for tid in ids if tid != keep and self._closable(tid))
+        return result
+
+    def from_domain(self, domain):
+        ids = self.client.index.by_domain.get(domain, ())
+        return [tid for tid in ids if self._closable(tid)]
+
+    def older_than(self, seconds):
+        """Неактивные вкладки, которые не открывались дольше seconds."""
+        cutoff = time.time() - seconds
+        result = []
+        for tab in self.store.tabs:
+            if tab.active or tab.pinned:
+                continue
+            if self.client.index.last_access(tab) < cutoff:
+                result.append(tab.id)
+        return result
+
+    def sorted_by_domain(self):
+        """Порядок незакреплённых вкладок вне групп по домену, или [] если уже так."""
+        loose = [t for t in self.store.tabs if t.group_id == -1 and not t.pinned]
+        urls  = self.client.index.urls
+        key   = lambda t: (url_domain(urls.get(t.id, '')), urls.get(t.id, ''))
+        ordered = sorted(loose, key=key)
+        if ordered == loose:
+            return []
+        return [t.id for t in ordered]
+
+    def close(self, ids):
+        if ids:
+            print(f"Bulk close: {len(ids)} tab(s)")
+            send_command(self.client.key, "close_multiple", ids=ids)
+
+    def move_to_end(self, ids):
+        if ids:
+            print(f"Bulk move: {len(ids)} tab(s)")
+            send_command(self.client.key, "move_multiple", ids=ids, index=-1)
+
+
+class DiscardPolicy:
+    """LRU-политика выгрузки вкладок одного браузера из памяти.
+
+    Пока загруженных вкладок больше max_loaded, выгружаются давно не
+    открывавшиеся — если простаивают дольше min_idle. Когда у браузера мало
+    свободной памяти, лимит и порог простоя снижаются.
+    """
+
+    def __init__(self, max_loaded=DISCARD_MAX_LOADED, min_idle=DISCARD_MIN_IDLE,
+                 exempt_pinned=DISCARD_EXEMPT_PINNED, exempt_grouped=DISCARD_EXEMPT_GROUPED,
+                 exempt_audible=DISCARD_EXEMPT_AUDIBLE):
+        self.max_loaded     = max_loaded
+        self.min_idle       = min_idle
+        self.exempt_pinned  = exempt_pinned
+        self.exempt_grouped = exempt_grouped
+        self.exempt_audible = exempt_audible
+
+    def _exempt(self, tab):
+        return (tab.active
+                or (self.exempt_pinned and tab.pinned)
+                or (self.exempt_grouped and tab.group_id != -1)
+                or (self.exempt_audible and tab.audible))
+
+    def plan(self, client):
+        """[(tab, причина)] в порядке выгрузки; ничего не отправляет."""
+        pressure   = client.memory_free is not None and client.memory_free < DISCARD_MEMORY_PRESSURE
+        max_loaded = self.max_loaded // 2 if pressure else self.max_loaded
+        min_idle   = min(self.min_idle, DISCARD_PRESSURE_IDLE) if pressure else self.min_idle
+
+        loaded = [t for t in client.store.tabs if not t.discarded]
+        excess = len(loaded) - max_loaded
+        if excess <= 0:
+            return []
+
+        now = time.time()
+        candidates = []
+        for tab in loaded:
+            if self._exempt(tab):
+                continue
+            idle = now - client.index.last_access(tab)
+            if idle >= min_idle:
+                candidates.append((idle, tab))
+        candidates.sort(key=lambda c: c[0], reverse=True)
+
+        suffix = ", мало памяти" if pressure else ""
+        return [(tab, f"простаивает {int(idle // 60)} мин{suffix}")
+                for idle, tab in candidates[:excess]]
+
+    def report(self, client, plan):
+        loaded = len(client.store) - client.store.n_discarded
+        print(f"Discard plan [{client.label}]: {len(plan)} of {loaded} loaded tab(s)")
+        for tab, reason in plan:
+            print(f"  - {tab.id}: {tab.title[:60]!r} ({reason})")
+
+    def apply(self, client, plan):
+        if plan:
+            send_command(client.key, "discard_multiple", ids=[tab.id for tab, _ in plan])
+
+    def run(self, client, plan):
+        """Отчёт по плану и выгрузка — кроме режима DISCARD_DRY_RUN."""
+        self.report(client, plan)
+        if not DISCARD_DRY_RUN:
+            self.apply(client, plan)
+
+
+# ─── Автогруппировка по правилам ──────────────────────────────────────────────
+# Правила из JSON-файла сопоставляют вкладкам именованные группы:
+#   [{"group": "Docs", "color": "blue", "domain": "*.python.org"},
+#    {"group": "Tickets", "title": "JIRA-\\d+"},
+#    {"group": "Video", "url": "youtube\\.com/watch"}]
+# domain — точный домен или «*.домен» вместе с поддоменами, title и url —
+# регулярные выражения (re.search). Срабатывает первое подходящее правило.
+# Проверяются только новые вкладки и сменившие url/заголовок — по SnapshotDiff.
+AUTO_GROUP_ENABLED      = True
+AUTO_GROUP_RULES_FILE   = os.path.join(APP_DATA_DIR, "group_rules.json")
+AUTO_GROUP_RELOAD       = 5.0    # сек между проверками mtime файла правил
+AUTO_GROUP_WAIT         = 5.0    # сек ждать, пока созданная группа появится в снимке
+
+
+class GroupRule:
+    __slots__ = ('index', 'group', 'color', 'domain', 'title', 'url')
+
+    def __init__(self, index, spec):
+        self.index  = index
+        self.group  = str(spec['group'])
+        self.color  = spec.get('color') if spec.get('color') in CHROME_COLORS else None
+        self.domain = spec.get('domain', '').lower().removeprefix('www.') or None
+        self.title  = re.compile(spec['title'], re.IGNORECASE) if spec.get('title') else None
+        self.url    = re.compile(spec['url'], re.IGNORECASE) if spec.get('url') else None
+        if not (self.domain or self.title or self.url):
+            raise ValueError("rule needs domain, title or url")
+
+    def matches(self, tab):
+        """Условия на заголовок и url выполнены (домен уже проверен индексом)."""
+        return ((self.title is None or self.title.search(tab.title) is not None)
+                and (self.url is None or self.url.search(tab.url) is not None))
+
+
+class GroupRules:
+    """Скомпилированные правила: индекс доменов и общие регулярки.
+
+    Доменные правила лежат в словарях (точный домен и суффикс «*.») — поиск
+    по числу частей домена, а не по числу правил. Регулярки заголовков и url
+    склеены в одну на поле: если она не совпала, ни одно такое правило не
+    проверяется. Так на сотне правил вкладка стоит пару словарных поиска и
+    два прохода re.
+    """
+
+    def __init__(self, specs):
+        self.rules    = [GroupRule(i, spec) for i, spec in enumerate(specs)]
+        self.exact    = {}   # {домен: [правило]}
+        self.suffix   = {}   # {домен: [правило]} для «*.домен»
+        self.no_domain = []  # правила только по title/url
+        for rule in self.rules:
+            if rule.domain is None:
+                self.no_domain.append(rule)
+            elif rule.domain.startswith('*.'):
+                self.suffix.setdefault(rule.domain[2:], []).append(rule)
+            else:
+                self.exact.setdefault(rule.domain, []).append(rule)
+        self.title_any = self._combine(r.title for r in self.no_domain)
+        self.url_any   = self._combine(r.url for r in self.no_domain)
+        # Без условия на поле правило проходит фильтр этого поля всегда
+        self.title_free = any(r.title is None for r in self.no_domain)
+        self.url_free   = any(r.url is None for r in self.no_domain)
+
+    @staticmethod
+    def _combine(patterns):
+        patterns = [p.pattern for p in patterns if p is not None]
+        if not patterns:
+            return None
+        # Номера групп в склейке сдвигаются: \1 или (?(1)...) второго правила
+        # указывали бы на группу первого — такие правила проверяем по одному
+        if any(re.search(r'\\[1-9]|\(\?\(\d', p) for p in patterns):
+            return None
+        try:
+            return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+        except re.error:
+            return None   # одинаковые именованные группы в разных правилах
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, tab, domain):
+        """Первое по порядку правило для вкладки или None."""
+        candidates = list(self.exact.get(domain, ()))
+        parts = domain.split('.')
+        for i in range(len(parts)):
+            candidates.extend(self.suffix.get('.'.join(parts[i:]), ()))
+        if self.no_domain and self._may_match(tab):
+            candidates.extend(self.no_domain)
+        best = None
+        for rule in candidates:
+            if (best is None or rule.index < best.index) and rule.matches(tab):
+                best = rule
+        return best
+
+    def _may_match(self, tab):
+        title_ok = self.title_free or self.title_any is None or self.title_any.search(tab.title)
+        url_ok   = self.url_free or self.url_any is None or self.url_any.search(tab.url)
+        return bool(title_ok and url_ok)
+
+
+def load_group_rules(path=AUTO_GROUP_RULES_FILE):
+    """GroupRules из файла; None, если файла нет или правила с ошибкой."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            specs = json.load(f)
+        rules = GroupRules(specs)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, re.error) as e:
+        print(f"!!! Group rules {path}: {e}")
+        return None
+    print(f"Loaded {len(rules)} group rule(s) from {path}")
+    return rules
+
+
+class AutoGrouper:
+    """Применяет GroupRules к вкладкам одного браузера по мере прихода снимков.
+
+    За снимок уходит одна команда group_multiple: вкладки в существующие
+    группы по id, для новых — название и цвет. Пока созданная группа не
+    появилась в снимке, следующие вкладки для неё ждут здесь, иначе Chrome
+    получил бы две группы с одним названием. Вкладку, которую пользователь
+    сам вынул из группы, правила больше не трогают.
+    """
+
+    def __init__(self, client):
+        self.client    = client
+        self.opted_out = set()   # вкладки, вынутые из группы вручную
+        self.inflight  = {}      # {tab_id: monotonic() отправки}
+        self.creating  = {}      # {название: monotonic() отправки}
+        self.waiting   = {}      # {название: set(tab_id)} — ждут создания группы
+
+    def update(self, rules, diff, closed):
+        """Проверяет добавленные и изменившиеся вкладки из diff.
+
+        closed — настоящие закрытия (ClientState.lifecycle): вкладка, ушедшая
+        из снимка вместе с окном, вернётся и должна остаться вне правил.
+        """
+        self.forget(closed)
+        candidates = list(diff.added)
+        for old, new in diff.changed:
+            if old.group_id != -1 and new.group_id == -1:
+                self.opted_out.add(new.id)
+            elif old.url != new.url or old.title != new.title or old.group_id != new.group_id:
+                candidates.append(new)
+        self._run(rules, candidates)
+
+    def forget(self, closed):
+        for rec in closed:
+            self.opted_out.discard(rec.id)
+            self.inflight.pop(rec.id, None)
+
+    def full_pass(self, rules):
+        """Проверяет все вкладки — после загрузки новых правил."""
+        self._run(rules, self.client.store.tabs)
+
+    def _run(self, rules, candidates):
+        now = time.monotonic()
+        self.inflight = {tid: t for tid, t in self.inflight.items() if now - t < AUTO_GROUP_WAIT}
+        self.creating = {g: t for g, t in self.creating.items() if now - t < AUTO_GROUP_WAIT}
+
+        matched = {}   # {правило.group: (правило, [tab_id])}
+        by_id   = self.client.store.by_id
+        for tab in candidates:
+            if (tab.group_id != -1 or tab.pinned or tab.id in self.opted_out
+                    or tab.id in self.inflight or by_id.get(tab.id) is not tab):
+                continue
+            rule = rules.match(tab, url_domain(tab.url)) if rules else None
+            if rule is not None:
+                matched.setdefault(rule.group, (rule, []))[1].append(tab.id)
+        if not matched and not self.waiting:
+            return
+
+        titles = {g.title: gid for gid, g in self.client.store.groups.items()}
+        batch  = []
+        # Вкладки, ждавшие создания группы, — в уже появившуюся группу
+        for title in list(self.waiting):
+            ids = [tid for tid in self.waiting[title]
+                   if tid in by_id and by_id[tid].group_id == -1]
+            if title in titles:
+                del self.waiting[title]
+                if ids:
+                    batch.append({'ids': ids, 'groupId': titles[title]})
+            elif title not in self.creating:
+                del self.waiting[title]   # группа так и не появилась — попробуем заново
+                if ids:
+                    rule = rules.match(by_id[ids[0]], url_domain(by_id[ids[0]].url)) if rules else None
+                    if rule is not None:
+                        matched.setdefault(rule.group, (rule, []))[1].extend(ids)
+        for title, (rule, ids) in matched.items():
+            if title in titles:
+                batch.append({'ids': ids, 'groupId': titles[title]})
+            elif title in self.creating:
+                self.waiting.setdefault(title, set()).update(ids)
+                continue
+            else:
+                batch.append({'ids': ids, 'title': title, 'color': rule.color or 'grey'})
+                self.creating[title] = now
+            for tid in ids:
+                self.inflight[tid] = now
+        if batch:
+            print(f"Auto-group [{self.client.label}]: "
+                  + ", ".join(f"{len(b['ids'])} -> {b.get('title', b.get('groupId'))}" for b in batch))
+            send_command(self.client.key, "group_multiple", groups=batch)
+
+
+# ─── История активности ───────────────────────────────────────────────────────
+# События open/close/activate/title из SnapshotDiff пишутся в SQLite в фоновом
+# потоке. GUI только кладёт кортежи в очередь и никогда не ждёт диск.
+HISTORY_ENABLED        = True
+HISTORY_DB             = os.path.join(APP_DATA_DIR, "history.sqlite3")
+HISTORY_FLUSH_INTERVAL = 2.0       # сек копим события перед записью
+HISTORY_BATCH_MAX      = 1000      # событий в одной транзакции
+HISTORY_RETENTION_DAYS = 90        # старше — удаляются
+HISTORY_MAX_SPAN       = 1800.0    # сек: дольше одна активация не засчитывается (сон, обед)
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ts      REAL    NOT NULL,      -- time.time()
+    client  TEXT    NOT NULL,
+    tab_id  INTEGER NOT NULL,
+    kind    TEXT    NOT NULL,      -- open | close | activate | title
+    url     TEXT,
+    title   TEXT
+);
+CREATE INDEX IF NOT EXISTS events_client_ts ON events(client, kind, ts);
+CREATE INDEX IF NOT EXISTS events_url       ON events(url, kind, ts);
+CREATE INDEX IF NOT EXISTS events_ts        ON events(ts);
+"""
+
+
+class HistoryStore:
+    """Журнал активности вкладок: пакетная запись в WAL, запросы — отдельными соединениями."""
+
+    def __init__(self, path):
+        self.path    = path
+        self.queue   = queue.Queue()
+        self.thread  = None
+
+    # ── Поток Qt ─────────────────────────────────────────────────────────────
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.thread = threading.Thread(target=self._writer, name="history", daemon=True)
+        self.thread.start()
+
+    def record(self, client_key, diff, opened=(), closed=(), initial=False):
+        """События из diff и настоящие открытия/закрытия (ClientState.lifecycle).
+
+        Первый снимок браузера — не «открытие» всех вкладок, а вкладки, лишь
+        ушедшие из снимка вместе с окном, — не закрытие.
+        """
+        if self.thread is None:
+            return
+        now    = time.time()
+        events = []
+        if not initial:
+            for rec in opened:
+                events.append((now, client_key, rec.id, 'open', rec.url, rec.title))
+        for rec in closed:
+            events.append((now, client_key, rec.id, 'close', rec.url, rec.title))
+        for rec in (diff.added if diff else ()):
+            if rec.active:
+                events.append((now, client_key, rec.id, 'activate', rec.url, rec.title))
+        for old, new in (diff.changed if diff else ()):
+            if new.active and not old.active:
+                events.append((now, client_key, new.id, 'activate', new.url, new.title))
+            if new.title != old.title and new.title:
+                events.append((now, client_key, new.id, 'title', new.url, new.title))
+        if events:
+            self.queue.put(events)
+
+    def close(self, timeout=2.0):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+    # ── Фоновый поток ────────────────────────────────────────────────────────
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _writer(self):
+        db = None
+        try:
+            db = self._connect()
+            db.executescript(HISTORY_SCHEMA)
+            self._apply_retention(db)
+        except sqlite3.Error as e:
+            # Писать некуда: record() становится пустым, иначе очередь росла бы без предела
+            print(f"!!! History disabled, {self.path}: {e}")
+            self.thread = None
+            if db is not None:
+                db.close()
+            return
+        last_retention = time.monotonic()
+        stop = False
+        while not stop:
+            batch = []
+            first = self.queue.get()
+            deadline = time.monotonic() + HISTORY_FLUSH_INTERVAL
+            while True:
+                if first is None:
+                    stop = True
+                    break
+                batch.extend(first)
+                if len(batch) >= HISTORY_BATCH_MAX:
+                    break
+                try:
+                    first = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    with db:
+                        db.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)", batch)
+                except sqlite3.Error as e:
+                    print(f"History write error: {e}")
+            if time.monotonic() - last_retention > 3600:
+                self._apply_retention(db)
+                last_retention = time.monotonic()
+        db.close()
+
+    def _apply_retention(self, db):
+        cutoff = time.time() - HISTORY_RETENTION_DAYS * 86400
+        with db:
+            removed = db.execute("DELETE FROM events WHERE ts < ?", (cutoff,)).rowcount
+        if removed:
+            print(f"History: removed {removed} events older than {HISTORY_RETENTION_DAYS} days")
+
+    # ── Запросы (не из потока Qt: сервер вызывает их через asyncio.to_thread) ──
+    def time_on_tabs(self, since, client=None, limit=50):
+        """[(url, title, секунд)]: между активацией и следующей активацией в том же браузере."""
+        db = self._connect()
+        try:
+            return db.execute("""
+                SELECT url, MAX(title), SUM(MIN(COALESCE(next_ts, :now) - ts, :cap)) AS seconds
+                FROM (SELECT ts, url, title,
+                             LEAD(ts) OVER (PARTITION BY client ORDER BY ts) AS next_ts
+                      FROM events
+                      WHERE kind = 'activate' AND ts >= :since
+                            AND (:client IS NULL OR client = :client))
+                GROUP BY url ORDER BY seconds DESC LIMIT :limit
+            """, {'since': since, 'client': client, 'limit': limit,
+                  'now': time.time(), 'cap': HISTORY_MAX_SPAN}).fetchall()
+        finally:
+            db.close()
+
+    def last_active(self, urls):
+        """{url: ts последней активации или открытия, None} — для поиска давно не открывавшихся вкладок."""
+        db = self._connect()
+        try:
+            result = {}
+            for url in urls:
+                row = db.execute("SELECT MAX(ts) FROM events WHERE url = ? AND kind IN ('activate', 'open')",
+                                 (url,)).fetchone()
+                result[url] = row[0]
+            return result
+        finally:
+            db.close()
+
+
+history = HistoryStore(HISTORY_DB)
+
+
+# ─── Сессии ───────────────────────────────────────────────────────────────────
+# Окно сохраняется в gzip-JSON (url, заголовки, группы, закрепление), а
+# восстанавливается пачками: следующая уходит только после restore_ack от
+# расширения и паузы, чтобы ни Chrome, ни панель не вставали на сотнях вкладок.
+SESSION_DIR            = os.path.join(APP_DATA_DIR, "sessions")
+SESSION_MENU_LIMIT     = 8       # последних сессий в меню
+RESTORE_BATCH_SIZE     = 8       # вкладок в одной пачке
+RESTORE_BATCH_INTERVAL = 0.5     # сек между пачками
+RESTORE_ACK_TIMEOUT    = 5.0     # сек ждать restore_ack, потом продолжаем сами
+STATUS_NOTICE_TIME     = 6.0     # сек показа сообщения в строке статуса
+
+
+def save_session(client):
+    """Пишет окно браузера в SESSION_DIR; возвращает путь к файлу."""
+    store   = client.store
+    keys    = {gid: str(i) for i, gid in enumerate(store.groups)}
+    session = {
+        'version': 1,
+        'saved':   time.time(),
+        'label':   client.label,
+        'groups':  [{'key': keys[g.id], 'title': g.title, 'color': g.color}
+                    for g in store.groups.values()],
+        'tabs':    [{'url': t.url, 'title': t.title, 'pinned': t.pinned,
+                     'group': keys.get(t.group_id)} for t in store.tabs if t.url],
+    }
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    label = "".join(c if c.isalnum() else "_" for c in client.label).strip("_")
+    name  = time.strftime("%Y-%m-%d_%H-%M-%S") + f"_{len(session['tabs'])}_{label}.json.gz"
+    path  = os.path.join(SESSION_DIR, name)
+    # Через временный файл: прерванная запись не оставит обрезанный .json.gz
+    tmp = path + ".part"
+    try:
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(session, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+def load_session(path):
+    """Читает файл сессии; ValueError — файл обрезан, повреждён или не сессия."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            session = json.load(f)
+    except (EOFError, zlib.error) as e:
+        raise ValueError(f"damaged session file: {path} ({e})") from e
+    if (not isinstance(session, dict) or session.get('version') != 1
+            or not isinstance(session.get('tabs'), list)
+            or not isinstance(session.get('groups', []), list)):
+        raise ValueError(f"not a session file: {path}")
+    if not all(isinstance(t, dict) and isinstance(t.get('url'), str) for t in session['tabs']):
+        raise ValueError(f"bad tab entry in session file: {path}")
+    if not all(isinstance(g, dict) and 'key' in g for g in session.get('groups', [])):
+        raise ValueError(f"bad group entry in session file: {path}")
+    return session
+
+
+def list_sessions():
+    """Файлы сессий, новые первыми."""
+    try:
+        names = [n for n in os.listdir(SESSION_DIR) if n.endswith(".json.gz")]
+    except OSError:
+        return []
+    return [os.path.join(SESSION_DIR, n) for n in sorted(names, reverse=True)]
+
+
+class SessionRestore:
+    """Планировщик восстановления: пачки restore_batch с ограничением темпа."""
+    ids = itertools.count(1)
+
+    def __init__(self, sidebar_app, client_key, session, discarded=False):
+        self.sidebar_app = sidebar_app
+        self.client_key  = client_key
+        self.restore_id  = f"{int(time.time())}-{next(SessionRestore.ids)}"
+        self.discarded   = discarded
+        # Chrome всё равно держит закреплённые в начале окна — создаём их первыми
+        self.tabs        = sorted(session['tabs'], key=lambda t: not t.get('pinned'))
+        self.groups      = {g['key']: {'title': g.get('title', ''), 'color': g.get('color', 'grey')}
+                            for g in session.get('groups', [])}
+        self.sent        = 0
+        self.batch_no    = 0
+        self.timer       = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._on_timer)
+
+    @property
+    def done(self):
+        return self.sent >= len(self.tabs)
+
+    def progress(self):
+        return f"{self.sent}/{len(self.tabs)}"
+
+    def start(self):
+        print(f"Restoring {len(self.tabs)} tabs [{self.restore_id}]")
+        self._send_next()
+
+    def cancel(self):
+        self.timer.stop()
+        self.tabs = self.tabs[:self.sent]
+
+    def _send_next(self):
+        batch = self.tabs[self.sent:self.sent + RESTORE_BATCH_SIZE]
+        keys  = {t['group'] for t in batch if t.get('group') is not None}
+        self.batch_no += 1
+        send_command(self.client_key, "restore_batch", restore=self.restore_id,
+                     batch=self.batch_no, tabs=batch, discarded=self.discarded,
+                     groups={k: self.groups[k] for k in keys if k in self.groups})
+        self.sent += len(batch)
+        self.timer.start(int(RESTORE_ACK_TIMEOUT * 1000))
+
+    def on_ack(self, batch_no):
+        if batch_no != self.batch_no:
+            return
+        if self.done:
+            self._finish()
+        else:
+            self.timer.start(int(RESTORE_BATCH_INTERVAL * 1000))
+
+    def _on_timer(self):
+        if self.done:
+            self._finish()
+        else:
+            self._send_next()
+
+    def _finish(self):
+        self.timer.stop()
+        print(f"Restore {self.restore_id} done: {len(self.tabs)} tabs")
+        self.sidebar_app.restore_finished(self)
+
+
+# ─── Оптимистичные операции ───────────────────────────────────────────────────
+class OptimisticOp:
+    """Отправленная, но ещё не подтверждённая снимком команда.
+
+    Хранилище остаётся авторитетным: операция лишь накладывается на его
+    вкладки при отрисовке (apply), пока снимок не покажет ожидаемое
+    состояние (confirmed) или не истечёт срок — тогда это откат.
+    """
+    __slots__ = ('kind', 'ids', 'value', 'deadline', 'retried')
+
+    def __init__(self, kind, ids, value=None):
+        self.kind     = kind          # 'activate' | 'close' | 'group' | 'pin'
+        self.ids      = set(ids)
+        self.value    = value         # group_id для 'group', pinned для 'pin'
+        self.deadline = time.monotonic() + OPTIMISTIC_TIMEOUT
+        self.retried  = False
+
+    def apply(self, tabs):
+        ids = self.ids
+        if self.kind == 'close':
+            return [t for t in tabs if t.id not in ids]
+        if self.kind == 'activate':
+            return [t.replace(active=t.id in ids) if t.active != (t.id in ids) else t
+                    for t in tabs]
+        if self.kind == 'group':
+            moved = [t for t in tabs if t.id in ids and t.group_id != self.value]
+            if not moved:
+                return tabs
+            # Группа в Chrome всегда сплошная: добавленные встают за её последней
+            # вкладкой, вынутые — сразу за группой, из которой их вынули
+            anchors = {self.value} if self.value != -1 else {t.group_id for t in moved}
+            moving  = {t.id for t in moved}
+            rest    = [t for t in tabs if t.id not in moving]
+            last    = max((i for i, t in enumerate(rest) if t.group_id in anchors), default=None)
+            moved   = [t.replace(group_id=self.value) for t in moved]
+            if last is None:          # в группе больше никого: вкладки остаются на месте
+                by_id = {t.id: t for t in moved}
+                return [by_id.get(t.id, t) for t in tabs]
+            return rest[:last + 1] + moved + rest[last + 1:]
+        if self.kind == 'pin':
+            # Chrome держит закреплённые вкладки в начале окна, и закрепление
+            # вынимает вкладку из группы
+            moved    = [t.replace(pinned=True, group_id=-1) if self.value else t.replace(pinned=False)
+                        for t in tabs if t.id in ids]
+            rest     = [t for t in tabs if t.id not in ids]
+            n_pinned = sum(1 for t in rest if t.pinned)
+            return rest[:n_pinned] + moved + rest[n_pinned:]
+        return tabs
+
+    def confirmed(self, store):
+        by_id = store.by_id
+        if self.kind == 'close':
+            return not any(tid in by_id for tid in self.ids)
+        if self.kind == 'activate':
+            return store.active_id in self.ids
+        present = [by_id[tid] for tid in self.ids if tid in by_id]
+        if self.kind == 'group':
+            return all(t.group_id == self.value for t in present)
+        if self.kind == 'pin':
+            return all(t.pinned == self.value for t in present)
+        return True
+
+
+# ─── Секция одного браузера ───────────────────────────────────────────────────
+class ClientSection(QWidget):
+    """Заголовок браузера/профиля и его вкладки с группами."""
+
+    def __init__(self, title):
+        super().__init__()
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(4)
+
+        self.header = QLabel(title)
+        self.header.setStyleSheet(
+            "color: #9aa0a6; font-size: 10px; font-weight: bold;"
+            "padding: 6px 6px 2px 6px; background: transparent;"
+        )
+        self.header.setVisible(False)
+
+        self.content = QWidget()
+        self.content_layout = QVBoxLayout(self.content)
+        self.content_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.content_layout.setContentsMargins(0, 0, 0, 0)
+        self.content_layout.setSpacing(4)
+        self.rows = RowBlocks(self.content_layout)
+
+        layout.addWidget(self.header)
+        layout.addWidget(self.content)
+
+
+class RowBlocks:
+    """Строки секции (вкладки и группы), разложенные по блокам до ROW_BLOCK_SIZE.
+
+    Вставка в плоский QVBoxLayout из тысяч строк заставляет Qt заново
+    раскладывать их все (десятки мс на тысячу); здесь пересчитывается один
+    блок, а соседние сдвигаются целиком. Интерфейс — как у layout:
+    count, itemAt, insertWidget; вынимать строку — только через take,
+    иначе размеры блоков разойдутся с Qt.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout    # в нём лежат только блоки
+        self.blocks = []        # [QVBoxLayout] по порядку
+        self.sizes  = []        # строк в каждом блоке
+        self.total  = 0
+        self.starts = None      # префиксные суммы sizes; None — пересчитать
+        self.owners = {}        # {виджет-блок: его QVBoxLayout}
+
+    def count(self):
+        return self.total
+
+    def _resize(self, bi, delta):
+        self.sizes[bi] += delta
+        self.total     += delta
+        self.starts     = None
+
+    def _locate(self, index):
+        if index >= self.total:
+            return None, index - self.total
+        # Проход расстановки читает itemAt подряд без вставок — префиксы
+        # живут весь шаг; после вставки пересчёт — один accumulate в C
+        if self.starts is None:
+            self.starts = list(itertools.accumulate(self.sizes, initial=0))
+        # bisect_right перескакивает пустые блоки с тем же началом
+        bi = bisect.bisect_right(self.starts, index) - 1
+        return bi, index - self.starts[bi]
+
+    def itemAt(self, index):
+        bi, i = self._locate(index)
+        return self.blocks[bi].itemAt(i) if bi is not None else None
+
+    def row_at(self, y):
+        """Номер первой строки, чей низ не выше y (координаты секции); count() — если таких нет.
+
+        Блоки и строки в них лежат сверху вниз, так что оба поиска — bisect
+        по прошлой раскладке, а номер строки собирается из префиксов sizes.
+        """
+        bi = bisect.bisect_left(range(len(self.blocks)), y,
+                                key=lambda b: self._bottom(self.blocks[b].parentWidget()))
+        if bi == len(self.blocks):
+            return self.total
+        block = self.blocks[bi]
+        y    -= block.parentWidget().y()
+        i     = bisect.bisect_left(range(self.sizes[bi]), y,
+                                   key=lambda r: self._bottom(block.itemAt(r).widget()))
+        if self.starts is None:
+            self.starts = list(itertools.accumulate(self.sizes, initial=0))
+        return self.starts[bi] + i
+
+    @staticmethod
+    def _bottom(widget):
+        return widget.y() + widget.height()
+
+    def _new_block(self, bi):
+        widget = QWidget()
+        block  = QVBoxLayout(widget)
+        block.setContentsMargins(0, 0, 0, 0)
+        block.setSpacing(self.layout.spacing())
+        self.layout.insertWidget(bi, widget)
+        self.blocks.insert(bi, block)
+        self.sizes.insert(bi, 0)
+        self.starts = None
+        self.owners[widget] = block
+        return bi
+
+    def take(self, widget):
+        """Вынимает строку из секции (виджет остаётся жив); False — её там нет."""
+        block = self.owners.get(widget.parentWidget())
+        if block is None:
+            return False
+        block.removeWidget(widget)
+        self._resize(self.blocks.index(block), -1)
+        return True
+
+    def insertWidget(self, index, widget):
+        # Строка уже в секции — вынимаем её (она всегда стоит после index)
+        self.take(widget)
+
+        bi, i = self._locate(index)
+        if bi is None:
+            # В конец: дописываем в последний блок или открываем новый
+            if not self.blocks or self.sizes[-1] >= ROW_BLOCK_SIZE:
+                bi = self._new_block(len(self.blocks))
+            else:
+                bi = len(self.blocks) - 1
+            i = self.sizes[bi]
+        elif i == 0 and bi > 0 and self.sizes[bi - 1] < ROW_BLOCK_SIZE:
+            bi -= 1
+            i = self.sizes[bi]
+        elif self.sizes[bi] >= ROW_BLOCK_SIZE:
+            if i == 0:
+                bi = self._new_block(bi)
+            else:
+                # Середина полного блока: последняя строка переезжает в начало
+                # следующего (перенос строки дорог — не делим блок пополам)
+                block = self.blocks[bi]
+                last  = block.itemAt(self.sizes[bi] - 1).widget()
+                if bi + 1 == len(self.blocks) or self.sizes[bi + 1] >= ROW_BLOCK_SIZE:
+                    self._new_block(bi + 1)
+                block.removeWidget(last)
+                self._resize(bi, -1)
+                self.blocks[bi + 1].insertWidget(0, last)
+                self._resize(bi + 1, 1)
+        self.blocks[bi].insertWidget(i, widget)
+        self._resize(bi, 1)
+
+    def prune(self):
+        """Убирает опустевшие после удалений блоки."""
+        for bi in range(len(self.blocks) - 1, -1, -1):
+            if self.sizes[bi] == 0:
+                owner = self.blocks.pop(bi).parentWidget()
+                del self.sizes[bi]
+                del self.owners[owner]
+                # Пустой блок: без setParent(None), который пересчитывает стили (~2 мс)
+                owner.hide()
+                self.layout.removeWidget(owner)
+                sip.delete(owner)
+        self.starts = None
+
+
+class ClientState:
+    """Состояние одного расширения (браузер/профиль): снимок, версия, виджеты.
+
+    У каждого подключения свои tab_id и group_id — в разных браузерах они
+    могут совпадать, поэтому всё хранится раздельно и перерисовывается только
+    та секция, чей снимок изменился.
+    """
+
+    def __init__(self, key, label):
+        self.key             = key
+        self.label           = label
+        self.connected       = True
+        self.disconnected_at = 0.0
+        self.store           = TabStore()
+        self.dirty           = False   # снимок ещё не отрисован
+        self.layout_dirty    = False   # ...и в нём меняется состав или порядок строк
+        self.tab_widgets     = {}      # {tab_id: TabWidget}
+        self.group_widgets   = {}      # {group_id: GroupWidget}
+        self.retired_groups  = []      # [GroupWidget] исчезли, ждут конца прохода
+        self.group_states    = {}      # {group_id: развёрнута ли}
+        self.pending_ops     = []      # [OptimisticOp] — ждут подтверждения снимком
+        # Снимок покрывает одно окно: вкладка, пропавшая из него при смене окна,
+        # не закрыта, а появившаяся — не открыта. Если расширение шлёт opened/closed
+        # (tabs.onCreated/onRemoved), различаем одно и другое; со старым
+        # расширением пропажа из снимка считается закрытием, как раньше
+        self.reports_lifecycle = False
+        self.out_of_scope    = {}      # {tab_id: TabRecord} — ушли из снимка, не закрыты
+        self.created         = set()   # opened пришёл, вкладки ещё не было в снимке
+        self.closed_early    = set()   # closed пришёл раньше снимка без вкладки
+        self.index           = TabIndex()
+        self.grouper         = AutoGrouper(self)
+        self.section         = ClientSection(label)
+
+        # Подписка: версия кэшированного состояния
+        self.state_epoch    = None    # идентификатор запуска Service Worker
+        self.state_seq      = 0       # версия последнего принятого снимка
+        self.last_heartbeat = 0.0     # monotonic() последнего сообщения
+        self.last_snapshot  = 0.0     # monotonic() последнего снимка
+        self.last_resync    = 0.0     # monotonic() последнего запроса resync
+        self.memory_free    = None    # доля свободной памяти из пинга расширения
+
+    def view(self):
+        """(вкладки, active_id) для отрисовки: снимок плюс неподтверждённые операции."""
+        if not (OPTIMISTIC_UI and self.pending_ops):
+            return self.store.tabs, self.store.active_id
+        tabs = self.store.tabs
+        for op in self.pending_ops:
+            tabs = op.apply(tabs)
+        return tabs, next((t.id for t in tabs if t.active), None)
+
+    def lifecycle(self, diff):
+        """(открытые, закрытые) вкладки из diff без смены окна в снимке."""
+        if not self.reports_lifecycle:
+            return diff.added, diff.removed
+        opened = []
+        for rec in diff.added:
+            self.out_of_scope.pop(rec.id, None)
+            if rec.id in self.created:
+                self.created.discard(rec.id)
+                opened.append(rec)
+        closed = []
+        for rec in diff.removed:
+            if rec.id in self.closed_early:
+                closed.append(rec)
+            else:
+                self.out_of_scope[rec.id] = rec
+        # closed для вкладок, которых мы не видели, больше не понадобятся
+        self.closed_early &= self.store.by_id.keys()
+        return opened, closed
+
+    def tabs_opened(self, ids):
+        """opened от расширения: вкладка новая, когда бы ни попала в снимок."""
+        self.created.update(tid for tid in ids if tid not in self.store.by_id)
+
+    def tabs_closed(self, ids):
+        """closed от расширения; возвращает закрытые вкладки вне снимка (другие окна).
+
+        Вкладки из снимка закроются следующим снимком — lifecycle найдёт их
+        в closed_early.
+        """
+        closed = []
+        for tid in ids:
+            self.created.discard(tid)
+            rec = self.out_of_scope.pop(tid, None)
+            if rec is not None:
+                closed.append(rec)
+            else:
+                self.closed_early.add(tid)
+        return closed
+
+    def settle_ops(self):
+        """Сверяет операции со снимком; True, если отображение нужно обновить."""
+        now     = time.monotonic()
+        changed = False
+        keep    = []
+        for op in self.pending_ops:
+            if op.confirmed(self.store):
+                continue
+            if now < op.deadline:
+                keep.append(op)
+                continue
+            if op.kind == 'close' and not op.retried:
+                # Вкладка не закрылась — повторяем команду один раз
+                ids = [tid for tid in op.ids if tid in self.store.by_id]
+                print(f"Retry close for tab(s) {ids}")
+                send_command(self.key, "close_multiple", ids=ids)
+                op.retried  = True
+                op.deadline = now + OPTIMISTIC_TIMEOUT
+                keep.append(op)
+                continue
+            print(f"Rolled back {op.kind} for tab(s) {sorted(op.ids)} [{self.label}]")
+            changed = True
+        self.pending_ops = keep
+        return changed and OPTIMISTIC_UI
+
+    def is_stale(self):
+        """True, если кэшу нельзя доверять и нужен свежий снимок."""
+        if not PUSH_SUBSCRIPTION or not self.store.loaded:
+            return True
+        return time.monotonic() - self.last_heartbeat > STATE_STALE_TIMEOUT
+
+    def request_resync(self):
+        now = time.monotonic()
+        if now - self.last_resync < RESYNC_MIN_INTERVAL:
+            return
+        self.last_resync = now
+        send_command(self.key, "request_update")
+
+
 # ─── Главное окно ─────────────────────────────────────────────────────────────
 class SidebarApp(QWidget):
+    ui_updated = pyqtSignal()   # проход отрисовки завершён
+
     def __init__(self):
         super().__init__()
         self.w_open   = 350
         self.w_closed = 8
 
-        self.group_states   = {}
-        self.tab_widgets    = {}    # {tab_id: TabWidget}
-        self.group_widgets  = {}    # {group_id: GroupWidget}
-        self.last_data_raw  = ""
+        self.clients        = {}    # {client_key: ClientState}
         self.force_update   = False
         self.scroll_to_tab_id    = None
-        self.scroll_to_group_id  = None
+        self.scroll_to_group     = None   # (client_key, group_id)
         self.scroll_to_active_tab = False
         self.last_active_tab_id  = None
         self.tray_icon = None
 
         # ── Новое: мультиселект ──────────────────────────────────────────────
+        # Выделение живёт в пределах одного браузера
         self.selected_tab_ids   = set()   # множество выделенных tab_id
+        self.selection_client   = None    # client_key выделенных вкладок
         self.last_clicked_tab_id = None   # для Shift+Click диапазона
 
-        # ── Новое: retry закрытия ────────────────────────────────────────────
-        self.pending_closes = {}  # {tab_id: float(timestamp)}
-
-        # Троттлинг обновлений
+        # Троттлинг обновлений: задержку подбирает schedule_ui_update,
+        # а сам проход режется на кусочки по UI_FRAME_BUDGET (slice_timer)
         self.update_timer = QTimer()
         self.update_timer.setSingleShot(True)
         self.update_timer.setInterval(150)
         self.update_timer.timeout.connect(self.actual_ui_update)
-        self.pending_data = None
+        self.slice_timer = QTimer()
+        self.slice_timer.setSingleShot(True)
+        self.slice_timer.setInterval(0)
+        self.slice_timer.timeout.connect(self._run_ui_slices)
+        self.ui_jobs        = {}     # {client_key: генератор reconcile_client}
+        self.ui_force       = False
+        self.ui_old_scroll  = 0
+        self.ui_job_cost    = 0.0    # сек, потраченные на текущий проход
+        self.ui_cost        = 0.0    # сек, скользящее среднее цены прохода
+        self.event_interval = 1.0    # сек, скользящее среднее между снимками
+        self.last_event_at  = 0.0
+
+        self.icons = IconStore()
+
+        # Политика выгрузки вкладок из памяти
+        self.discard_policy = DiscardPolicy()
+        self.discard_timer  = QTimer()
+        self.discard_timer.setInterval(int(DISCARD_INTERVAL * 1000))
+        self.discard_timer.timeout.connect(self.run_discard_policy)
+        if DISCARD_AUTO:
+            self.discard_timer.start()
+
+        self.restores = {}   # {restore_id: SessionRestore} — идущие восстановления
+
+        # Короткие сообщения (сессия сохранена, ошибка) — в строке статуса
+        self.notice = ""
+        self.notice_timer = QTimer()
+        self.notice_timer.setSingleShot(True)
+        self.notice_timer.timeout.connect(lambda: self.show_notice(""))
+
+        # Автогруппировка: правила перечитываются, когда меняется файл
+        self.group_rules       = None
+        self.group_rules_mtime = None
+        self.rules_timer = QTimer()
+        self.rules_timer.setInterval(int(AUTO_GROUP_RELOAD * 1000))
+        self.rules_timer.timeout.connect(self.reload_group_rules)
+        if AUTO_GROUP_ENABLED:
+            self.reload_group_rules()
+            self.rules_timer.start()
 
         # Платформа
         self.is_windows = platform.system() == 'Windows'
@@ -682,68 +2201,139 @@ class SidebarApp(QWidget):
         self.anim.setDuration(150)
 
         signals.data_received.connect(self.request_update)
+        signals.heartbeat_received.connect(self.on_heartbeat)
+        signals.client_connected.connect(self.on_client_connected)
+        signals.client_disconnected.connect(self.on_client_disconnected)
+        signals.restore_ack.connect(self.on_restore_ack)
+        signals.tab_lifecycle.connect(self.on_tab_lifecycle)
 
     # ── Мультиселект ─────────────────────────────────────────────────────────
-    def toggle_tab_selection(self, tab_id):
+    def _selection_widgets(self):
+        client = self.clients.get(self.selection_client)
+        return client.tab_widgets if client else {}
+
+    def _select_client(self, client_key):
+        """Переносит выделение в другой браузер, сбрасывая прежнее."""
+        if self.selection_client != client_key:
+            self.clear_selection()
+            self.selection_client = client_key
+            self.last_clicked_tab_id = None
+
+    def toggle_tab_selection(self, client_key, tab_id):
         """Переключает выделение одной вкладки (Ctrl+Click)."""
+        self._select_client(client_key)
+        widgets = self._selection_widgets()
         if tab_id in self.selected_tab_ids:
             self.selected_tab_ids.discard(tab_id)
-            if tab_id in self.tab_widgets:
-                self.tab_widgets[tab_id].set_selected(False)
+            if tab_id in widgets:
+                widgets[tab_id].set_selected(False)
         else:
             self.selected_tab_ids.add(tab_id)
-            if tab_id in self.tab_widgets:
-                self.tab_widgets[tab_id].set_selected(True)
+            if tab_id in widgets:
+                widgets[tab_id].set_selected(True)
         self.last_clicked_tab_id = tab_id
         self._update_status_label()
 
     def clear_selection(self):
         """Снимает выделение со всех вкладок."""
+        widgets = self._selection_widgets()
         for tid in list(self.selected_tab_ids):
-            if tid in self.tab_widgets:
-                self.tab_widgets[tid].set_selected(False)
+            if tid in widgets:
+                widgets[tid].set_selected(False)
         self.selected_tab_ids.clear()
         self._update_status_label()
 
-    def range_select_tabs(self, tab_id):
+    def range_select_tabs(self, client_key, tab_id):
         """Выделяет диапазон вкладок от last_clicked_tab_id до tab_id (Shift+Click)."""
-        if not self.pending_data:
-            self.toggle_tab_selection(tab_id)
-            return
-        all_ids = [t['id'] for t in self.pending_data.get('tabs', [])]
-        last = self.last_clicked_tab_id
-        if last is None or last not in all_ids or tab_id not in all_ids:
-            self.toggle_tab_selection(tab_id)
+        self._select_client(client_key)
+        client = self.clients.get(client_key)
+        pos    = client.store.pos if client else {}
+        last   = self.last_clicked_tab_id
+        if last not in pos or tab_id not in pos:
+            self.toggle_tab_selection(client_key, tab_id)
             return
-        i1 = all_ids.index(last)
-        i2 = all_ids.index(tab_id)
+        i1, i2 = pos[last], pos[tab_id]
         start, end = min(i1, i2), max(i1, i2)
-        for tid in all_ids[start:end + 1]:
+        for rec in client.store.tabs[start:end + 1]:
+            tid = rec.id
             self.selected_tab_ids.add(tid)
-            if tid in self.tab_widgets:
-                self.tab_widgets[tid].set_selected(True)
+            if tid in client.tab_widgets:
+                client.tab_widgets[tid].set_selected(True)
         self.last_clicked_tab_id = tab_id
         self._update_status_label()
 
     def _update_status_label(self):
-        n_tabs     = len(self.pending_data.get('tabs', [])) if self.pending_data else 0
-        n_selected = len(self.selected_tab_ids)
+        n_tabs      = sum(len(c.store) for c in self.clients.values())
+        n_discarded = sum(c.store.n_discarded for c in self.clients.values())
+        n_selected  = len(self.selected_tab_ids)
+        text = f"Вкладок: {n_tabs}"
+        if n_discarded > 0:
+            text += f"  ·  Выгружено: {n_discarded}"
         if n_selected > 0:
-            self.status_label.setText(
-                f"Вкладок: {n_tabs}  ·  Выбрано: {n_selected}"
-            )
-        else:
-            self.status_label.setText(f"Вкладок: {n_tabs}")
+            text += f"  ·  Выбрано: {n_selected}"
+        for restore in self.restores.values():
+            text += f"  ·  Восстановление: {restore.progress()}"
+        if self.notice:
+            text += f"  ·  {self.notice}"
+        self.status_label.setText(text)
+
+    def show_notice(self, text):
+        """Показывает сообщение в строке статуса на STATUS_NOTICE_TIME."""
+        self.notice = text
+        if text:
+            self.notice_timer.start(int(STATUS_NOTICE_TIME * 1000))
+        self._update_status_label()
+
+    # ── Сессии ───────────────────────────────────────────────────────────────
+    def save_window_session(self, client_key):
+        client = self.clients.get(client_key)
+        if not client:
+            return
+        try:
+            path = save_session(client)
+        except OSError as e:
+            print(f"!!! Cannot save session: {e}")
+            self.show_notice("Не удалось сохранить сессию")
+            return
+        print(f"Session saved: {path}")
+        self.show_notice(f"Сессия сохранена: {os.path.basename(path)[:-len('.json.gz')]}")
+
+    def restore_session(self, client_key, path, discarded=False):
+        try:
+            session = load_session(path)
+        except (OSError, ValueError) as e:
+            print(f"!!! Cannot load session {path}: {e}")
+            self.show_notice(f"Не удалось открыть сессию {os.path.basename(path)}")
+            return
+        restore = SessionRestore(self, client_key, session, discarded)
+        self.restores[restore.restore_id] = restore
+        restore.start()
+        self._update_status_label()
+
+    def cancel_restores(self):
+        for restore in list(self.restores.values()):
+            restore.cancel()
+            self.restore_finished(restore)
+
+    def on_restore_ack(self, _key, data):
+        restore = self.restores.get(data.get('restore'))
+        if restore:
+            restore.on_ack(data.get('batch'))
+            self._update_status_label()
+
+    def restore_finished(self, restore):
+        self.restores.pop(restore.restore_id, None)
+        self._update_status_label()
 
     # ── Новая вкладка ────────────────────────────────────────────────────────
     def create_new_tab(self):
-        cmd = json.dumps({"action": "new_tab"})
+        client = self.latest_client()
+        key = client.key if client else None
         print("Creating new tab")
-        command_queue.put(cmd)
+        send_command(key, "new_tab")
         self.force_update = True
         self.scroll_to_active_tab = True
-        QTimer.singleShot(100, lambda: command_queue.put(
-            json.dumps({"action": "request_update"})))
+        QTimer.singleShot(100, lambda: send_command(key, "request_update"))
 
     # ── Проверка активности Chrome ───────────────────────────────────────────
     def is_chrome_in_foreground(self):
@@ -786,17 +2376,193 @@ class SidebarApp(QWidget):
         except:
             return False
 
+    # ── Клиенты (браузеры и профили) ─────────────────────────────────────────
+    def latest_client(self):
+        """Браузер с самым свежим снимком — туда уходят команды без вкладки."""
+        live = [c for c in self.clients.values() if c.store.loaded]
+        return max(live, key=lambda c: c.last_snapshot) if live else None
+
+    def _get_client(self, key, label=None):
+        client = self.clients.get(key)
+        if client is None:
+            client = ClientState(key, label or key)
+            self.clients[key] = client
+            self.scroll_layout.addWidget(client.section)
+            self._update_section_headers()
+        return client
+
+    def _update_section_headers(self):
+        show = SHOW_CLIENT_SECTIONS and len(self.clients) > 1
+        for client in self.clients.values():
+            client.section.header.setVisible(show)
+
+    def on_client_connected(self, key, hello):
+        client = self._get_client(key, hello.get('label'))
+        client.connected = True
+        client.reports_lifecycle = bool(hello.get('reports_lifecycle'))
+        if hello.get('label') and client.label != hello['label']:
+            client.label = hello['label']
+            client.section.header.setText(client.label)
+        query_api.publish(client)
+
+    def on_client_disconnected(self, key):
+        client = self.clients.get(key)
+        if not client:
+            return
+        # Service Worker переподключается часто — держим секцию какое-то время,
+        # чтобы не перестраивать её заново и не терять свёрнутые группы
+        client.connected = False
+        client.disconnected_at = time.monotonic()
+        query_api.publish(client)
+        QTimer.singleShot(int(CLIENT_GRACE_PERIOD * 1000), lambda: self._drop_client(key))
+
+    def _drop_client(self, key):
+        client = self.clients.get(key)
+        if not client or client.connected:
+            return
+        if time.monotonic() - client.disconnected_at < CLIENT_GRACE_PERIOD - 0.1:
+            return  # переподключался и снова отвалился — ждёт свой таймер
+        print(f"Dropping client {client.label}")
+        if self.selection_client == key:
+            self.clear_selection()
+            self.selection_client = None
+        del self.clients[key]
+        query_api.drop(key)
+        client.section.deleteLater()
+        self._update_section_headers()
+        self._update_status_label()
+
+    # ── Оптимистичные операции ───────────────────────────────────────────────
+    def apply_optimistic(self, client_key, kind, ids, value=None):
+        client = self.clients.get(client_key)
+        if not client or not ids:
+            return
+        if kind == 'pin':
+            # От того, что видно сейчас, с неподтверждёнными операциями: второе
+            # нажатие до прихода снимка возвращает вкладку обратно
+            tabs, _active_id = client.view()
+            tab = next((t for t in tabs if t.id == ids[0]), None)
+            value = not tab.pinned if tab else True
+        client.pending_ops.append(OptimisticOp(kind, ids, value))
+        QTimer.singleShot(int(OPTIMISTIC_TIMEOUT * 1000) + 50, lambda: self._settle_ops(client_key))
+        if OPTIMISTIC_UI:
+            client.dirty = True
+            self.force_update = True
+            self.update_timer.start(0)
+
+    def _settle_ops(self, client_key):
+        """Таймаут операции: снимок так и не пришёл — повтор или откат."""
+        client = self.clients.get(client_key)
+        if client and client.settle_ops():
+            client.dirty = client.layout_dirty = True
+            self.update_timer.start(0)
+        if client and any(op.retried for op in client.pending_ops):
+            QTimer.singleShot(int(OPTIMISTIC_TIMEOUT * 1000) + 50, lambda: self._settle_ops(client_key))
+
+    # ── Выгрузка вкладок ─────────────────────────────────────────────────────
+    def run_discard_policy(self):
+        for client in self.clients.values():
+            if not client.connected or not client.store.loaded:
+                continue
+            plan = self.discard_policy.plan(client)
+            if plan:
+                self.discard_policy.run(client, plan)
+
+    # ── Автогруппировка ──────────────────────────────────────────────────────
+    def reload_group_rules(self):
+        try:
+            mtime = os.path.getmtime(AUTO_GROUP_RULES_FILE)
+        except OSError:
+            mtime = None
+        if mtime == self.group_rules_mtime:
+            return
+        self.group_rules_mtime = mtime
+        self.group_rules = load_group_rules() if mtime is not None else None
+        if self.group_rules:
+            for client in self.clients.values():
+                if client.connected and client.store.loaded:
+                    client.grouper.full_pass(self.group_rules)
+
+    def on_tab_lifecycle(self, key, kind, ids):
+        """Настоящие открытия и закрытия вкладок, в том числе в окнах вне снимка."""
+        client = self.clients.get(key)
+        if client is None:
+            return
+        if kind == 'opened':
+            client.tabs_opened(ids)
+            return
+        closed = client.tabs_closed(ids)
+        if closed:
+            history.record(key, None, closed=closed)
+            client.grouper.forget(closed)
+
+    # ── Подписка на состояние ────────────────────────────────────────────────
+    def on_heartbeat(self, key, data):
+        """Пинг расширения: подтверждает свежесть кэша или сообщает о пропуске."""
+        client = self.clients.get(key)
+        if client is None:
+            return   # секцию заводят hello и снимок, не пинг
+        client.last_heartbeat = time.monotonic()
+        memory = data.get('memory')
+        if memory and memory.get('capacity'):
+            client.memory_free = memory['available'] / memory['capacity']
+        seq = data.get('seq')
+        if seq is None:
+            return
+        if data.get('epoch') != client.state_epoch or seq > client.state_seq:
+            # Расширение ушло вперёд (или перезапустилось) — мы пропустили снимок
+            print(f"State gap [{client.label}]: have {client.state_seq}, extension at {seq}")
+            client.request_resync()
+
     # ── Обновление UI ────────────────────────────────────────────────────────
-    def request_update(self, data):
-        data_str = json.dumps(data, sort_keys=True)
-        if data_str == self.last_data_raw and not self.force_update:
+    def request_update(self, key, data):
+        client = self._get_client(key)
+        epoch = data.pop('epoch', None)
+        seq   = data.pop('seq', None)
+        if seq is not None:
+            if epoch == client.state_epoch and seq <= client.state_seq:
+                return  # запоздавший или повторный снимок
+            client.state_epoch, client.state_seq = epoch, seq
+        client.last_heartbeat = client.last_snapshot = time.monotonic()
+
+        initial = not client.store.loaded
+        diff = client.store.apply(data)
+        opened, closed = client.lifecycle(diff)
+        history.record(key, diff, opened, closed, initial)
+        ops_changed = client.settle_ops()
+        if not diff and not ops_changed and not self.force_update:
+            return
+        client.index.update(diff)
+        if diff:
+            query_api.publish(client, diff)
+            if self.group_rules and client.connected:
+                client.grouper.update(self.group_rules, diff, closed)
+        client.dirty = True
+        if ops_changed or diff.moves_rows():
+            client.layout_dirty = True
+        self.schedule_ui_update()
+
+    def schedule_ui_update(self):
+        """Откладывает отрисовку на задержку, подобранную по частоте снимков и цене отрисовки.
+
+        Одиночное событие рисуется почти сразу; при потоке снимков или дорогой
+        отрисовке задержка растёт, чтобы собрать несколько снимков в один проход.
+        Уже идущий таймер не перезапускается — иначе поток снимков откладывал бы
+        отрисовку бесконечно.
+        """
+        now = time.monotonic()
+        interval = min(now - self.last_event_at, 1.0)
+        self.last_event_at  = now
+        self.event_interval = 0.7 * self.event_interval + 0.3 * interval
+        if self.update_timer.isActive():
             return
-        self.pending_data  = data
-        self.last_data_raw = data_str
-        self.update_timer.start()
+        delay = UI_COST_FACTOR * self.ui_cost
+        if self.event_interval * 1000 < UI_MAX_DELAY:
+            delay = max(delay, 2 * self.event_interval)   # пачка снимков — соберём её
+        self.update_timer.start(int(min(max(delay * 1000, UI_MIN_DELAY), UI_MAX_DELAY)))
 
     def actual_ui_update(self):
-        if not self.pending_data:
+        if not self.clients:
             return
 
         # Если открыто контекстное меню — откладываем
@@ -804,128 +2570,68 @@ class SidebarApp(QWidget):
             self.update_timer.start(500)
             return
 
-        if self.underMouse() and not self.force_update:
-            self.update_timer.start(500)
+        # Под курсором строки не должны уезжать: меняем только содержимое,
+        # а перестройку списка ждём, пока курсор не уйдёт
+        if self.underMouse() and not self.force_update and any(
+                c.dirty and c.layout_dirty for c in self.clients.values()):
+            self.update_timer.start(UI_HOVER_RECHECK)
             return
 
         force_update_active = self.force_update
         self.force_update   = False
+        self.ui_force       = self.ui_force or force_update_active
 
-        data      = self.pending_data
-        tabs_data = data.get('tabs', [])
-        if not tabs_data:
-            return
+        self._update_status_label()
 
-        n_selected = len(self.selected_tab_ids)
-        if n_selected > 0:
-            self.status_label.setText(
-                f"Вкладок: {len(tabs_data)}  ·  Выбрано: {n_selected}"
-            )
+        if not self.ui_jobs:
+            self.ui_old_scroll = self.scroll.verticalScrollBar().value()
+            self.ui_job_cost   = 0.0
+
+        # Перерисовываем только браузеры, чей снимок изменился; незаконченный
+        # проход начинается заново — уже созданные виджеты при этом сохраняются
+        latest = self.latest_client()
+        for client in self.clients.values():
+            if client.dirty and client.store.tabs:
+                client.dirty = client.layout_dirty = False
+                self.ui_jobs[client.key] = self.reconcile_client(
+                    client, force_update_active, self.scroll_to_active_tab and client is latest)
+        self._run_ui_slices()
+
+    def _run_ui_slices(self):
+        """Выполняет проходы отрисовки не дольше UI_FRAME_BUDGET за тик цикла событий."""
+        started  = time.perf_counter()
+        deadline = started + UI_FRAME_BUDGET
+        for key in list(self.ui_jobs):
+            job = self.ui_jobs[key]
+            if key not in self.clients:
+                del self.ui_jobs[key]
+                continue
+            try:
+                while time.perf_counter() < deadline:
+                    next(job)
+            except StopIteration:
+                del self.ui_jobs[key]
+            if time.perf_counter() >= deadline:
+                break
+        self.ui_job_cost += time.perf_counter() - started
+        if self.ui_jobs:
+            self.slice_timer.start()   # остаток — после обработки ввода
         else:
-            self.status_label.setText(f"Вкладок: {len(tabs_data)}")
-
-        v_bar      = self.scroll.verticalScrollBar()
-        old_scroll = v_bar.value()
-
-        # 1. Удаляем виджеты исчезнувших вкладок
-        current_tab_ids = {tab['id'] for tab in tabs_data}
-        for tid in list(self.tab_widgets.keys()):
-            if tid not in current_tab_ids:
-                self.selected_tab_ids.discard(tid)    # снимаем из выделения
-                self.pending_closes.pop(tid, None)    # снимаем из retry
-                self.tab_widgets.pop(tid).deleteLater()
-
-        # 2. Retry: если вкладка не закрылась за 600 мс — повторяем команду
-        now = time.time()
-        for tab_id, sent_time in list(self.pending_closes.items()):
-            if tab_id not in current_tab_ids:
-                self.pending_closes.pop(tab_id, None)
-            elif now - sent_time > 0.6:
-                print(f"Retry close for tab {tab_id}")
-                command_queue.put(json.dumps({"action": "close", "id": tab_id}))
-                self.pending_closes[tab_id] = now  # сброс таймера
-
-        # 3. Удаляем виджеты исчезнувших групп
-        current_group_ids = {g['id'] for g in data.get('groups', [])}
-        for gid in list(self.group_widgets.keys()):
-            if gid not in current_group_ids:
-                self.group_widgets.pop(gid).deleteLater()
-
-        # 4. Обновляем / создаём виджеты
-        groups_map       = {g['id']: g for g in data.get('groups', [])}
-        all_groups_data  = data.get('groups', [])
-
-        if force_update_active and self.scroll_to_group_id:
-            self.group_states[self.scroll_to_group_id] = True
+            self._finish_ui_update()
 
-        # Разворачиваем группу активной вкладки при автоскролле
-        if self.scroll_to_active_tab:
-            for tab in tabs_data:
-                if tab['active']:
-                    ag_id = tab['groupId'] if tab['groupId'] != -1 else None
-                    if ag_id:
-                        self.group_states[ag_id] = True
-                    break
-
-        target_widget       = None
-        main_idx            = 0
-        group_tab_indices   = {gid: 0 for gid in current_group_ids}
-        added_groups_to_layout = set()
-
-        for tab in tabs_data:
-            tid  = tab['id']
-            g_id = tab['groupId']
-
-            if tid in self.tab_widgets:
-                tab_widget = self.tab_widgets[tid]
-                tab_widget.update_data(tab)
-            else:
-                tab_widget = TabWidget(tab, self)
-                self.tab_widgets[tid] = tab_widget
-                # Если ID уже в выделении (маловероятно, но на всякий случай)
-                if tid in self.selected_tab_ids:
-                    tab_widget.set_selected(True)
-
-            tab_widget.available_groups = all_groups_data
-
-            if g_id != -1 and g_id in groups_map:
-                if g_id not in self.group_widgets:
-                    self.group_widgets[g_id] = GroupWidget(
-                        groups_map[g_id], self, self.group_states.get(g_id, True)
-                    )
-                else:
-                    self.group_widgets[g_id].update_data(
-                        groups_map[g_id], self.group_states.get(g_id, True)
-                    )
-
-                group_w = self.group_widgets[g_id]
-                if g_id not in added_groups_to_layout:
-                    item = self.scroll_layout.itemAt(main_idx)
-                    if not item or item.widget() != group_w:
-                        self.scroll_layout.insertWidget(main_idx, group_w)
-                    main_idx += 1
-                    added_groups_to_layout.add(g_id)
-
-                g_item = group_w.tabs_layout.itemAt(group_tab_indices[g_id])
-                if not g_item or g_item.widget() != tab_widget:
-                    group_w.tabs_layout.insertWidget(group_tab_indices[g_id], tab_widget)
-                group_tab_indices[g_id] += 1
-            else:
-                item = self.scroll_layout.itemAt(main_idx)
-                if not item or item.widget() != tab_widget:
-                    self.scroll_layout.insertWidget(main_idx, tab_widget)
-                main_idx += 1
+    def _finish_ui_update(self):
+        self.ui_cost = 0.7 * self.ui_cost + 0.3 * self.ui_job_cost
+        force_update_active, self.ui_force = self.ui_force, False
 
-            if (self.scroll_to_active_tab or force_update_active) and tab['active']:
-                target_widget = tab_widget
-            elif self.scroll_to_tab_id == tid:
-                target_widget = tab_widget
+        target_widget = self._scroll_target(self.latest_client(), force_update_active)
+        v_bar         = self.scroll.verticalScrollBar()
+        old_scroll    = self.ui_old_scroll
 
         # 5. Автоскролл
         if target_widget:
             self.scroll_to_active_tab = False
             self.scroll_to_tab_id     = None
-            self.scroll_to_group_id   = None
+            self.scroll_to_group      = None
             self.scroll_content.adjustSize()
 
             def do_scroll():
@@ -939,6 +2645,189 @@ class SidebarApp(QWidget):
                     v_bar.setValue(old_scroll)
 
             QTimer.singleShot(1, restore_scroll)
+        self.ui_updated.emit()
+
+    def _scroll_target(self, latest, force_update_active):
+        if latest is None:
+            return None
+        if self.scroll_to_active_tab or force_update_active:
+            _tabs, active_id = latest.view()
+            if active_id is not None:
+                return latest.tab_widgets.get(active_id)
+        if self.scroll_to_tab_id is not None:
+            return latest.tab_widgets.get(self.scroll_to_tab_id)
+        return None
+
+    def _first_visible_row(self, client):
+        """Позиция в окне первой вкладки, видимой в области прокрутки (по прошлой раскладке)."""
+        section = client.section
+        top = (self.scroll.verticalScrollBar().value()
+               - section.content.mapTo(self.scroll_content, QPoint(0, 0)).y())
+        item = section.rows.itemAt(section.rows.row_at(top))
+        if item is None:
+            return 0
+        w = item.widget()
+        if isinstance(w, GroupWidget):
+            members = client.store.group_members.get(w.group_id)
+            if not members:
+                return 0
+            tid = members[0]
+        else:
+            tid = w.tab_id
+        return client.store.pos.get(tid, 0)
+
+    def reconcile_client(self, client, force_update_active, expand_active):
+        """Приводит секцию браузера к его последнему снимку — по шагу за next().
+
+        Сначала по порядку окна расставляются уже существующие виджеты
+        (дёшево), затем создаются новые — начиная с видимых строк. Каждая
+        новая строка вставляется перед уже расставленными соседями, поэтому
+        между шагами секция всегда показывает верный порядок.
+        """
+        store     = client.store
+        tabs_data, active_id = client.view()
+        layout    = client.section.rows
+        selection = self.selected_tab_ids if self.selection_client == client.key else set()
+
+        # 1. Удаляем виджеты исчезнувших (или закрытых оптимистично) вкладок.
+        # Строка сразу уходит из раскладки (индексы ниже не «плывут»), но без
+        # setParent(None): перестройка стилей при нём — ~0.6 мс на виджет
+        current_tab_ids = store.by_id if tabs_data is store.tabs else {t.id for t in tabs_data}
+        for tid in list(client.tab_widgets.keys()):
+            if tid not in current_tab_ids:
+                selection.discard(tid)                  # снимаем из выделения
+                w = client.tab_widgets.pop(tid)
+                w.hide()
+                if not layout.take(w) and w.parentWidget() is not None:
+                    w.parentWidget().layout().removeWidget(w)
+                # Удаляем в шаге, а не deleteLater: иначе сотни удалений
+                # выполнятся разом после шага, вне бюджета кадра
+                sip.delete(w)
+                yield
+
+        # 2. Повтор незакрывшихся вкладок — в ClientState.settle_ops
+
+        # 3. Убираем виджеты исчезнувших групп. Их вкладки ещё живы и
+        # расставятся только в следующих шагах, поэтому сама группа удаляется
+        # после шага 4, когда в ней не останется вкладок
+        current_group_ids = store.groups
+        for gid in list(client.group_widgets.keys()):
+            if gid not in current_group_ids:
+                w = client.group_widgets.pop(gid)
+                w.hide()
+                layout.take(w)
+                client.retired_groups.append(w)
+
+        # 4. Обновляем / расставляем существующие виджеты
+        groups_map       = store.groups
+        all_groups_data  = list(store.groups.values())
+
+        if force_update_active and self.scroll_to_group and self.scroll_to_group[0] == client.key:
+            client.group_states[self.scroll_to_group[1]] = True
+
+        # Разворачиваем группу активной вкладки при автоскролле
+        if expand_active and active_id is not None:
+            ag_id = store.by_id[active_id].group_id if active_id in store.by_id else -1
+            if ag_id != -1:
+                client.group_states[ag_id] = True
+
+        top_pos       = -1      # позиция строки верхнего уровня (вкладка или группа)
+        placed_top    = []      # позиции уже стоящих в layout строк, по возрастанию
+        placed_child  = {}      # {group_id: [позиции в группе]}
+        child_count   = {}
+        missing       = []      # [(позиция в окне, tab, top_pos, group_id, позиция в группе)]
+        seen_groups   = set()
+
+        for i, tab in enumerate(tabs_data):
+            tid  = tab.id
+            g_id = tab.group_id if tab.group_id in groups_map else -1
+
+            if g_id != -1:
+                if g_id not in seen_groups:
+                    seen_groups.add(g_id)
+                    top_pos += 1
+                    if g_id not in client.group_widgets:
+                        client.group_widgets[g_id] = GroupWidget(
+                            groups_map[g_id], self, client.group_states.get(g_id, True), client.key
+                        )
+                    else:
+                        client.group_widgets[g_id].update_data(
+                            groups_map[g_id], client.group_states.get(g_id, True)
+                        )
+                    group_w = client.group_widgets[g_id]
+                    item = layout.itemAt(len(placed_top))
+                    if not item or item.widget() != group_w:
+                        layout.insertWidget(len(placed_top), group_w)
+                        group_w.show()
+                    placed_top.append(top_pos)
+                    placed_child[g_id] = []
+                    child_count[g_id]  = 0
+                child_pos = child_count[g_id]
+                child_count[g_id] += 1
+            else:
+                top_pos += 1
+                child_pos = None
+
+            tab_widget = client.tab_widgets.get(tid)
+            if tab_widget is None:
+                missing.append((i, tab, top_pos, g_id, child_pos))
+                continue
+            tab_widget.update_data(tab)
+            tab_widget.available_groups = all_groups_data
+
+            if g_id != -1:
+                group_w = client.group_widgets[g_id]
+                idx = len(placed_child[g_id])
+                g_item = group_w.tabs_layout.itemAt(idx)
+                if not g_item or g_item.widget() != tab_widget:
+                    layout.take(tab_widget)     # была строкой верхнего уровня
+                    group_w.tabs_layout.insertWidget(idx, tab_widget)
+                    tab_widget.show()           # см. шаг 5
+                placed_child[g_id].append(child_pos)
+            else:
+                idx = len(placed_top)
+                item = layout.itemAt(idx)
+                if not item or item.widget() != tab_widget:
+                    layout.insertWidget(idx, tab_widget)
+                    tab_widget.show()           # см. шаг 5
+                placed_top.append(top_pos)
+            yield
+
+        # Прежде prune: убранная группа всё ещё дочерняя для своего блока
+        for w in client.retired_groups:
+            sip.delete(w)
+        client.retired_groups.clear()
+        layout.prune()
+        if not missing:
+            return
+
+        # 5. Создаём новые виджеты: от первой видимой строки вниз, потом выше неё
+        anchor = self._first_visible_row(client)
+        if expand_active and active_id is not None:
+            anchor = next(i for i, t in enumerate(tabs_data) if t.id == active_id)
+        missing.sort(key=lambda m: (m[0] < anchor, abs(m[0] - anchor)))
+
+        for _i, tab, t_pos, g_id, child_pos in missing:
+            tab_widget = TabWidget(tab, self, client.key)
+            client.tab_widgets[tab.id] = tab_widget
+            # Если ID уже в выделении (маловероятно, но на всякий случай)
+            if tab.id in selection:
+                tab_widget.set_selected(True)
+            tab_widget.available_groups = all_groups_data
+
+            if g_id != -1:
+                placed = placed_child[g_id]
+                idx = bisect.bisect_left(placed, child_pos)
+                client.group_widgets[g_id].tabs_layout.insertWidget(idx, tab_widget)
+            else:
+                placed = placed_top
+                idx = bisect.bisect_left(placed, t_pos)
+                layout.insertWidget(idx, tab_widget)
+            placed.insert(idx, child_pos if g_id != -1 else t_pos)
+            # Показываем сразу: иначе Qt покажет строку и применит её стили
+            # уже после шага — несколько мс на строку вне бюджета кадра
+            tab_widget.show()
+            yield
 
     # ── Анимация ─────────────────────────────────────────────────────────────
     def enterEvent(self, event):
@@ -950,9 +2839,17 @@ class SidebarApp(QWidget):
         self.anim.stop()
         self.anim.setEndValue(QRect(0, 0, self.w_open, self.real_height))
         self.anim.start()
-        command_queue.put(json.dumps({"action": "request_update"}))
-        QTimer.singleShot(150, lambda: command_queue.put(
-            json.dumps({"action": "request_update"})))
+        if not PUSH_SUBSCRIPTION:
+            post_command(json.dumps({"action": "request_update"}))
+            QTimer.singleShot(150, lambda: post_command(
+                json.dumps({"action": "request_update"})))
+            return
+        # Сразу рисуем кэш, а расширение трогаем только если он устарел
+        if self.clients:
+            self.update_timer.start(0)
+        for client in self.clients.values():
+            if client.is_stale():
+                client.request_resync()
 
     def leaveEvent(self, event):
         if QApplication.activePopupWidget():
@@ -972,63 +2869,614 @@ class SidebarApp(QWidget):
 
 
 # ─── WebSocket сервер ─────────────────────────────────────────────────────────
-connected_clients = set()
+CLIENT_QUEUE_SIZE       = 256   # команд в очереди одного клиента до отключения
+CLIENT_SEND_TIMEOUT     = 2.0   # сек на один send
+CLIENT_MAX_TIMEOUTS     = 3     # таймаутов подряд до отключения
+CLIENT_METRICS_INTERVAL = 60.0  # сек между выводом метрик очередей
+
+# Транспорт: лимит входящего сообщения (по умолчанию в websockets — 1 МиБ,
+# превышение молча рвёт соединение) и сжатие, которое на localhost лишь тратит CPU
+WS_MAX_SIZE    = 64 * 1024 * 1024   # байт; None — без лимита
+WS_COMPRESSION = None               # None — без permessage-deflate, "deflate" — включить
+
+# Подписка, которую приложение объявляет расширению в ответном hello: только
+# эти поля вкладок, окна и события. Расширение не шлёт остального и молчит
+# на событиях, не задевающих подписанные поля (status loading/complete и т.п.)
+SNAPSHOT_FIELDS  = ("id", "title", "active", "groupId", "icon",   # строки панели
+                    "url",                 # дубликаты, домены, история, сессии
+                    "pinned", "discarded", "audible", "lastAccessed")   # выгрузка, очистка
+SNAPSHOT_WINDOWS = "current"   # "current" — окно в фокусе, "all" — все обычные окна
+SNAPSHOT_EVENTS  = ("created", "removed", "activated", "moved", "updated", "groups",
+                    "lifecycle")   # сообщения opened/closed о настоящих открытиях и закрытиях
+
+connected_clients = {}  # {websocket: ClientConnection}
+tab_owners        = {}  # {(client key, tab_id): ClientConnection} — кто прислал вкладку;
+                        # id вкладок у разных браузеров совпадают
+connection_ids    = itertools.count(1)
+
+
+class ClientConnection:
+    """Подключённое расширение: своя очередь исходящих команд и writer-задача.
+
+    Медленный или полумёртвый клиент копит команды только в своей очереди и
+    не задерживает остальных. Переполнение очереди или несколько таймаутов
+    подряд — клиент отключается.
+    """
+
+    def __init__(self, websocket):
+        self.websocket     = websocket
+        self.addr          = websocket.remote_address
+        self.conn_id       = next(connection_ids)
+        # key — постоянный идентификатор профиля из hello; до него — номер соединения
+        self.key           = f"conn-{self.conn_id}"
+        self.label         = f"Браузер {self.conn_id}"
+        self.queue         = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.tab_ids       = set()   # вкладки из последнего снимка
+        self.last_snapshot = 0.0     # monotonic() последнего снимка
+        self.sent          = 0
+        self.dropped       = 0
+        self.timeouts      = 0
+        self.max_depth     = 0
+        self.evicted       = False
+        self.assembly      = None    # снимок, собираемый из snapshot_part
+        self.subscription  = None    # согласованная подписка после hello
+        self.reports_lifecycle = False  # расширение шлёт opened/closed
+        self.writer        = asyncio.create_task(self.write_loop())
+
+    def enqueue(self, cmd):
+        if self.evicted:
+            return
+        try:
+            self.queue.put_nowait(cmd)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.evict("outbound queue overflow")
+            return
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    async def write_loop(self):
+        while True:
+            cmd = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send(cmd), CLIENT_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                print(f">>> Send timeout to {self.addr} ({self.timeouts})")
+                if self.timeouts >= CLIENT_MAX_TIMEOUTS:
+                    self.evict("send timeout")
+                    return
+                continue
+            except websockets.exceptions.ConnectionClosed:
+                return
+            self.timeouts = 0
+            self.sent += 1
+            print(f">>> Sent to {self.addr}")
+
+    def evict(self, reason):
+        if self.evicted:
+            return
+        self.evicted = True
+        print(f"!!! Evicting {self.addr}: {reason} (queued {self.queue.qsize()})")
+        # Сразу из маршрутизации: закрытие полумёртвого сокета может тянуться
+        # до close_timeout, а команды тем временем молча терялись бы в enqueue
+        connected_clients.pop(self.websocket, None)
+        self.drop_tabs()
+        asyncio.create_task(self.websocket.close(1008, reason))
+
+    def negotiate(self, capabilities):
+        """Подписка из нужного приложению и того, что умеет расширение.
+
+        Старое расширение capabilities не присылает — ему отправляем свою
+        подписку как есть, а оно её просто проигнорирует.
+        """
+        caps    = capabilities or {}
+        fields  = [f for f in SNAPSHOT_FIELDS if f in caps.get('fields', SNAPSHOT_FIELDS)]
+        events  = [e for e in SNAPSHOT_EVENTS if e in caps.get('events', SNAPSHOT_EVENTS)]
+        windows = SNAPSHOT_WINDOWS if SNAPSHOT_WINDOWS in caps.get('windows', [SNAPSHOT_WINDOWS]) else "current"
+        missing = set(SNAPSHOT_FIELDS) - set(fields)
+        if missing:
+            print(f"!!! {self.label} does not send fields: {', '.join(sorted(missing))}")
+        self.subscription   = {'fields': fields, 'windows': windows, 'events': events}
+        self.reports_lifecycle = 'lifecycle' in caps.get('events', ())
+        return self.subscription
+
+    def add_snapshot_part(self, part):
+        """Собирает большой снимок из частей; возвращает его после последней.
+
+        Части одного снимка идут по порядку с общими epoch/seq. Пропуск или
+        чужая часть сбрасывают сборку — недостающее состояние догонит resync
+        по пингу.
+        """
+        key = (part.get('epoch'), part.get('seq'))
+        idx = part.get('part', 0)
+        if idx == 0:
+            self.assembly = {'key': key, 'next': 0, 'tabs': [],
+                             'groups': part.get('groups', [])}
+        asm = self.assembly
+        if asm is None or asm['key'] != key or asm['next'] != idx:
+            print(f"!!! Dropped snapshot part {idx} from {self.addr}")
+            self.assembly = None
+            return None
+        asm['tabs'].extend(part.get('tabs', []))
+        asm['next'] += 1
+        if asm['next'] < part.get('parts', 1):
+            return None
+        self.assembly = None
+        return {'tabs': asm['tabs'], 'groups': asm['groups'],
+                'epoch': key[0], 'seq': key[1]}
+
+    def claim_tabs(self, tabs):
+        """Запоминает, какие вкладки принадлежат этому клиенту."""
+        if self.evicted:
+            return
+        new_ids = {t['id'] for t in tabs}
+        for tid in self.tab_ids - new_ids:
+            if tab_owners.get((self.key, tid)) is self:
+                del tab_owners[(self.key, tid)]
+        for tid in new_ids:
+            tab_owners[(self.key, tid)] = self
+        self.tab_ids = new_ids
+        self.last_snapshot = time.monotonic()
+
+    def drop_tabs(self):
+        for tid in self.tab_ids:
+            if tab_owners.get((self.key, tid)) is self:
+                del tab_owners[(self.key, tid)]
+        self.tab_ids = set()
+
+    def release(self):
+        self.writer.cancel()
+        self.drop_tabs()
+
+
+def latest_client():
+    """Клиент, приславший самый свежий снимок, — для команд без вкладки."""
+    return max(connected_clients.values(), key=lambda c: c.last_snapshot)
+
+
+def route_command(payload):
+    """Возвращает [(client, payload)] — команда уходит только владельцу вкладки.
+
+    Вкладку ищем у браузера из payload['client'] (при переподключении у него
+    бывает два соединения — берём приславшее её), без ключа — у браузера
+    с самым свежим снимком.
+    """
+    key = payload.pop('client', None)
+    if key is not None:
+        conns = [c for c in connected_clients.values() if c.key == key]
+        if not conns:
+            print(f"!!! Client {key} is not connected")
+            return []
+        default = max(conns, key=lambda c: c.conn_id)
+    elif payload.get('action') == 'request_update':
+        return [(c, payload) for c in connected_clients.values()]
+    else:
+        default = latest_client()
+        key     = default.key
+    if 'ids' in payload:
+        by_owner = {}
+        for tid in payload['ids']:
+            owner = tab_owners.get((key, tid), default)
+            by_owner.setdefault(owner, []).append(tid)
+        return [(c, {**payload, 'ids': ids}) for c, ids in by_owner.items()]
+    if 'id' in payload:
+        return [(tab_owners.get((key, payload['id']), default), payload)]
+    return [(default, payload)]
+
+
+def dispatch_command(cmd):
+    print(f">>> COMMAND: {cmd}")
+    if not connected_clients:
+        print("!!! No extensions connected")
+        return
+    for client, payload in route_command(json.loads(cmd)):
+        client.enqueue(json.dumps(payload))
+
+
+def log_client_metrics():
+    for c in connected_clients.values():
+        print(f">>> Client {c.addr}: depth={c.queue.qsize()} max_depth={c.max_depth} "
+              f"sent={c.sent} dropped={c.dropped} timeouts={c.timeouts}")
 
 
 async def ws_handler(websocket):
     addr = websocket.remote_address
     print(f"Bridge connected: {addr}")
-    connected_clients.add(websocket)
+    client = ClientConnection(websocket)
+    connected_clients[websocket] = client
     print(f"Total connected clients: {len(connected_clients)}")
     try:
         async for message in websocket:
             data = json.loads(message)
+            if data.get('type') == 'hello':
+                client.key   = data.get('instance') or client.key
+                client.label = data.get('browser') or client.label
+                if data.get('instance'):
+                    client.label += f" · {data['instance'][:4]}"
+                print(f"Hello from {client.label} ({client.key})")
+                # Ответный hello: что присылать. Расширение шлёт первый снимок после него
+                client.enqueue(json.dumps({'type': 'hello', **client.negotiate(data.get('capabilities'))}))
+                signals.client_connected.emit(client.key, {'label': client.label,
+                                                           'reports_lifecycle': client.reports_lifecycle})
+                continue
+            if client.subscription is None:
+                # До hello неизвестно, чей это браузер: секцию под conn-N не заводим
+                print(f"!!! {data.get('type', 'snapshot')} from {addr} before hello, ignored")
+                continue
             if data.get('type') == 'ping':
+                signals.heartbeat_received.emit(client.key, data)
+                continue
+            if data.get('type') == 'icons':
+                signals.icons_received.emit(client.key, data.get('icons', {}))
                 continue
-            signals.data_received.emit(data)
-    except websockets.exceptions.ConnectionClosed:
-        print(f"Bridge disconnected: {addr}")
+            if data.get('type') in ('opened', 'closed'):
+                signals.tab_lifecycle.emit(client.key, data['type'], data.get('ids', []))
+                continue
+            if data.get('type') == 'restore_ack':
+                signals.restore_ack.emit(client.key, data)
+                continue
+            if data.get('type') == 'snapshot_part':
+                data = client.add_snapshot_part(data)
+                if data is None:
+                    continue
+            if 'tabs' in data:
+                client.claim_tabs(data['tabs'])
+            signals.data_received.emit(client.key, data)
+    except websockets.exceptions.ConnectionClosed as e:
+        # 1009 — сообщение больше WS_MAX_SIZE
+        print(f"Bridge disconnected: {addr} ({e})")
     except Exception as e:
         print(f"WS Error: {e}")
     finally:
-        connected_clients.discard(websocket)
+        connected_clients.pop(websocket, None)
+        client.release()
+        if client.subscription is not None and not any(
+                c.key == client.key for c in connected_clients.values()):
+            signals.client_disconnected.emit(client.key)
         print(f"Client removed. Total connected: {len(connected_clients)}")
 
 
 async def send_worker():
-    """Отправляет команды из Qt-очереди всем подключённым расширениям."""
+    """Периодически печатает метрики очередей клиентов.
+
+    Команды приходят через post_command сразу в цикл — опроса нет.
+    """
     print("Send worker is ALIVE and running")
     while True:
+        await asyncio.sleep(CLIENT_METRICS_INTERVAL)
         try:
-            await asyncio.sleep(0.01)
-            try:
-                cmd = command_queue.get_nowait()
-                print(f">>> COMMAND: {cmd}")
-            except queue.Empty:
-                continue
-
-            if not connected_clients:
-                print("!!! No extensions connected")
-            else:
-                clients = list(connected_clients)
-                print(f">>> Sending to {len(clients)} client(s)")
-                for client in clients:
-                    try:
-                        await client.send(cmd)
-                        print(f">>> Sent to {client.remote_address}")
-                    except Exception as e:
-                        print(f">>> Failed to send: {e}")
+            log_client_metrics()
         except Exception as e:
             print(f"Worker Error: {e}")
-            import traceback
-            traceback.print_exc()
 
 
-async def main_async():
-    async with websockets.serve(ws_handler, "127.0.0.1", 8765):
+async def main_async(in_qt_thread=False):
+    global ws_loop, loop_is_qt
+    async with websockets.serve(ws_handler, "127.0.0.1", 8765,
+                                max_size=WS_MAX_SIZE, compression=WS_COMPRESSION):
         print("WebSocket Server started on ws://127.0.0.1:8765")
+        # Под loop_lock: post_command либо уже видит ws_loop, либо положил
+        # команду в очередь до публикации — и она уйдёт здесь, раньше следующих
+        with loop_lock:
+            loop_is_qt = in_qt_thread
+            ws_loop    = asyncio.get_running_loop()
+            while True:
+                try:
+                    cmd = command_queue.get_nowait()
+                except queue.Empty:
+                    break
+                ws_loop.call_soon(dispatch_command, cmd)
         asyncio.create_task(send_worker())
-        await asyncio.Future()
+        api_server = None
+        if QUERY_API:
+            # API необязателен: занятый порт не должен ронять сервер расширений
+            try:
+                api_server = await asyncio.start_server(query_api.handle, QUERY_API_HOST, QUERY_API_PORT)
+                print(f"Query API on http://{QUERY_API_HOST}:{QUERY_API_PORT}")
+            except OSError as e:
+                print(f"!!! Query API disabled: cannot listen on {QUERY_API_HOST}:{QUERY_API_PORT} ({e})")
+        try:
+            await asyncio.Future()
+        finally:
+            if api_server is not None:
+                api_server.close()
+
+
+def use_qt_event_loop():
+    if EVENT_LOOP_MODE == "thread":
+        return False
+    if qasync is None:
+        if EVENT_LOOP_MODE == "qasync":
+            print("!!! qasync is not installed, falling back to a server thread")
+        return False
+    return True
+
+
+# ─── Локальный API (только чтение) ────────────────────────────────────────────
+# Скрипты и лаунчеры спрашивают состояние вкладок у панели, а не у браузера:
+#   GET /clients                     браузеры и профили
+#   GET /tabs?client=&domain=&group=&q=&active=&pinned=&discarded=&audible=&limit=&fields=
+#   GET /groups?client=
+#   GET /active?fields=              активная вкладка каждого браузера
+#   GET /events?client=&fields=      поток изменений (text/event-stream)
+#   GET /history/time?hours=&client=&limit=   где прошло время (по истории)
+#   GET /history/stale?days=&client=          открытые, но давно не активированные
+QUERY_API        = True
+QUERY_API_HOST   = "127.0.0.1"
+QUERY_API_PORT   = 8766
+QUERY_FEED_QUEUE = 256     # событий в очереди подписчика до отключения
+QUERY_FEED_PING  = 15.0    # сек между keep-alive комментариями в /events
+
+# Имена полей — как в снимке расширения
+TAB_FIELDS = {
+    'id': 'id', 'title': 'title', 'url': 'url', 'icon': 'icon', 'groupId': 'group_id',
+    'active': 'active', 'pinned': 'pinned', 'discarded': 'discarded',
+    'audible': 'audible', 'lastAccessed': 'last_accessed',
+}
+
+
+def tab_json(rec, fields):
+    return {name: getattr(rec, TAB_FIELDS[name]) for name in fields}
+
+
+class ApiView:
+    """Неизменяемый срез ClientState для потока сервера.
+
+    Записи TabRecord/GroupRecord после создания не меняются, а TabStore
+    заменяет списки и словари целиком, поэтому срез — это просто ссылки.
+    """
+    __slots__ = ('key', 'label', 'connected', 'seq', 'tabs', 'by_id', 'groups',
+                 'group_members', 'active_id')
+
+    def __init__(self, client):
+        self.key       = client.key
+        self.label     = client.label
+        self.connected = client.connected
+        self.seq       = client.state_seq
+        self.tabs      = client.store.tabs
+        self.by_id     = client.store.by_id
+        self.groups    = client.store.groups
+        self.group_members = client.store.group_members
+        self.active_id = client.store.active_id
+
+    def info(self):
+        return {'client': self.key, 'label': self.label, 'connected': self.connected,
+                'seq': self.seq, 'tabs': len(self.tabs), 'active': self.active_id}
+
+
+class QueryApi:
+    """HTTP на loopback поверх кэша панели; браузер не опрашивается."""
+
+    def __init__(self):
+        self.views       = {}      # {client_key: ApiView} — заменяется из потока Qt
+        self.subscribers = set()   # {(asyncio.Queue, client_key | None)}
+
+    # ── Поток Qt ─────────────────────────────────────────────────────────────
+    def publish(self, client, diff=None):
+        view = ApiView(client)
+        self.views[client.key] = view
+        if diff and self.subscribers and ws_loop is not None:
+            event = ('tabs', view, [r for r in diff.added], [r.id for r in diff.removed],
+                     [new for _old, new in diff.changed], diff.reordered, diff.groups_changed)
+            call_in_loop(self._broadcast, event)
+
+    def drop(self, key):
+        self.views.pop(key, None)
+        if self.subscribers and ws_loop is not None:
+            call_in_loop(self._broadcast, ('client_removed', key))
+
+    # ── Поток сервера ────────────────────────────────────────────────────────
+    def _broadcast(self, event):
+        key = event[1].key if event[0] == 'tabs' else event[1]
+        for sub in list(self.subscribers):
+            queue_, only = sub
+            if only is not None and only != key:
+                continue
+            try:
+                queue_.put_nowait(event)
+            except asyncio.QueueFull:
+                # Не читает — отключаем, как медленного клиента WebSocket
+                self.subscribers.discard(sub)
+                while not queue_.empty():
+                    queue_.get_nowait()
+                queue_.put_nowait(None)
+
+    @staticmethod
+    def _fields(query):
+        names = [f for f in query.get('fields', [''])[0].split(',') if f]
+        bad = [f for f in names if f not in TAB_FIELDS]
+        if bad:
+            raise ValueError(f"unknown field(s): {', '.join(bad)}")
+        return names or list(TAB_FIELDS)
+
+    @staticmethod
+    def _flag(query, name):
+        value = query.get(name, [None])[0]
+        if value is None:
+            return None
+        return value.lower() in ('1', 'true', 'yes')
+
+    def _selected_views(self, query):
+        key = query.get('client', [None])[0]
+        views = list(self.views.values())
+        return [v for v in views if v.key == key] if key else views
+
+    def query_tabs(self, query):
+        fields  = self._fields(query)
+        domain  = query.get('domain', [None])[0]
+        group   = query.get('group', [None])[0]
+        text    = (query.get('q', [''])[0]).lower()
+        limit   = int(query.get('limit', ['0'])[0] or 0)
+        flags   = {name: self._flag(query, name) for name in ('active', 'pinned', 'discarded', 'audible')}
+        flags   = {name: v for name, v in flags.items() if v is not None}
+        result  = []
+        for view in self._selected_views(query):
+            tabs = view.tabs
+            if group is not None:
+                tabs = [view.by_id[tid] for tid in view.group_members.get(int(group), ())]
+            for rec in tabs:
+                if domain and url_domain(rec.url) != domain:
+                    continue
+                if text and text not in rec.title.lower() and text not in rec.url.lower():
+                    continue
+                if any(getattr(rec, name) != v for name, v in flags.items()):
+                    continue
+                item = tab_json(rec, fields)
+                item['client'] = view.key
+                result.append(item)
+                if limit and len(result) >= limit:
+                    return result
+        return result
+
+    def query_groups(self, query):
+        return [{'client': v.key, 'id': g.id, 'title': g.title, 'color': g.color}
+                for v in self._selected_views(query) for g in v.groups.values()]
+
+    def query_active(self, query):
+        fields = self._fields(query)
+        result = []
+        for view in self._selected_views(query):
+            rec = view.by_id.get(view.active_id)
+            if rec is not None:
+                result.append(dict(tab_json(rec, fields), client=view.key))
+        return result
+
+    def query_history(self, path, query):
+        if history.thread is None:
+            raise ValueError("history is disabled")
+        client = query.get('client', [None])[0]
+        if path == '/history/time':
+            hours = float(query.get('hours', ['24'])[0])
+            limit = int(query.get('limit', ['50'])[0])
+            rows  = history.time_on_tabs(time.time() - hours * 3600, client, limit)
+            return [{'url': url, 'title': title, 'seconds': round(sec, 1)} for url, title, sec in rows]
+        if path == '/history/stale':
+            cutoff = time.time() - float(query.get('days', ['7'])[0]) * 86400
+            tabs   = [(v.key, rec) for v in self._selected_views(query) for rec in v.tabs]
+            last   = history.last_active({rec.url for _key, rec in tabs})
+            result = []
+            for key, rec in tabs:
+                # История или lastAccessed Chrome; без того и другого — не знаем, не «давно»
+                seen = max(last[rec.url] or 0, rec.last_accessed / 1000)
+                if seen and seen < cutoff:
+                    result.append({'client': key, 'id': rec.id, 'title': rec.title,
+                                   'url': rec.url, 'lastActive': seen})
+            return result
+        return None
+
+    def _event_text(self, event, fields):
+        if event[0] == 'client_removed':
+            return 'client_removed', {'client': event[1]}
+        if event[0] == 'snapshot':
+            view = event[1]
+            return 'snapshot', dict(view.info(), tabs=[tab_json(r, fields) for r in view.tabs],
+                                    groups=[{'id': g.id, 'title': g.title, 'color': g.color}
+                                            for g in view.groups.values()])
+        _kind, view, added, removed, changed, reordered, groups_changed = event
+        payload = dict(view.info(),
+                       added=[tab_json(r, fields) for r in added],
+                       removed=removed,
+                       changed=[tab_json(r, fields) for r in changed],
+                       reordered=reordered)
+        if reordered:
+            payload['order'] = [r.id for r in view.tabs]
+        if groups_changed:
+            payload['groups'] = [{'id': g.id, 'title': g.title, 'color': g.color}
+                                 for g in view.groups.values()]
+        return 'tabs', payload
+
+    async def handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5.0)
+            lines = head.decode('latin-1').split("\r\n")
+            method, target, _version = lines[0].split(" ", 2)
+            headers = {k.strip().lower(): v.strip() for k, _, v in
+                       (line.partition(":") for line in lines[1:] if line)}
+            # Защита от DNS rebinding: страница из браузера не прочитает вкладки
+            host = headers.get('host', '').rsplit(':', 1)[0]
+            if host not in ('127.0.0.1', 'localhost', '[::1]'):
+                return await self._respond(writer, 403, {'error': 'forbidden host'})
+            if method != 'GET':
+                return await self._respond(writer, 405, {'error': 'read-only API'})
+            parts = urlsplit(target)
+            query = parse_qs(parts.query)
+            if parts.path == '/events':
+                return await self._stream(writer, query)
+            if parts.path.startswith('/history/'):
+                # SQLite — в пуле потоков, чтобы не держать цикл сервера
+                try:
+                    body = await asyncio.to_thread(self.query_history, parts.path, query)
+                except (ValueError, sqlite3.Error) as e:
+                    return await self._respond(writer, 400, {'error': str(e)})
+                if body is None:
+                    return await self._respond(writer, 404, {'error': 'not found'})
+                return await self._respond(writer, 200, body)
+            routes = {
+                '/clients': lambda q: [v.info() for v in self.views.values()],
+                '/tabs':    self.query_tabs,
+                '/groups':  self.query_groups,
+                '/active':  self.query_active,
+            }
+            route = routes.get(parts.path.rstrip('/') or '/')
+            if route is None:
+                return await self._respond(writer, 404, {'error': 'not found', 'paths': list(routes) + ['/events']})
+            try:
+                body = route(query)
+            except ValueError as e:
+                return await self._respond(writer, 400, {'error': str(e)})
+            await self._respond(writer, 200, body)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except Exception as e:
+            print(f"API Error: {e}")
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        reason = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden',
+                  404: 'Not Found', 405: 'Method Not Allowed'}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\n"
+                     f"Content-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def _stream(self, writer, query):
+        try:
+            fields = self._fields(query)
+        except ValueError as e:
+            return await self._respond(writer, 400, {'error': str(e)})
+        only = query.get('client', [None])[0]
+        sub  = (asyncio.Queue(maxsize=QUERY_FEED_QUEUE), only)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+        # Сначала текущее состояние, дальше только изменения — без гонки с GET /tabs
+        for view in list(self.views.values()):
+            if only is None or view.key == only:
+                sub[0].put_nowait(('snapshot', view))
+        self.subscribers.add(sub)
+        print(f"API subscriber connected ({len(self.subscribers)})")
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub[0].get(), QUERY_FEED_PING)
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                    await writer.drain()
+                    continue
+                if event is None:
+                    break
+                name, payload = self._event_text(event, fields)
+                writer.write(f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(sub)
+            print(f"API subscriber left ({len(self.subscribers)})")
+
+
+query_api = QueryApi()
 
 
 def resource_path(relative_path):
@@ -1060,10 +3508,26 @@ if __name__ == "__main__":
     tray_icon.setContextMenu(tray_menu)
     tray_icon.show()
 
-    threading.Thread(target=lambda: asyncio.run(main_async()), daemon=True).start()
-
     network_manager = QNetworkAccessManager()
     window = SidebarApp()
     window.show()
 
+    if HISTORY_ENABLED:
+        history.start()
+        app.aboutToQuit.connect(history.close)
+
+    if use_qt_event_loop():
+        # Один цикл: сигналы и команды идут без межпоточных переходов,
+        # а сервер закрывается вместе с приложением
+        print("Event loop: asyncio on Qt (qasync)")
+        loop = qasync.QEventLoop(app)
+        asyncio.set_event_loop(loop)
+        with loop:
+            server = loop.create_task(main_async(in_qt_thread=True))
+            app.aboutToQuit.connect(server.cancel)
+            loop.run_forever()
+        sys.exit(0)
+
+    print("Event loop: asyncio in a server thread")
+    threading.Thread(target=lambda: asyncio.run(main_async()), daemon=True).start()
     sys.exit(app.exec())
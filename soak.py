@@ -0,0 +1,462 @@
+"""Долгий прогон панели без браузера: ищет медленные утечки.
+
+Поднимает SidebarApp в offscreen-режиме вместе с WebSocket-сервером из
+main.py и подключает к нему имитацию расширения, которая часами открывает,
+закрывает, переключает и группирует вкладки, отвечает на команды и get_icons.
+
+Раз в --sample секунд снимаются RSS, число живых QObject и виджетов,
+размеры кэшей и задержка «снимок → отрисовка». В конце по каждой метрике
+сравниваются медианы первой и последней трети прогона (после прогрева):
+рост выше порога — код выхода 1.
+
+    python soak.py --minutes 240
+    python soak.py --minutes 10 --churn 0.05 --csv soak.csv
+
+С --bench-tabs N вместо долгого прогона меряется первая отрисовка окна из
+N вкладок: снимок приходит частями snapshot_part, как от background.js.
+
+    python soak.py --bench-tabs 20000
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+import threading
+import statistics
+import ctypes
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import websockets
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import Qt, QObject, QTimer, QBuffer, QByteArray
+from PyQt6.QtGui import QPixmap, QColor
+from PyQt6.QtNetwork import QNetworkAccessManager
+
+import main
+
+# Допустимый рост метрики: относительный и абсолютный (оба должны быть превышены)
+THRESHOLDS = {
+    "rss_mib":       (0.10, 8.0),
+    "qobjects":      (0.05, 50),
+    "wrappers":      (0.05, 50),
+    "widgets":       (0.05, 20),
+    "icon_cache":    (0.10, 20),
+    "icon_waiting":  (0.10, 20),
+    "tab_widgets":   (0.10, 20),
+    "index_extra":   (0.10, 20),
+    "pending_ops":   (0.50, 10),
+    "latency_ms":    (0.50, 50.0),
+}
+
+
+SNAPSHOT_CHUNK_TABS = 1000   # как в background.js
+BENCH_SCREEN_ROWS   = 40     # строк на экране: столько виджетов — «первый экран готов»
+
+# ─── Имитация расширения ─────────────────────────────────────────────────────
+def icon_data_url(color):
+    pixmap = QPixmap(16, 16)
+    pixmap.fill(QColor(color))
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QBuffer.OpenModeFlag.WriteOnly)
+    pixmap.save(buf, "PNG")
+    return "data:image/png;base64," + bytes(data.toBase64()).decode()
+
+
+class MockExtension:
+    """Окно браузера в памяти: те же сообщения, что шлёт background.js."""
+
+    def __init__(self, instance, tabs, domains, seed):
+        self.instance = instance
+        self.rnd      = random.Random(seed)
+        self.domains  = domains
+        self.icons    = {f"ic{i:03d}": icon_data_url(QColor.fromHsv(i * 7 % 360, 200, 220).name())
+                         for i in range(domains)}
+        self.next_id  = 1
+        self.groups   = {}
+        self.tabs     = [self._new_tab() for _ in range(tabs)]
+        self.tabs[0]['active'] = True
+        self.target   = tabs
+        self.seq      = 0
+
+    def _new_tab(self):
+        tid = self.next_id
+        self.next_id += 1
+        d = self.rnd.randrange(self.domains)
+        return {"id": tid, "title": f"Page {tid}", "active": False, "groupId": -1,
+                "icon": f"ic{d:03d}", "url": f"https://site{d}.example/{tid}",
+                "pinned": False, "lastAccessed": time.time() * 1000,
+                "discarded": False, "audible": False}
+
+    def snapshot(self):
+        self.seq += 1
+        return {"tabs": self.tabs, "epoch": "soak", "seq": self.seq,
+                "groups": [{"id": g, "title": t, "color": "blue"} for g, t in self.groups.items()]}
+
+    def messages(self):
+        """Снимок так, как его шлёт background.js: целиком или частями."""
+        snap = self.snapshot()
+        tabs = snap["tabs"]
+        if len(tabs) <= SNAPSHOT_CHUNK_TABS:
+            return [snap]
+        parts = -(-len(tabs) // SNAPSHOT_CHUNK_TABS)
+        return [{"type": "snapshot_part", "epoch": snap["epoch"], "seq": snap["seq"],
+                 "part": part, "parts": parts,
+                 "tabs": tabs[part * SNAPSHOT_CHUNK_TABS:(part + 1) * SNAPSHOT_CHUNK_TABS],
+                 **({"groups": snap["groups"]} if part == 0 else {})}
+                for part in range(parts)]
+
+    def _activate(self, tid):
+        for t in self.tabs:
+            t['active'] = t['id'] == tid
+            if t['active']:
+                t['lastAccessed'] = time.time() * 1000
+
+    def churn(self):
+        """Одно случайное действие пользователя в браузере."""
+        r = self.rnd.random()
+        # Открытие/закрытие тянут число вкладок к target, чтобы рост метрик
+        # означал утечку, а не случайное блуждание размера окна
+        p_open = 0.5 * self.target / (self.target + len(self.tabs))
+        if r < p_open or len(self.tabs) < 5:
+            self.tabs.insert(self.rnd.randrange(len(self.tabs) + 1), self._new_tab())
+        elif r < 0.50:
+            self.tabs.pop(self.rnd.randrange(len(self.tabs)))
+            if not any(t['active'] for t in self.tabs):
+                self.tabs[0]['active'] = True
+        elif r < 0.70:
+            self._activate(self.rnd.choice(self.tabs)['id'])
+        elif r < 0.85:
+            self.rnd.choice(self.tabs)['title'] = f"Title {self.rnd.randrange(10 ** 6)}"
+        elif r < 0.95:
+            gid = self.rnd.randrange(1, 6)
+            self.groups[gid] = f"Group {gid}"
+            self.rnd.choice(self.tabs)['groupId'] = gid
+        else:
+            used = {t['groupId'] for t in self.tabs}
+            self.groups = {g: n for g, n in self.groups.items() if g in used}
+            tab = self.rnd.choice(self.tabs)
+            tab['groupId'] = -1
+
+    def handle(self, cmd):
+        """Команда от приложения; возвращает сообщения-ответы."""
+        action = cmd.get('action')
+        if action == 'get_icons':
+            return [{"type": "icons", "icons": {d: self.icons[d] for d in cmd['digests'] if d in self.icons}}]
+        if action == 'activate':
+            self._activate(cmd['id'])
+        elif action in ('close', 'close_multiple'):
+            ids = set(cmd.get('ids') or [cmd.get('id')])
+            self.tabs = [t for t in self.tabs if t['id'] not in ids] or [self._new_tab()]
+        elif action == 'request_update':
+            pass
+        else:
+            return []
+        return self.messages()
+
+
+async def run_extension(ext, churn_interval, stop):
+    """Подключает расширение; churn_interval=None — один снимок и только ответы на команды."""
+    while not stop.is_set():
+        try:
+            async with websockets.connect("ws://127.0.0.1:8765", max_size=None) as ws:
+                await ws.send(json.dumps({"type": "hello", "instance": ext.instance, "browser": "Soak"}))
+                ext.sent_at = time.perf_counter()
+                for message in ext.messages():
+                    await ws.send(json.dumps(message))
+
+                async def reader():
+                    async for message in ws:
+                        for reply in ext.handle(json.loads(message)):
+                            await ws.send(json.dumps(reply))
+
+                read_task = asyncio.create_task(reader())
+                while not stop.is_set() and not read_task.done():
+                    if churn_interval is None:
+                        await asyncio.sleep(0.5)
+                        continue
+                    ext.churn()
+                    for message in ext.messages():
+                        await ws.send(json.dumps(message))
+                    await ws.send(json.dumps({"type": "ping", "epoch": "soak", "seq": ext.seq}))
+                    await asyncio.sleep(churn_interval)
+                read_task.cancel()
+        except (OSError, websockets.exceptions.ConnectionClosed):
+            await asyncio.sleep(0.5)
+
+
+# ─── Метрики ─────────────────────────────────────────────────────────────────
+class ProcessMemoryCounters(ctypes.Structure):
+    """PROCESS_MEMORY_COUNTERS из psapi.h."""
+    _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + [
+        (name, ctypes.c_size_t) for name in (
+            "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+            "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+            "PagefileUsage", "PeakPagefileUsage")]
+
+
+def rss_mib():
+    """Текущий RSS процесса, МиБ — без сторонних пакетов."""
+    if sys.platform == "win32":
+        kernel32 = ctypes.WinDLL("kernel32")
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        kernel32.K32GetProcessMemoryInfo.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters), ctypes.c_ulong]
+        counters = ProcessMemoryCounters(cb=ctypes.sizeof(ProcessMemoryCounters))
+        if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(),
+                                                ctypes.byref(counters), counters.cb):
+            raise ctypes.WinError()
+        return counters.WorkingSetSize / 2 ** 20
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # macOS и BSD: только пиковый RSS (в байтах на macOS), но утечку видно и по нему
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class Sampler:
+    def __init__(self, app, window):
+        self.app       = app
+        self.window    = window
+        self.samples   = []
+        self.latencies = []
+        self.pending   = None   # perf_counter() первого неотрисованного снимка
+        # Задержка «снимок пришёл → проход отрисовки завершён»
+        main.signals.data_received.connect(self.on_snapshot)
+        window.ui_updated.connect(self.on_rendered)
+
+    def on_snapshot(self, _key, _data):
+        if self.pending is None:
+            self.pending = time.perf_counter()
+
+    def on_rendered(self):
+        if self.pending is not None:
+            self.latencies.append((time.perf_counter() - self.pending) * 1000)
+            self.pending = None
+
+    def sample(self, elapsed):
+        gc.collect()
+        w = self.window
+        clients = list(w.clients.values())
+        row = {
+            "t":            round(elapsed, 1),
+            "rss_mib":      round(rss_mib(), 2),
+            "qobjects":     len(w.findChildren(QObject)),
+            "wrappers":     sum(1 for o in gc.get_objects() if isinstance(o, QObject)),
+            "widgets":      len(QApplication.allWidgets()),
+            "icon_cache":   len(main.icon_cache),
+            "icon_waiting": sum(len(v) for v in w.icons.waiting.values()),
+            "tab_widgets":  sum(len(c.tab_widgets) + len(c.group_widgets) for c in clients),
+            # записи индекса сверх живых вкладок
+            "index_extra":  sum(len(c.index.urls) + len(c.index.first_seen) - 2 * len(c.store)
+                                for c in clients),
+            "pending_ops":  sum(len(c.pending_ops) for c in clients),
+            "tabs":         sum(len(c.store) for c in clients),
+            "latency_ms":   round(statistics.median(self.latencies), 1) if self.latencies else 0.0,
+        }
+        self.latencies.clear()
+        self.samples.append(row)
+        print("  ".join(f"{k}={v}" for k, v in row.items()), file=sys.__stdout__, flush=True)
+
+
+class RenderBench:
+    """Первая отрисовка большого окна: отправка частей → снимок в UI → конец прохода.
+
+    Таймер раз в 1 мс меряет, насколько надолго занят цикл событий Qt: это
+    задержка ввода, пока окно собирается и рисуется.
+    """
+
+    def __init__(self, app, window, ext):
+        self.app      = app
+        self.window   = window
+        self.ext      = ext
+        self.received = None
+        self.screen   = None
+        self.gaps     = []
+        self.last     = time.perf_counter()
+        main.signals.data_received.connect(self.on_snapshot)
+        self.probe = QTimer()
+        self.probe.setInterval(1)
+        self.probe.timeout.connect(self.tick)
+        self.probe.start()
+
+    def tick(self):
+        now = time.perf_counter()
+        self.gaps.append(now - self.last)
+        self.last = now
+        if self.screen is None and any(len(c.tab_widgets) >= BENCH_SCREEN_ROWS
+                                       for c in self.window.clients.values()):
+            self.screen = now
+
+    def on_snapshot(self, _key, _data):
+        if self.received is None:
+            self.received = time.perf_counter()
+
+    def on_rendered(self):
+        if self.received is None:
+            return
+        done = time.perf_counter()
+        self.probe.stop()
+        gaps = sorted(self.gaps)
+        parts = -(-len(self.ext.tabs) // SNAPSHOT_CHUNK_TABS)
+        sys.__stdout__.write(
+            f"tabs={len(self.ext.tabs)}  parts={parts}"
+            f"  received_ms={(self.received - self.ext.sent_at) * 1000:.0f}"
+            f"  first_screen_ms={(self.screen - self.ext.sent_at) * 1000:.0f}"
+            f"  first_render_ms={(done - self.ext.sent_at) * 1000:.0f}"
+            f"  max_stall_ms={gaps[-1] * 1000:.1f}"
+            f"  p99_stall_ms={gaps[int(0.99 * len(gaps))] * 1000:.1f}"
+            f"  stalls_over_frame={sum(g > 1 / 60 for g in gaps)}\n")
+        self.app.quit()
+
+
+class LeftClick:
+    def button(self):
+        return Qt.MouseButton.LeftButton
+
+
+def click_random_tab(window, rnd):
+    """Имитирует клик по вкладке: оптимистичная активация и команда расширению."""
+    clients = [c for c in window.clients.values() if c.tab_widgets]
+    if not clients:
+        return
+    client = rnd.choice(clients)
+    widget = client.tab_widgets[rnd.choice(list(client.tab_widgets))]
+    if rnd.random() < 0.8:
+        widget.on_frame_click(LeftClick())
+    else:
+        widget.on_close_click()
+
+
+def trend_failures(samples, warmup):
+    rows = [r for r in samples if r["t"] >= warmup]
+    if len(rows) < 6:
+        print("!!! Not enough samples after warm-up to judge trends", file=sys.__stdout__)
+        return []
+    third  = len(rows) // 3
+    failed = []
+    for name, (rel, absolute) in THRESHOLDS.items():
+        first = statistics.median(r[name] for r in rows[:third])
+        last  = statistics.median(r[name] for r in rows[-third:])
+        grow  = last - first
+        if grow > absolute and grow > rel * max(first, 1e-9):
+            failed.append(f"{name}: {first:g} -> {last:g}")
+    return failed
+
+
+# ─── Точка входа ─────────────────────────────────────────────────────────────
+async def run_server(stop):
+    """main_async до stop; asyncio.run затем отменит и дождётся задач сервера."""
+    server = asyncio.create_task(main.main_async())
+    while not stop.is_set() and not server.done():
+        await asyncio.sleep(0.2)
+    server.cancel()
+    await asyncio.gather(server, return_exceptions=True)
+
+
+def start_threads(stop, extensions, churn):
+    """Сервер и расширения — каждый в своём потоке со своим циклом asyncio."""
+    threads = [threading.Thread(target=lambda: asyncio.run(run_server(stop)), name="server")]
+    for ext in extensions:
+        threads.append(threading.Thread(
+            target=lambda ext=ext: asyncio.run(run_extension(ext, churn, stop)), name=ext.instance))
+    for thread in threads:
+        thread.daemon = True      # зависший поток не должен держать выход
+        thread.start()
+    return threads
+
+
+def stop_threads(stop, threads):
+    """Останавливает потоки до выхода: иначе они шлют сигналы уже удалённым объектам Qt."""
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5.0)
+        if thread.is_alive():
+            print(f"!!! Thread {thread.name} did not stop", file=sys.__stdout__)
+
+
+def render_bench(app, window, tabs):
+    ext   = MockExtension("bench", tabs, domains=60, seed=0)
+    bench = RenderBench(app, window, ext)
+    window.ui_updated.connect(bench.on_rendered)
+    stop    = threading.Event()
+    threads = start_threads(stop, [ext], None)
+    QTimer.singleShot(10 * 60 * 1000, app.quit)   # не дождались отрисовки
+    app.exec()
+    stop_threads(stop, threads)
+    if bench.probe.isActive():
+        sys.__stdout__.write("!!! No render within 10 minutes\n")
+        return 1
+    return 0
+
+
+def soak(app, window, args):
+    sampler = Sampler(app, window)
+    stop    = threading.Event()
+    threads = start_threads(stop, [MockExtension(f"soak-{i}", args.tabs, domains=60, seed=i)
+                                   for i in range(args.browsers)], args.churn)
+
+    rnd     = random.Random(42)
+    started = time.monotonic()
+    clicks  = QTimer()
+    clicks.timeout.connect(lambda: click_random_tab(window, rnd))
+    clicks.start(int(args.clicks * 1000))
+    sampling = QTimer()
+    sampling.timeout.connect(lambda: sampler.sample(time.monotonic() - started))
+    sampling.start(int(args.sample * 1000))
+    QTimer.singleShot(int(args.minutes * 60 * 1000), app.quit)
+    app.exec()
+    stop_threads(stop, threads)
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write(",".join(sampler.samples[0]) + "\n")
+            for row in sampler.samples:
+                f.write(",".join(str(v) for v in row.values()) + "\n")
+
+    failed = trend_failures(sampler.samples, args.warmup)
+    for line in failed:
+        sys.__stdout__.write(f"LEAK? {line}\n")
+    sys.__stdout__.write("FAIL\n" if failed else "OK\n")
+    return 1 if failed else 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=120.0, help="длительность прогона")
+    parser.add_argument("--sample", type=float, default=30.0, help="сек между замерами")
+    parser.add_argument("--warmup", type=float, default=120.0, help="сек прогрева без оценки трендов")
+    parser.add_argument("--churn", type=float, default=0.2, help="сек между действиями в браузере")
+    parser.add_argument("--clicks", type=float, default=1.0, help="сек между кликами по панели")
+    parser.add_argument("--tabs", type=int, default=150, help="вкладок в начале")
+    parser.add_argument("--browsers", type=int, default=2, help="сколько расширений подключить")
+    parser.add_argument("--csv", help="сохранить замеры в CSV")
+    parser.add_argument("--bench-tabs", type=int, help="только замерить первую отрисовку N вкладок")
+    parser.add_argument("--log", default=os.devnull, help="куда писать лог main.py (по умолчанию — никуда)")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    main.network_manager = QNetworkAccessManager()
+    # Подробный лог main.py за часы не нужен; замеры идут в sys.__stdout__
+    with open(args.log, "w") as log, contextlib.redirect_stdout(log):
+        window = main.SidebarApp()
+        window.show()
+        if args.bench_tabs:
+            code = render_bench(app, window, args.bench_tabs)
+        else:
+            code = soak(app, window, args)
+        window.close()
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
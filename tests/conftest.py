@@ -0,0 +1,14 @@
+"""Общее для тестов: main.py из корня репозитория и offscreen-QApplication."""
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt6.QtWidgets import QApplication
+
+
+@pytest.fixture(scope="session", autouse=True)
+def app():
+    return QApplication.instance() or QApplication([])
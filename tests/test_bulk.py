@@ -0,0 +1,59 @@
+"""BulkOperations: какие вкладки попадают в массовые операции."""
+import time
+
+import main
+
+HOUR = 3600
+
+
+def make_client(tabs):
+    client = main.ClientState("k", "K")
+    client.index.update(client.store.apply({"tabs": tabs, "groups": []}))
+    return client
+
+
+def tab(tid, url, **extra):
+    return dict({"id": tid, "url": url}, **extra)
+
+
+def test_duplicates_keep_active_or_first_copy():
+    client = make_client([
+        tab(1, "https://a.com/x"), tab(2, "https://a.com/x#"), tab(3, "https://a.com/x"),
+        tab(4, "https://b.com/"), tab(5, "https://b.com/", active=True),
+        tab(6, "https://c.com/", pinned=True), tab(7, "https://c.com/"),
+        tab(8, "https://d.com/#inbox"), tab(9, "https://d.com/#sent"),
+    ])
+    bulk = main.BulkOperations(client)
+    # Пустой «#» — та же страница, #inbox и #sent — разные; закреплённая не закрывается
+    assert sorted(bulk.duplicates()) == [2, 3, 4, 7]
+
+
+def test_from_domain_ignores_www_and_pinned():
+    client = make_client([tab(1, "https://www.a.com/"), tab(2, "https://a.com/x"),
+                          tab(3, "https://a.com/y", pinned=True), tab(4, "https://sub.a.com/")])
+    assert sorted(main.BulkOperations(client).from_domain("a.com")) == [1, 2]
+    assert main.BulkOperations(client).from_domain("none.com") == []
+
+
+def test_older_than_skips_active_and_pinned():
+    now_ms = time.time() * 1000
+    client = make_client([
+        tab(1, "https://a.com/", lastAccessed=now_ms - 5 * HOUR * 1000),
+        tab(2, "https://b.com/", lastAccessed=now_ms - 60 * 1000),
+        tab(3, "https://c.com/", lastAccessed=now_ms - 5 * HOUR * 1000, active=True),
+        tab(4, "https://d.com/", lastAccessed=now_ms - 5 * HOUR * 1000, pinned=True),
+    ])
+    assert main.BulkOperations(client).older_than(HOUR) == [1]
+
+
+def test_sorted_by_domain_only_loose_tabs():
+    client = make_client([
+        tab(1, "https://p.com/", pinned=True), tab(2, "https://c.com/"),
+        tab(3, "https://g.com/", groupId=7), tab(4, "https://www.a.com/z"),
+        tab(5, "https://a.com/b"),
+    ])
+    bulk = main.BulkOperations(client)
+    assert bulk.sorted_by_domain() == [5, 4, 2]
+    already = make_client([tab(1, "https://a.com/"), tab(2, "https://b.com/"),
+                           tab(3, "https://z.com/", groupId=7)])
+    assert main.BulkOperations(already).sorted_by_domain() == []
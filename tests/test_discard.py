@@ -0,0 +1,61 @@
+"""DiscardPolicy: кого и когда выгружать из памяти."""
+import time
+
+import pytest
+
+import main
+
+HOUR = 3600
+
+
+def make_client(tabs, memory_free=None):
+    client = main.ClientState("k", "K")
+    client.memory_free = memory_free
+    client.index.update(client.store.apply({"tabs": tabs, "groups": []}))
+    return client
+
+
+def tab(tid, idle, **extra):
+    return dict({"id": tid, "url": f"https://s{tid}.example/",
+                 "lastAccessed": (time.time() - idle) * 1000}, **extra)
+
+
+def planned(policy, client):
+    return [t.id for t, _reason in policy.plan(client)]
+
+
+def test_only_excess_idle_tabs_oldest_first():
+    client = make_client([tab(1, 5 * HOUR), tab(2, 60), tab(3, 9 * HOUR), tab(4, 2 * HOUR)])
+    policy = main.DiscardPolicy(max_loaded=2, min_idle=HOUR)
+    assert planned(policy, client) == [3, 1]
+    assert planned(main.DiscardPolicy(max_loaded=4, min_idle=HOUR), client) == []
+
+
+def test_exemptions():
+    client = make_client([tab(1, 9 * HOUR, active=True), tab(2, 9 * HOUR, pinned=True),
+                          tab(3, 9 * HOUR, audible=True), tab(4, 9 * HOUR, groupId=5),
+                          tab(5, 9 * HOUR, discarded=True), tab(6, 9 * HOUR)])
+    assert planned(main.DiscardPolicy(max_loaded=0, min_idle=HOUR), client) == [4, 6]
+    strict = main.DiscardPolicy(max_loaded=0, min_idle=HOUR, exempt_grouped=True,
+                                exempt_pinned=False, exempt_audible=False)
+    assert sorted(planned(strict, client)) == [2, 3, 6]
+
+
+def test_memory_pressure_halves_limit_and_idle():
+    tabs = [tab(i, 10 * 60) for i in range(1, 7)]
+    policy = main.DiscardPolicy(max_loaded=4, min_idle=HOUR)
+    assert planned(policy, make_client(tabs, memory_free=0.5)) == []
+    low = make_client(tabs, memory_free=main.DISCARD_MEMORY_PRESSURE / 2)
+    plan = policy.plan(low)
+    assert len(plan) == 4 and all("мало памяти" in reason for _t, reason in plan)
+
+
+@pytest.mark.parametrize("dry_run, sent", [(True, []), (False, [[1]])])
+def test_dry_run_only_reports(monkeypatch, dry_run, sent):
+    commands = []
+    monkeypatch.setattr(main, "DISCARD_DRY_RUN", dry_run)
+    monkeypatch.setattr(main, "send_command", lambda client, action, **f: commands.append(f["ids"]))
+    client = make_client([tab(1, 9 * HOUR), tab(2, 60, active=True)])
+    policy = main.DiscardPolicy(max_loaded=1, min_idle=HOUR)
+    policy.run(client, policy.plan(client))
+    assert commands == sent
@@ -0,0 +1,58 @@
+"""GroupRules.match: индекс доменов и общий фильтр по заголовку и url."""
+import main
+
+
+def rec(url, title=""):
+    return main.TabRecord({"id": 1, "url": url, "title": title})
+
+
+def group_of(rules, url, title=""):
+    rule = rules.match(rec(url, title), main.url_domain(url))
+    return rule and rule.group
+
+
+def test_exact_domain_vs_suffix():
+    rules = main.GroupRules([{"group": "Exact", "domain": "www.example.com"},
+                             {"group": "Docs", "domain": "*.python.org"}])
+    assert group_of(rules, "https://example.com/") == "Exact"
+    assert group_of(rules, "https://sub.example.com/") is None
+    assert group_of(rules, "https://python.org/") == "Docs"
+    assert group_of(rules, "https://docs.python.org/3/") == "Docs"
+    assert group_of(rules, "https://a.b.python.org/") == "Docs"
+    assert group_of(rules, "https://notpython.org/") is None
+
+
+def test_first_rule_wins_across_indexes():
+    rules = main.GroupRules([{"group": "Tickets", "title": r"JIRA-\d+"},
+                             {"group": "Work", "domain": "*.corp.com"},
+                             {"group": "Wiki", "domain": "wiki.corp.com", "url": "/page/"}])
+    assert group_of(rules, "https://wiki.corp.com/page/1", "JIRA-7 spec") == "Tickets"
+    assert group_of(rules, "https://wiki.corp.com/page/1", "spec") == "Work"
+    assert group_of(rules, "https://jira.corp.com/", "dashboard") == "Work"
+
+
+def test_title_prefilter():
+    rules = main.GroupRules([{"group": "Tickets", "title": r"JIRA-\d+"},
+                             {"group": "Video", "title": "watch", "url": r"youtube\.com/watch"}])
+    assert rules.title_any is not None and not rules.title_free
+    assert group_of(rules, "https://x.com/", "nothing here") is None
+    assert group_of(rules, "https://x.com/", "jira-12") == "Tickets"
+    # Общий фильтр пропустил заголовок, но url правила Video не совпал
+    assert group_of(rules, "https://vimeo.com/watch", "Watch later") is None
+    assert group_of(rules, "https://youtube.com/watch?v=1", "Watch later") == "Video"
+
+
+def test_rule_without_title_condition_bypasses_title_filter():
+    rules = main.GroupRules([{"group": "Tickets", "title": r"JIRA-\d+"},
+                             {"group": "Video", "url": r"youtube\.com/watch"}])
+    assert rules.title_free
+    assert group_of(rules, "https://youtube.com/watch?v=1", "any title") == "Video"
+
+
+def test_backreferences_fall_back_to_single_rules():
+    rules = main.GroupRules([{"group": "Dup", "title": r"(\w+) \1"},
+                             {"group": "Other", "title": r"(x)\1"}])
+    assert rules.title_any is None        # в склейке \1 второго правила — группа первого
+    assert group_of(rules, "https://a.com/", "bye bye") == "Dup"
+    assert group_of(rules, "https://a.com/", "xx") == "Other"
+    assert group_of(rules, "https://a.com/", "bye") is None
@@ -0,0 +1,20 @@
+"""HistoryStore: недоступная база отключает журнал, а не копит очередь."""
+import main
+
+
+def test_unusable_db_disables_recording(tmp_path):
+    path = tmp_path / "history.sqlite3"
+    path.mkdir()                          # на месте файла — каталог: sqlite его не откроет
+    history = main.HistoryStore(str(path))
+    history.start()
+    thread = history.thread
+    thread.join(5)
+    assert not thread.is_alive()
+    assert history.thread is None
+
+    rec  = main.TabRecord({"id": 1, "url": "https://a.com/", "title": "a", "active": True})
+    diff = main.SnapshotDiff()
+    diff.added.append(rec)
+    history.record("k", diff, opened=[rec], closed=[rec])
+    assert history.queue.empty()
+    history.close()
@@ -0,0 +1,88 @@
+"""IconStore: повтор потерянных get_icons, уборка ожидающих, LRU и кэш неудач."""
+from types import SimpleNamespace
+
+import pytest
+from PyQt6.QtGui import QPixmap
+
+import main
+
+
+class Waiter(main.QWidget):
+    """Минимальный «виджет вкладки»: то, что IconStore читает у TabWidget."""
+
+    def __init__(self, digest, client_key="k"):
+        super().__init__()
+        self.icon_key   = digest
+        self.client_key = client_key
+        self.icon_label = main.QLabel(self)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, "send_command",
+                        lambda client, action, **f: sent.append((client, f["digests"])))
+    monkeypatch.setattr(main, "icon_cache", main.OrderedDict())
+    now = [1000.0]
+    store = main.IconStore(clock=lambda: now[0])
+    store.sent, store.now = sent, now
+    yield store
+    main.signals.icons_received.disconnect(store.on_icons)
+
+
+def test_lost_reply_is_retried_then_given_up(store):
+    w = Waiter("d1")
+    store.request("k", "d1", w)
+    store.flush()
+    assert store.sent == [("k", ["d1"])]
+    assert store.retry_timer.isActive()
+
+    for attempt in range(main.ICON_MAX_RETRIES):
+        store.now[0] += main.ICON_RETRY_INTERVAL
+        store.retry()
+        store.flush()
+        assert len(store.sent) == attempt + 2
+    store.now[0] += main.ICON_RETRY_INTERVAL
+    store.retry()
+    assert store.requested == {} and store.waiting == {}
+    assert not store.retry_timer.isActive()
+    assert main.cached_icon("d1").isNull()   # неудача запомнена
+
+
+def test_abandoned_request_is_dropped(store):
+    w = Waiter("d1")
+    store.request("k", "d1", w)
+    store.flush()
+    w.icon_key = "d2"              # вкладка сменила иконку, d1 больше не нужна
+    store.now[0] += main.ICON_RETRY_INTERVAL
+    store.retry()
+    store.flush()
+    assert store.sent == [("k", ["d1"])]
+    assert "d1" not in store.requested and "d1" not in store.waiting
+
+
+def test_icon_cache_is_lru(store, monkeypatch):
+    monkeypatch.setattr(main, "ICON_CACHE_LIMIT", 2)
+    pixmap = QPixmap(16, 16)
+    store._deliver("a", pixmap)
+    store._deliver("b", pixmap)
+    assert main.cached_icon("a") is not None     # «a» свежее «b»
+    store._deliver("c", pixmap)
+    assert list(main.icon_cache) == ["a", "c"]
+
+
+
+def test_failed_icon_is_not_requested_again(store):
+    w = Waiter("bad")
+    store.request("k", "bad", w)
+    store.flush()
+    store.on_icons("k", {"bad": "data:image/png;base64,bm90IGFuIGltYWdl"})
+    assert main.cached_icon("bad").isNull()
+    assert store.requested == {} and store.waiting == {}
+
+    # Новая вкладка с той же иконкой сразу рисует иконку по умолчанию
+    panel = SimpleNamespace(icons=store)
+    tab = main.TabWidget(main.TabRecord({"id": 1, "icon": "bad"}), panel, "k")
+    store.flush()
+    assert store.sent == [("k", ["bad"])]
+    assert not tab.icon_label.pixmap().isNull()
@@ -0,0 +1,41 @@
+"""ClientConnection.negotiate: подписка из того, что умеет расширение."""
+import asyncio
+
+import main
+
+
+class FakeSocket:
+    remote_address = ("127.0.0.1", 1)
+
+
+def negotiate(capabilities):
+    async def run():
+        client = main.ClientConnection(FakeSocket())
+        try:
+            return client.negotiate(capabilities), client.reports_lifecycle
+        finally:
+            client.writer.cancel()
+    return asyncio.run(run())
+
+
+def test_old_extension_gets_full_subscription():
+    sub, lifecycle = negotiate(None)
+    assert sub == {'fields': list(main.SNAPSHOT_FIELDS), 'windows': main.SNAPSHOT_WINDOWS,
+                   'events': list(main.SNAPSHOT_EVENTS)}
+    assert not lifecycle
+
+
+def test_subscription_is_intersection_in_app_order(capsys):
+    sub, lifecycle = negotiate({'fields': ['url', 'id', 'title', 'extra'],
+                                'events': ['lifecycle', 'created', 'unknown']})
+    assert sub['fields'] == ['id', 'title', 'url']
+    assert sub['events'] == ['created', 'lifecycle']
+    assert lifecycle
+    assert "does not send fields: active, audible" in capsys.readouterr().out
+
+
+def test_windows_fall_back_to_current(monkeypatch):
+    monkeypatch.setattr(main, "SNAPSHOT_WINDOWS", "all")
+    assert negotiate({'windows': ['current']})[0]['windows'] == "current"
+    assert negotiate({'windows': ['current', 'all']})[0]['windows'] == "all"
+    assert negotiate({})[0]['windows'] == "all"
@@ -0,0 +1,49 @@
+"""Оптимистичные операции: значение считается от видимого состояния панели."""
+from types import SimpleNamespace
+
+import main
+
+
+def test_second_pin_toggle_before_snapshot_unpins():
+    client = main.ClientState("k", "K")
+    client.store.apply({"tabs": [{"id": 1, "url": "https://a.example/"},
+                                 {"id": 2, "url": "https://b.example/"}], "groups": []})
+    panel = SimpleNamespace(clients={"k": client}, force_update=False,
+                            update_timer=SimpleNamespace(start=lambda ms: None))
+
+    main.SidebarApp.apply_optimistic(panel, "k", "pin", [2])
+    tabs, _ = client.view()
+    assert [t.id for t in tabs if t.pinned] == [2]
+
+    main.SidebarApp.apply_optimistic(panel, "k", "pin", [2])
+    tabs, _ = client.view()
+    assert not any(t.pinned for t in tabs)
+    assert [op.value for op in client.pending_ops] == [True, False]
+
+
+def view(tabs, op):
+    client = main.ClientState("k", "K")
+    client.store.apply({"tabs": tabs, "groups": [{"id": 7, "title": "G"}]})
+    return [(t.id, t.group_id, t.pinned) for t in op.apply(client.store.tabs)]
+
+
+WINDOW = [{"id": 1, "url": "https://a.example/", "pinned": True},
+          {"id": 2, "url": "https://b.example/", "groupId": 7},
+          {"id": 3, "url": "https://c.example/", "groupId": 7},
+          {"id": 4, "url": "https://d.example/"},
+          {"id": 5, "url": "https://e.example/"}]
+
+
+def test_pinning_leaves_the_group():
+    assert view(WINDOW, main.OptimisticOp("pin", [3], True)) == \
+        [(1, -1, True), (3, -1, True), (2, 7, False), (4, -1, False), (5, -1, False)]
+
+
+def test_added_tab_moves_after_last_group_member():
+    assert view(WINDOW, main.OptimisticOp("group", [5], 7)) == \
+        [(1, -1, True), (2, 7, False), (3, 7, False), (5, 7, False), (4, -1, False)]
+
+
+def test_removed_tab_moves_right_after_its_group():
+    assert view(WINDOW, main.OptimisticOp("group", [2], -1)) == \
+        [(1, -1, True), (3, 7, False), (2, -1, False), (4, -1, False), (5, -1, False)]
@@ -0,0 +1,59 @@
+"""QueryApi: разбор фильтров /tabs и выбор полей."""
+from urllib.parse import parse_qs
+
+import pytest
+
+import main
+
+TABS = [
+    {"id": 1, "title": "Python docs", "url": "https://docs.python.org/3/", "groupId": 5, "active": True},
+    {"id": 2, "title": "Inbox", "url": "https://www.mail.com/#inbox", "pinned": True},
+    {"id": 3, "title": "Tutorial", "url": "https://docs.python.org/3/tutorial/", "groupId": 5,
+     "discarded": True},
+    {"id": 4, "title": "Music", "url": "https://radio.example/", "audible": True},
+]
+
+
+@pytest.fixture
+def api():
+    api = main.QueryApi()
+    for key, tabs in (("chrome", TABS), ("edge", [{"id": 1, "title": "Edge", "url": "https://mail.com/"}])):
+        client = main.ClientState(key, key)
+        client.store.apply({"tabs": tabs, "groups": [{"id": 5, "title": "Docs", "color": "blue"}]})
+        api.publish(client)
+    return api
+
+
+def ids(api, qs):
+    return [(t["client"], t["id"]) for t in api.query_tabs(parse_qs(qs))]
+
+
+def test_filters(api):
+    assert ids(api, "client=chrome&domain=docs.python.org") == [("chrome", 1), ("chrome", 3)]
+    assert ids(api, "domain=mail.com") == [("chrome", 2), ("edge", 1)]     # без «www.»
+    assert ids(api, "client=chrome&group=5&discarded=0") == [("chrome", 1)]
+    assert ids(api, "q=TUTOR") == [("chrome", 3)]                         # заголовок или url
+    assert ids(api, "q=inbox&pinned=yes") == [("chrome", 2)]
+    assert ids(api, "audible=true") == [("chrome", 4)]
+    assert ids(api, "active=1&limit=1") == [("chrome", 1)]
+    assert ids(api, "limit=2") == [("chrome", 1), ("chrome", 2)]
+    assert ids(api, "client=nobody") == []
+    assert ids(api, "group=99") == []
+
+
+def test_fields(api):
+    tabs = api.query_tabs(parse_qs("client=chrome&group=5&fields=id,groupId,url"))
+    assert tabs == [
+        {"id": 1, "groupId": 5, "url": "https://docs.python.org/3/", "client": "chrome"},
+        {"id": 3, "groupId": 5, "url": "https://docs.python.org/3/tutorial/", "client": "chrome"},
+    ]
+    full = api.query_tabs(parse_qs("client=edge"))[0]
+    assert set(full) == set(main.TAB_FIELDS) | {"client"}
+    assert api.query_active(parse_qs("fields=title")) == [{"title": "Python docs", "client": "chrome"}]
+
+
+@pytest.mark.parametrize("qs", ["fields=id,bogus", "limit=many", "group=docs"])
+def test_bad_query_is_value_error(api, qs):
+    # Сервер отвечает на ValueError кодом 400
+    with pytest.raises(ValueError):
+        api.query_tabs(parse_qs(qs))
@@ -0,0 +1,65 @@
+"""Маршрутизация команд: владелец вкладки и отключение медленного клиента."""
+import asyncio
+
+import pytest
+
+import main
+
+
+class FakeSocket:
+    remote_address = ("127.0.0.1", 1)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    monkeypatch.setattr(main, "connected_clients", {})
+    monkeypatch.setattr(main, "tab_owners", {})
+
+    def connect(key, tab_ids):
+        socket = FakeSocket()
+        client = main.ClientConnection(socket)
+        client.key = key
+        main.connected_clients[socket] = client
+        client.claim_tabs([{"id": tid} for tid in tab_ids])
+        return client
+    return connect
+
+
+def run(test):
+    async def body():
+        await test()
+        for client in main.connected_clients.values():
+            client.writer.cancel()
+    asyncio.run(body())
+
+
+def test_same_tab_id_in_two_browsers(connect):
+    async def test():
+        chrome = connect("chrome", [1, 2])
+        edge   = connect("edge", [1, 3])
+        assert main.route_command({"action": "close", "id": 1, "client": "edge"}) == \
+            [(edge, {"action": "close", "id": 1})]
+        assert main.route_command({"action": "close", "id": 1, "client": "chrome"}) == \
+            [(chrome, {"action": "close", "id": 1})]
+        # Повторный снимок chrome не отнимает вкладку 1 у edge
+        chrome.claim_tabs([{"id": 1}])
+        assert main.tab_owners[("edge", 1)] is edge
+        edge.release()
+        assert ("edge", 1) not in main.tab_owners and ("chrome", 1) in main.tab_owners
+    run(test)
+
+
+def test_evicted_client_leaves_routing(connect):
+    async def test():
+        old = connect("chrome", [1])
+        new = connect("chrome", [1])
+        old.claim_tabs([{"id": 1}])        # вкладку последним прислало старое соединение
+        assert main.route_command({"action": "close", "id": 1, "client": "chrome"})[0][0] is old
+        old.evict("timeouts")
+        assert old not in main.connected_clients.values()
+        assert main.route_command({"action": "close", "id": 1, "client": "chrome"})[0][0] is new
+        assert main.route_command({"action": "close", "id": 1})[0][0] is new
+    run(test)
@@ -0,0 +1,28 @@
+"""RowBlocks: первая видимая строка по раскладке блоков."""
+from PyQt6.QtWidgets import QVBoxLayout, QWidget
+
+import main
+
+
+def test_row_at_finds_row_under_offset(monkeypatch):
+    monkeypatch.setattr(main, "ROW_BLOCK_SIZE", 8)
+    container = QWidget()
+    layout = QVBoxLayout(container)
+    layout.setContentsMargins(0, 0, 0, 0)
+    layout.setSpacing(0)
+    rows = main.RowBlocks(layout)
+    for i in range(30):
+        w = QWidget()
+        w.setFixedHeight(10)
+        rows.insertWidget(i, w)
+    container.show()
+    main.QApplication.processEvents()
+
+    assert rows.row_at(-5) == 0
+    assert rows.row_at(0) == 0
+    assert rows.row_at(10) == 0          # низ строки 0 ровно на границе
+    assert rows.row_at(11) == 1
+    assert rows.row_at(85) == 8          # первая строка второго блока
+    assert rows.row_at(299) == 29
+    assert rows.row_at(301) == rows.count()
+    assert rows.itemAt(rows.row_at(157)).widget() is rows.itemAt(15).widget()
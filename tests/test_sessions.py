@@ -0,0 +1,91 @@
+"""Сохранение и чтение сессий: полный круг и повреждённые файлы."""
+import gzip
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def session_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SESSION_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_client():
+    client = main.ClientState("k", "Chrome · ab")
+    client.store.apply({
+        "tabs": [{"id": 1, "url": "https://a.example/", "title": "A", "pinned": True},
+                 {"id": 2, "url": "https://b.example/", "title": "B", "groupId": 7},
+                 {"id": 3, "url": "", "title": "пустая"}],
+        "groups": [{"id": 7, "title": "Work", "color": "blue"}]})
+    return client
+
+
+def write_gz(path, payload):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(payload, f)
+
+
+def test_round_trip(session_dir):
+    path = main.save_session(make_client())
+    assert os.listdir(session_dir) == [os.path.basename(path)]     # без .part
+    session = main.load_session(path)
+    assert [t["url"] for t in session["tabs"]] == ["https://a.example/", "https://b.example/"]
+    assert session["tabs"][0]["pinned"] and session["tabs"][1]["group"] == "0"
+    assert session["groups"] == [{"key": "0", "title": "Work", "color": "blue"}]
+    assert main.list_sessions() == [path]
+
+
+def test_truncated_file_is_value_error(session_dir):
+    path = main.save_session(make_client())
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        main.load_session(path)
+
+
+@pytest.mark.parametrize("payload", [
+    [1, 2],
+    {"version": 1, "tabs": ["https://a.example/"]},
+    {"version": 1, "tabs": [{"title": "без url"}]},
+    {"version": 1, "tabs": [], "groups": [{"title": "без key"}]},
+    {"version": 2, "tabs": []},
+])
+def test_malformed_payload_is_value_error(session_dir, payload):
+    path = str(session_dir / "bad.json.gz")
+    write_gz(path, payload)
+    with pytest.raises(ValueError):
+        main.load_session(path)
+
+
+def test_failed_save_leaves_no_file(session_dir):
+    client = make_client()
+    client.store.tabs[1].title = {"не JSON"}   # запись падает посреди файла
+    with pytest.raises(TypeError):
+        main.save_session(client)
+    assert os.listdir(session_dir) == []
+
+
+def test_restore_of_damaged_session_reports_instead_of_raising(session_dir):
+    path = str(session_dir / "bad.json.gz")
+    with open(path, "wb") as f:
+        f.write(gzip.compress(b'{"version": 1, "tabs": [')[:20])
+    notices = []
+    panel = SimpleNamespace(show_notice=notices.append, restores={})
+    main.SidebarApp.restore_session(panel, "k", path)
+    assert panel.restores == {} and len(notices) == 1
+
+
+def test_save_error_is_reported(session_dir, monkeypatch):
+    monkeypatch.setattr(main, "SESSION_DIR", str(session_dir / "file"))
+    (session_dir / "file").write_text("не каталог")    # makedirs упадёт с OSError
+    notices = []
+    panel = SimpleNamespace(clients={"k": make_client()}, show_notice=notices.append)
+    main.SidebarApp.save_window_session(panel, "k")
+    assert notices == ["Не удалось сохранить сессию"]
@@ -0,0 +1,44 @@
+"""Сборка большого снимка из snapshot_part (как их шлёт background.js)."""
+import asyncio
+
+import main
+
+
+class FakeSocket:
+    remote_address = ("127.0.0.1", 1)
+
+
+def parts(seq, tabs, chunk=2, groups=()):
+    count = -(-len(tabs) // chunk)
+    return [dict({"type": "snapshot_part", "epoch": "e", "seq": seq, "part": p, "parts": count,
+                   "tabs": tabs[p * chunk:(p + 1) * chunk]},
+                  **({"groups": list(groups)} if p == 0 else {}))
+            for p in range(count)]
+
+
+def feed(messages):
+    async def run():
+        client = main.ClientConnection(FakeSocket())
+        try:
+            return [client.add_snapshot_part(m) for m in messages]
+        finally:
+            client.writer.cancel()
+    return asyncio.run(run())
+
+
+def test_parts_assemble_in_order():
+    tabs = [{"id": i} for i in range(5)]
+    results = feed(parts(1, tabs, groups=[{"id": 7}]))
+    assert results[:-1] == [None, None]
+    assert results[-1] == {"tabs": tabs, "groups": [{"id": 7}], "epoch": "e", "seq": 1}
+
+
+def test_gap_or_foreign_part_drops_assembly():
+    tabs = [{"id": i} for i in range(6)]
+    first, second = parts(1, tabs), parts(2, tabs)
+    # Потерялась средняя часть — снимок не собирается
+    assert feed([first[0], first[2]]) == [None, None]
+    # Новый снимок начался посреди старого — собирается только новый
+    results = feed([first[0], first[1]] + second)
+    assert results[-1]["seq"] == 2 and results[-1]["tabs"] == tabs
+    assert results[:-1] == [None] * 4
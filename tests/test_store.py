@@ -0,0 +1,25 @@
+"""TabStore: индексы снимка, в том числе состав групп."""
+import main
+
+
+def snap(*tabs):
+    return {"tabs": [dict({"url": f"https://s{t['id']}.example/"}, **t) for t in tabs],
+            "groups": [{"id": 7, "title": "G"}, {"id": 8, "title": "H"}]}
+
+
+def test_group_members_follow_regrouping_and_order():
+    store = main.TabStore()
+    store.apply(snap({"id": 1, "groupId": 7}, {"id": 2}, {"id": 3, "groupId": 7}))
+    assert store.group_members == {7: [1, 3]}
+    store.apply(snap({"id": 3, "groupId": 7}, {"id": 1, "groupId": 8}, {"id": 2, "groupId": 7}))
+    assert store.group_members == {7: [3, 2], 8: [1]}
+
+
+def test_group_members_reused_when_rows_do_not_move():
+    store = main.TabStore()
+    store.apply(snap({"id": 1, "groupId": 7}, {"id": 2}))
+    members = store.group_members
+    store.apply(snap({"id": 1, "groupId": 7, "title": "новый заголовок"}, {"id": 2}))
+    assert store.group_members is members
+    store.apply(snap({"id": 2}))
+    assert store.group_members == {} and members == {7: [1]}   # старый не тронут
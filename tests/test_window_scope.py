@@ -0,0 +1,102 @@
+"""Снимок покрывает одно окно: смена окна — не закрытие и не открытие вкладок."""
+import main
+
+WINDOW_A = [{"id": 1, "url": "https://a.example/1", "active": True},
+            {"id": 2, "url": "https://a.example/2"}]
+WINDOW_B = [{"id": 3, "url": "https://b.example/3", "active": True}]
+
+
+def make_client(reports_lifecycle=True):
+    client = main.ClientState("k", "K")
+    client.reports_lifecycle = reports_lifecycle
+    return client
+
+
+def snapshot(client, tabs):
+    diff = client.store.apply({"tabs": tabs, "groups": []})
+    return diff, client.lifecycle(diff)
+
+
+def ids(recs):
+    return sorted(rec.id for rec in recs)
+
+
+def test_window_switch_is_not_close_or_open():
+    client = make_client()
+    snapshot(client, WINDOW_A)
+    _, (opened, closed) = snapshot(client, WINDOW_B)
+    assert closed == []
+    assert opened == []          # вкладка другого окна, opened о ней не было
+    _, (opened, closed) = snapshot(client, WINDOW_A)
+    assert (opened, closed) == ([], [])
+
+
+def test_real_close_in_snapshot_and_out_of_scope():
+    client = make_client()
+    snapshot(client, WINDOW_A)
+    # Закрытие в текущем окне: closed приходит раньше снимка
+    assert client.tabs_closed([2]) == []
+    _, (_, closed) = snapshot(client, WINDOW_A[:1])
+    assert ids(closed) == [2]
+    # Закрытие в окне вне снимка
+    snapshot(client, WINDOW_B)
+    assert ids(client.tabs_closed([1])) == [1]
+    assert client.out_of_scope == {}
+
+
+def test_new_tab_is_open():
+    client = make_client()
+    snapshot(client, WINDOW_A)
+    client.tabs_opened([9])
+    _, (opened, _) = snapshot(client, WINDOW_A + [{"id": 9, "url": "https://n.example/"}])
+    assert ids(opened) == [9]
+    # Открыта в другом окне — «открытие», когда окно попадёт в снимок
+    client.tabs_opened([10])
+    _, (opened, _) = snapshot(client, [{"id": 10, "url": "https://m.example/"}])
+    assert ids(opened) == [10]
+
+
+def test_legacy_extension_treats_removal_as_close():
+    client = make_client(reports_lifecycle=False)
+    snapshot(client, WINDOW_A)
+    _, (_, closed) = snapshot(client, WINDOW_B)
+    assert ids(closed) == [1, 2]
+
+
+def test_history_skips_window_switch():
+    client = make_client()
+    store = main.HistoryStore(":memory:")
+    store.thread = object()      # без фонового потока: события остаются в очереди
+    diff, (opened, closed) = snapshot(client, WINDOW_A)
+    store.record("k", diff, opened, closed, initial=True)
+    diff, (opened, closed) = snapshot(client, WINDOW_B)
+    store.record("k", diff, opened, closed)
+    kinds = [e[3] for batch in list(store.queue.queue) for e in batch]
+    assert "open" not in kinds and "close" not in kinds
+    assert kinds.count("activate") == 2
+
+
+def test_auto_group_opt_out_survives_window_switch(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, "send_command", lambda client, action, **f: sent.append(f))
+    rules = main.GroupRules([{"group": "A", "domain": "a.example"}])
+    client = make_client()
+    groups = [{"id": 50, "title": "A"}]
+
+    def feed(tabs):
+        diff = client.store.apply({"tabs": tabs, "groups": groups})
+        _, closed = client.lifecycle(diff)
+        client.grouper.update(rules, diff, closed)
+
+    grouped = [dict(t, groupId=50) for t in WINDOW_A]
+    feed(grouped)
+    # Пользователь вынул вкладку 2 из группы
+    feed([grouped[0], dict(grouped[1], groupId=-1)])
+    assert 2 in client.grouper.opted_out
+    feed(WINDOW_B)
+    feed([grouped[0], dict(grouped[1], groupId=-1)])
+    assert sent == []
+    # Настоящее закрытие снимает отказ
+    assert client.tabs_closed([2]) == []
+    feed([grouped[0]])
+    assert 2 not in client.grouper.opted_out